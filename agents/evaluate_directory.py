@@ -1,5 +1,5 @@
-from utils import read_file
-import re
+from utils import read_file, save_string_to_txt, deferred_fsync
+from chapter_directory_parser import tokenize_blueprint
 from llm_adapters import create_llm_adapter
 
 
@@ -11,42 +11,24 @@ def split_novel_directory(chapters_per_file: int):
     # 读取Novel_directory.txt文件
     directory = read_file("./Novel_Output/Novel_directory.txt").strip()
     
-    # 按行分割
-    lines = directory.split('\n')
-    
-    # 识别章节边界
-    chapters = []
-    current_chapter = []
-    
-    for line in lines:
-        # 检查是否是新章节的开始
-        if re.match(r'^第\d+章', line):
-            # 如果当前章节不为空，将其添加到章节列表中
-            if current_chapter:
-                chapters.append('\n'.join(current_chapter))
-                current_chapter = []
-        # 将当前行添加到当前章节中
-        current_chapter.append(line)
-    
-    # 添加最后一个章节
-    if current_chapter:
-        chapters.append('\n'.join(current_chapter))
+    # 按章节切分
+    chapters = [entry.raw_text for entry in tokenize_blueprint(directory)]
     
     # 计算需要创建的文件数量
     total_chapters = len(chapters)
     num_files = (total_chapters + chapters_per_file - 1) // chapters_per_file
     
-    # 创建切分后的文件
-    for i in range(num_files):
-        start_index = i * chapters_per_file
-        end_index = min((i + 1) * chapters_per_file, total_chapters)
-        
-        # 提取章节内容
-        chapter_section = chapters[start_index:end_index]
-        
-        # 写入新文件
-        with open(f"./Novel_Output/Novel_directory_part_{i+1}.txt", "w", encoding="utf-8") as f:
-            f.write('\n\n'.join(chapter_section))
+    # 创建切分后的文件（原子写入，全部写完后统一fsync目录）
+    with deferred_fsync():
+        for i in range(num_files):
+            start_index = i * chapters_per_file
+            end_index = min((i + 1) * chapters_per_file, total_chapters)
+            
+            # 提取章节内容
+            chapter_section = chapters[start_index:end_index]
+            
+            # 写入新文件
+            save_string_to_txt('\n\n'.join(chapter_section), f"./Novel_Output/Novel_directory_part_{i+1}.txt")
     
     print(f"已将Novel_directory.txt切分为{num_files}个文件，每个文件包含{chapters_per_file}章。")
 
@@ -0,0 +1,123 @@
+# benchmark_blueprint.py
+# -*- coding: utf-8 -*-
+"""
+章节目录解析的微基准测试，输出各操作的解析吞吐量（MB/s）。
+
+用法：
+    python benchmark_blueprint.py                      # 合成 2000 章的目录
+    python benchmark_blueprint.py 20000                # 合成指定章数的目录
+    python benchmark_blueprint.py Novel_Output/Novel_directory.txt
+
+对照组为改用共享解析器之前各处内联的正则写法，用于比较。
+"""
+import re
+import sys
+import time
+import random
+from chapter_directory_parser import (
+    tokenize_blueprint, parse_chapter_blueprint, split_blueprint_entries,
+    blueprint_chapter_numbers, last_blueprint_entries
+)
+
+_WORDS = "林漾苏晚星黄浦江老城区艺术展共感通晓暴雨旧巷古玩市场木扳指记忆画面设计方案"
+
+
+def synthesize_blueprint(chapters: int, seed: int = 0) -> str:
+    """合成章节目录，"语言风格"/"章节类型"两种标签和多行简述混合出现"""
+    rng = random.Random(seed)
+
+    def sentence(length: int) -> str:
+        return "".join(rng.choice(_WORDS) for _ in range(length)) + "。"
+
+    blocks = []
+    for number in range(1, chapters + 1):
+        style_label = "语言风格" if number % 2 else "章节类型"
+        summary = sentence(80)
+        if number % 5 == 0:
+            summary += "\n" + sentence(40)
+        blocks.append(
+            f"第{number}章 - [{sentence(6)[:-1]}]\n"
+            f"本章定位：{sentence(8)}\n"
+            f"核心作用：{sentence(4)}\n"
+            f"{style_label}：{sentence(6)}\n"
+            f"衔接要素：{sentence(30)}\n"
+            f"本章简述：{summary}"
+        )
+    return "\n\n".join(blocks)
+
+
+# ---------------- 对照组：原来各处内联的正则 ----------------
+_LEGACY_SPLIT = r"(第\s*\d+\s*章.*?)(?=第\s*\d+\s*章|$)"
+
+
+def legacy_limit(text: str, limit: int = 50) -> str:
+    chapters = re.findall(_LEGACY_SPLIT, text, flags=re.DOTALL)
+    return "\n\n".join(chapters[-limit:]).strip()
+
+
+def legacy_chapter_numbers(text: str) -> list:
+    return [int(x) for x in re.findall(r"第\s*(\d+)\s*章", text)]
+
+
+def legacy_parse(text: str) -> list:
+    header = re.compile(r'^第\s*(\d+)\s*章\s*-\s*\[?(.*?)\]?$')
+    fields = [re.compile(rf'^{label}：\s*\[?(.*)\]?$') for label in ("本章定位", "核心作用", "语言风格", "衔接要素", "本章简述")]
+    results = []
+    for chunk in re.split(r'\n\s*\n', text.strip()):
+        lines = chunk.strip().splitlines()
+        if not lines:
+            continue
+        match = header.match(lines[0].strip())
+        if not match:
+            continue
+        values = [""] * len(fields)
+        for line in lines[1:]:
+            for i, pattern in enumerate(fields):
+                m = pattern.match(line.strip())
+                if m:
+                    values[i] = m.group(1).strip()
+                    break
+        results.append((int(match.group(1)), match.group(2), values))
+    return results
+
+
+def bench(name: str, func, text: str, repeat: int = 5) -> float:
+    """重复执行取最快一次，返回 MB/s"""
+    size_mb = len(text.encode('utf-8')) / (1024 * 1024)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - started)
+    throughput = size_mb / best if best > 0 else float("inf")
+    print(f"{name:<36}{best * 1000:>10.2f} ms{throughput:>10.1f} MB/s")
+    return throughput
+
+
+def main(argv: list) -> None:
+    if argv and not argv[0].isdigit():
+        with open(argv[0], 'r', encoding='utf-8') as f:
+            text = f.read()
+        source = argv[0]
+    else:
+        chapters = int(argv[0]) if argv else 2000
+        text = synthesize_blueprint(chapters)
+        source = f"合成目录（{chapters}章）"
+    size_mb = len(text.encode('utf-8')) / (1024 * 1024)
+    print(f"{source}：{size_mb:.2f} MB，{len(tokenize_blueprint(text))} 章\n")
+
+    print("共享解析器")
+    bench("tokenize_blueprint", tokenize_blueprint, text)
+    bench("parse_chapter_blueprint", parse_chapter_blueprint, text)
+    bench("split_blueprint_entries", split_blueprint_entries, text)
+    bench("blueprint_chapter_numbers", blueprint_chapter_numbers, text)
+    bench("last_blueprint_entries(50)", lambda t: last_blueprint_entries(t, 50), text)
+
+    print("\n对照组（原内联正则）")
+    bench("legacy parse (按空行分块+逐字段正则)", legacy_parse, text)
+    bench("legacy limit (DOTALL 切分)", legacy_limit, text)
+    bench("legacy chapter numbers", legacy_chapter_numbers, text)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
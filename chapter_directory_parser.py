@@ -1,7 +1,115 @@
 # chapter_blueprint_parser.py
 # -*- coding: utf-8 -*-
+"""
+章节目录（Novel_directory.txt）解析
+tokenize_blueprint() 用预编译的正则把目录切分为章节条目并同时解析各字段，
+所有需要按章切分/解析目录的地方（章节目录生成的续写与截断、提取最近章节目录、
+SQLite目录表、目录切分）都基于它，不再各自编写正则。
+
+条目格式：
+    第1章 - [章节标题]
+    本章定位：...
+    核心作用：...
+    语言风格：...        （早期的目录提示词使用"章节类型"，两者都解析为 suspense_level）
+    衔接要素：...
+    本章简述：...         （可以跨多行）
+标题前后的方括号、字段值外层的方括号会被去掉。
+"""
 import re
-
+from typing import Dict, List, NamedTuple
+from tracing import traced
+
+# 字段标签 -> 字段名
+FIELD_LABELS = {
+    "本章定位": "chapter_role",
+    "核心作用": "chapter_purpose",
+    "语言风格": "suspense_level",
+    "章节类型": "suspense_level",
+    "衔接要素": "connection_elements",
+    "本章简述": "chapter_summary",
+}
+
+FIELD_NAMES = ("chapter_role", "chapter_purpose", "suspense_level", "connection_elements", "chapter_summary")
+
+_BLANK = "[ \t\u3000]*"
+_LABEL = "|".join(FIELD_LABELS)
+# 章节标题行：第1章 - 标题 / 第1章 - [标题] / 第1章：标题 / 第 1 章 标题，"第"之前只能有空白字符。
+# 行首锚定写成紧跟的换行符而不是 re.M 下的 ^：以字面字符开头时正则引擎可以直接跳到候选位置，
+# ^ 则要在每个位置尝试一次（2000章的目录约慢5倍）；扫描前在文本开头补一个换行，使第一行也能匹配，
+# 补换行后匹配的起点（即该换行符）正好是标题行在原文中的行首位置
+_HEADER = re.compile(rf'\n{_BLANK}第{_BLANK}(\d+){_BLANK}章')
+_TITLE_SEPARATORS = "-—–:："
+# 行首的字段行，连同紧跟其后的续行（非空、且不是字段行或章节标题行）一起匹配
+_FIELD = re.compile(
+    rf'^{_BLANK}({_LABEL})[：:]'
+    rf'(.*(?:\n(?!{_BLANK}(?:(?:{_LABEL})[：:]|第{_BLANK}\d+{_BLANK}章)){_BLANK}\S.*)*)',
+    re.M
+)
+
+
+class BlueprintEntry(NamedTuple):
+    """目录中的一章：章节号、原始文本（去掉首尾空白）、解析出的字段"""
+    chapter_number: int
+    raw_text: str
+    fields: Dict[str, str]
+
+
+def _strip_brackets(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == "[" and value[-1] == "]":
+        return value[1:-1].strip()
+    return value
+
+
+def _field_value(value: str) -> str:
+    """字段值：第一行去掉外层方括号，续行逐行去掉首尾空白后接在后面"""
+    first, newline, rest = value.partition("\n")
+    first = first.strip()
+    if first[:1] == "[":
+        first = _strip_brackets(first)
+    if newline:
+        rest = "\n".join(line.strip() for line in rest.split("\n"))
+        first = f"{first}\n{rest}" if first else rest
+    return first
+
+
+def _title(blueprint_text: str, position: int) -> str:
+    """标题行中"第N章"之后的部分，去掉一个分隔符和外层方括号"""
+    line_end = blueprint_text.find("\n", position)
+    title = blueprint_text[position:line_end if line_end >= 0 else len(blueprint_text)].strip()
+    if title and title[0] in _TITLE_SEPARATORS:
+        title = title[1:]
+    return _strip_brackets(title)
+
+
+def tokenize_blueprint(blueprint_text: str) -> List[BlueprintEntry]:
+    """
+    扫描章节目录，按出现顺序返回所有章节条目。
+    先用预编译的正则找出所有章节标题行，章节原文按标题行的位置直接切片，
+    再在每章的范围内用一个多行正则取出字段行及其续行；逐行的判断都在正则引擎中完成。
+    第一个章节标题之前的内容被忽略，不属于任何已知字段的行只保留在原始文本中，
+    紧跟在字段后面的续行（如多行的本章简述）归入该字段，遇到空行结束。
+    """
+    # 补一个换行使第一行也能匹配 _HEADER，之后所有位置都在补换行后的文本上计算
+    text = "\n" + blueprint_text
+    headers = list(_HEADER.finditer(text))
+    ends = [header.start() for header in headers[1:]] + [len(text)]
+    entries: List[BlueprintEntry] = []
+    label_of = FIELD_LABELS.__getitem__
+    find_fields = _FIELD.findall
+    for header, end in zip(headers, ends):
+        fields = dict.fromkeys(FIELD_NAMES, "")
+        fields["chapter_title"] = _title(text, header.end())
+        for label, value in find_fields(text, header.end(), end):
+            value = value.strip()
+            if value[:1] == "[" or "\n" in value:
+                value = _field_value(value)
+            fields[label_of(label)] = value
+        entries.append(BlueprintEntry(int(header.group(1)), text[header.start():end].strip(), fields))
+    return entries
+
+
+@traced("parse.chapter_blueprint")
 def parse_chapter_blueprint(blueprint_text: str):
     """
     解析整份章节蓝图文本，返回一个列表，每个元素是一个 dict：
@@ -10,104 +118,49 @@ def parse_chapter_blueprint(blueprint_text: str):
       "chapter_title": str,
       "chapter_role": str,       # 本章定位
       "chapter_purpose": str,    # 核心作用
-      "suspense_level": str,     # 语言风格
+      "suspense_level": str,     # 语言风格 / 章节类型
       "connection_elements": str, # 衔接要素
       "chapter_summary": str     # 本章简述
     }
     """
-
-    # 先按空行进行分块，以免多章之间混淆
-    chunks = re.split(r'\n\s*\n', blueprint_text.strip())
-    results = []
-
-    # 兼容是否使用方括号包裹章节标题
-    # 例如：
-    #   第1章 - 紫极光下的预兆
-    # 或
-    #   第1章 - [紫极光下的预兆]
-    chapter_number_pattern = re.compile(r'^第\s*(\d+)\s*章\s*-\s*\[?(.*?)\]?$')
-
-    role_pattern     = re.compile(r'^本章定位：\s*\[?(.*)\]?$')
-    purpose_pattern  = re.compile(r'^核心作用：\s*\[?(.*)\]?$')
-    suspense_pattern = re.compile(r'^语言风格：\s*\[?(.*)\]?$')
-    connection_pattern = re.compile(r'^衔接要素：\s*\[?(.*)\]?$')
-    summary_pattern = re.compile(r'^本章简述：\s*\[?(.*)\]?$')
-
-    for chunk in chunks:
-        lines = chunk.strip().splitlines()
-        if not lines:
-            continue
-
-        chapter_number   = None
-        chapter_title    = ""
-        chapter_role     = ""
-        chapter_purpose  = ""
-        suspense_level   = ""
-        connection_elements = ""
-        chapter_summary  = ""
-
-        # 先匹配第一行（或前几行），找到章号和标题
-        header_match = chapter_number_pattern.match(lines[0].strip())
-        if not header_match:
-            # 不符合"第X章 - 标题"的格式，跳过
-            continue
-
-        chapter_number = int(header_match.group(1))
-        chapter_title  = header_match.group(2).strip()
-
-        # 从后面的行匹配其他字段
-        for line in lines[1:]:
-            line_stripped = line.strip()
-            if not line_stripped:
-                continue
-
-            m_role = role_pattern.match(line_stripped)
-            if m_role:
-                chapter_role = m_role.group(1).strip()
-                continue
-
-            m_purpose = purpose_pattern.match(line_stripped)
-            if m_purpose:
-                chapter_purpose = m_purpose.group(1).strip()
-                continue
-
-            m_suspense = suspense_pattern.match(line_stripped)
-            if m_suspense:
-                suspense_level = m_suspense.group(1).strip()
-                continue
-
-            m_connection = connection_pattern.match(line_stripped)
-            if m_connection:
-                connection_elements = m_connection.group(1).strip()
-                continue
-
-            m_summary = summary_pattern.match(line_stripped)
-            if m_summary:
-                chapter_summary = m_summary.group(1).strip()
-                continue
-
-        results.append({
-            "chapter_number": chapter_number,
-            # 章节标题
-            "chapter_title": chapter_title,
-            "chapter_role": chapter_role,
-            "chapter_purpose": chapter_purpose,
-            "suspense_level": suspense_level,
-            "connection_elements": connection_elements,
-            "chapter_summary": chapter_summary
-        })
-
+    results = [dict(fields, chapter_number=number) for number, _, fields in tokenize_blueprint(blueprint_text)]
     # 按照 chapter_number 排序后返回
     results.sort(key=lambda x: x["chapter_number"])
     return results
 
 
-def get_chapter_info_from_blueprint(blueprint_text: str, target_chapter_number: int):
+def split_blueprint_entries(blueprint_text: str) -> Dict[int, str]:
+    """把章节目录文本切分为 章节号 -> 该章原始文本"""
+    return {entry.chapter_number: entry.raw_text for entry in tokenize_blueprint(blueprint_text)}
+
+
+def renumber_entry_text(raw_text: str, chapter_number: int) -> str:
+    """把一章原始文本标题行中的章节号改为 chapter_number，其余内容不变"""
+    header, _, rest = raw_text.partition("\n")
+    header = re.sub(r'第\s*\d+\s*章', f'第{chapter_number}章', header, count=1)
+    return f"{header}\n{rest}" if rest else header
+
+
+def blueprint_chapter_numbers(blueprint_text: str) -> List[int]:
+    """目录中出现的所有章节号（按出现顺序），只扫描章节标题行"""
+    return [int(number) for number in _HEADER.findall("\n" + blueprint_text)]
+
+
+def last_blueprint_entries(blueprint_text: str, count: int) -> str:
+    """目录中最后 count 章的原始文本，以空行分隔；按标题行的位置直接切片"""
+    if count <= 0:
+        return ""
+    # 在补换行后的文本中，匹配起点正好是标题行在原文中的行首位置
+    starts = [match.start() for match in _HEADER.finditer("\n" + blueprint_text)][-count:]
+    ends = starts[1:] + [len(blueprint_text)]
+    return "\n\n".join(blueprint_text[start:end].strip() for start, end in zip(starts, ends))
+
+
+def find_chapter_info(all_chapters: list, target_chapter_number: int):
     """
-    在已经加载好的章节蓝图文本中，找到对应章号的结构化信息，返回一个 dict。
+    在 parse_chapter_blueprint 的解析结果中，找到对应章号的结构化信息，返回一个 dict。
     若找不到则返回一个默认的结构。
     """
-    all_chapters = parse_chapter_blueprint(blueprint_text)
     for ch in all_chapters:
         if ch["chapter_number"] == target_chapter_number:
             return ch
@@ -125,4 +178,12 @@ def get_chapter_info_from_blueprint(blueprint_text: str, target_chapter_number:
         "connection_elements": "",
         # 对应Novel_directory.txt中的本章简述
         "chapter_summary": ""
-    }
\ No newline at end of file
+    }
+
+
+def get_chapter_info_from_blueprint(blueprint_text: str, target_chapter_number: int):
+    """
+    在已经加载好的章节蓝图文本中，找到对应章号的结构化信息，返回一个 dict。
+    若找不到则返回一个默认的结构。
+    """
+    return find_chapter_info(parse_chapter_blueprint(blueprint_text), target_chapter_number)
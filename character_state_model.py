@@ -0,0 +1,265 @@
+# character_state_model.py
+# -*- coding: utf-8 -*-
+"""
+角色状态文档（character_state.txt）的结构化模型
+文档格式：
+    角色一：张三
+    [角色功能]
+    - ...
+    [触发或加深的事件]
+    - ...
+
+    角色二：李四
+    ...
+
+    新出场角色：
+    - ...
+parse_character_state() 逐行扫描一次，得到 角色 -> 分区 -> 条目 的模型，
+to_text() 按同样的格式序列化回文本；事件总结、增量更新都在模型上修改，耗时与文档长度成线性关系。
+角色编号支持任意中文数字（角色十一、角色二十三……）和阿拉伯数字。
+parse_state_delta() / apply_state_delta() 用于把模型输出的增量（新增事件、新出场角色）合并进模型。
+"""
+import re
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+EVENTS_SECTION = "触发或加深的事件"
+NEW_CHARACTERS_HEADER = "新出场角色："
+
+_CHARACTER_HEADER = re.compile(r'^角色([零〇一二两三四五六七八九十百\d]+)\s*[：:]\s*(.*)$')
+_SECTION_HEADER = re.compile(r'^\[(.+?)\]\s*$')
+_NEW_CHARACTERS_HEADER = re.compile(r'^新出场角色\s*[：:]\s*(.*)$')
+
+_DIGITS = "零一二三四五六七八九"
+
+
+def chinese_numeral(number: int) -> str:
+    """把正整数转换为中文数字（1 -> 一，11 -> 十一，23 -> 二十三，105 -> 一百零五）"""
+    if number < 10:
+        return _DIGITS[number]
+    if number < 20:
+        return "十" + (_DIGITS[number % 10] if number % 10 else "")
+    if number < 100:
+        return _DIGITS[number // 10] + "十" + (_DIGITS[number % 10] if number % 10 else "")
+    hundreds, rest = divmod(number, 100)
+    if rest == 0:
+        return _DIGITS[hundreds] + "百"
+    if rest < 10:
+        return _DIGITS[hundreds] + "百零" + _DIGITS[rest]
+    tens = chinese_numeral(rest)
+    # 一百一十五 而不是 一百十五
+    return _DIGITS[hundreds] + "百" + (("一" + tens) if rest < 20 else tens)
+
+
+@dataclass
+class Character:
+    """一个角色：编号（如"角色一"）、名称，以及按原顺序排列的分区（分区名 -> 条目行）"""
+    label: str
+    name: str
+    sections: Dict[str, List[str]] = field(default_factory=dict)
+
+    @property
+    def events(self) -> List[str]:
+        """[触发或加深的事件]下的条目行（含"- "前缀）"""
+        return self.sections.get(EVENTS_SECTION, [])
+
+    def set_events(self, events: List[str]) -> None:
+        self.sections[EVENTS_SECTION] = list(events)
+
+    def to_text(self, sections: Optional[List[str]] = None) -> str:
+        """序列化为文本，sections 指定时只输出这些分区"""
+        lines = [f"{self.label}：{self.name}"]
+        for section_name, items in self.sections.items():
+            if sections is not None and section_name not in sections:
+                continue
+            if section_name:
+                lines.append(f"[{section_name}]")
+            lines.extend(items)
+        return "\n".join(lines)
+
+
+@dataclass
+class CharacterState:
+    """整份角色状态文档"""
+    characters: List[Character] = field(default_factory=list)
+    new_characters: List[str] = field(default_factory=list)   # "新出场角色："下的条目行
+    preamble: List[str] = field(default_factory=list)         # 第一个角色之前的内容（一般为空）
+    has_new_characters_section: bool = False
+
+    def find(self, name: str) -> Optional[Character]:
+        for character in self.characters:
+            if character.name == name:
+                return character
+        return None
+
+    def by_name(self) -> Dict[str, Character]:
+        return {character.name: character for character in self.characters}
+
+    def add_character(self, name: str, sections: Optional[Dict[str, List[str]]] = None) -> Character:
+        """在末尾添加角色，编号顺延"""
+        character = Character(
+            label=f"角色{chinese_numeral(len(self.characters) + 1)}",
+            name=name,
+            sections=dict(sections or {})
+        )
+        self.characters.append(character)
+        return character
+
+    def events_text(self) -> str:
+        """只包含 角色X：名称 + [触发或加深的事件] 的文本，没有事件分区的角色跳过"""
+        return "\n\n".join(
+            character.to_text(sections=[EVENTS_SECTION])
+            for character in self.characters if EVENTS_SECTION in character.sections
+        )
+
+    def replace_events(self, other: "CharacterState") -> List[str]:
+        """用 other 中同名角色的事件列表替换本文档中的事件，返回找不到的角色名"""
+        index = self.by_name()
+        missing = []
+        for updated in other.characters:
+            if EVENTS_SECTION not in updated.sections:
+                continue
+            character = index.get(updated.name)
+            if character is None or EVENTS_SECTION not in character.sections:
+                missing.append(updated.name)
+                continue
+            character.set_events(updated.events)
+        return missing
+
+    def to_text(self) -> str:
+        blocks = []
+        if self.preamble:
+            blocks.append("\n".join(self.preamble))
+        blocks.extend(character.to_text() for character in self.characters)
+        if self.has_new_characters_section or self.new_characters:
+            blocks.append("\n".join([NEW_CHARACTERS_HEADER] + self.new_characters))
+        return "\n\n".join(blocks) + "\n"
+
+
+def parse_character_state(text: str) -> CharacterState:
+    """逐行解析角色状态文本"""
+    state = CharacterState()
+    current: Optional[Character] = None
+    current_items: Optional[List[str]] = None
+    in_new_characters = False
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        match = _NEW_CHARACTERS_HEADER.match(line)
+        if match:
+            in_new_characters = True
+            state.has_new_characters_section = True
+            current, current_items = None, None
+            if match.group(1):
+                state.new_characters.append(match.group(1))
+            continue
+        if in_new_characters:
+            state.new_characters.append(line)
+            continue
+
+        match = _CHARACTER_HEADER.match(line)
+        if match:
+            current = Character(label=f"角色{match.group(1)}", name=match.group(2).strip())
+            current_items = None
+            state.characters.append(current)
+            continue
+
+        match = _SECTION_HEADER.match(line)
+        if match and current is not None:
+            current_items = current.sections.setdefault(match.group(1).strip(), [])
+            continue
+
+        if current_items is not None:
+            current_items.append(line)
+        elif current is None:
+            state.preamble.append(line)
+        else:
+            # 角色名之后、第一个分区之前的内容，归入一个无名分区以免丢失
+            current_items = current.sections.setdefault("", [])
+            current_items.append(line)
+
+    return state
+
+
+class StateDeltaError(ValueError):
+    """增量更新内容无法解析或未通过校验"""
+
+
+def parse_state_delta(response_text: str) -> Dict[str, Any]:
+    """
+    从模型返回的文本中解析增量更新JSON并校验格式，返回
+    {"add_events": {角色名: [事件]}, "new_characters": [条目], "remove_new_characters": [名称]}
+    """
+    start, end = response_text.find("{"), response_text.rfind("}")
+    if start == -1 or end <= start:
+        raise StateDeltaError("返回内容中没有JSON对象")
+    try:
+        data = json.loads(response_text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise StateDeltaError(f"JSON解析失败: {e}")
+    if not isinstance(data, dict):
+        raise StateDeltaError("增量更新必须是JSON对象")
+
+    add_events = data.get("add_events") or {}
+    new_characters = data.get("new_characters") or []
+    remove_new_characters = data.get("remove_new_characters") or []
+    if not isinstance(add_events, dict) or not all(
+            isinstance(name, str) and isinstance(events, list) and all(isinstance(e, str) for e in events)
+            for name, events in add_events.items()):
+        raise StateDeltaError("add_events 必须是 角色名 -> 事件列表")
+    for key, value in (("new_characters", new_characters), ("remove_new_characters", remove_new_characters)):
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise StateDeltaError(f"{key} 必须是字符串列表")
+    return {
+        "add_events": add_events,
+        "new_characters": new_characters,
+        "remove_new_characters": remove_new_characters,
+    }
+
+
+def _as_item(text: str) -> str:
+    text = text.strip()
+    return text if text.startswith("-") else f"- {text}"
+
+
+def apply_state_delta(state: CharacterState, delta: Dict[str, Any]) -> List[str]:
+    """
+    把增量更新合并进角色状态（就地修改），返回实际新增的事件条目。
+    add_events 中出现文档里没有的角色时抛出 StateDeltaError，不做任何修改。
+    """
+    index = state.by_name()
+    unknown = [name for name in delta["add_events"] if name.strip() not in index]
+    if unknown:
+        raise StateDeltaError(f"add_events 中包含不存在的角色: {', '.join(unknown)}")
+
+    added = []
+    for name, events in delta["add_events"].items():
+        character = index[name.strip()]
+        existing = set(character.events)
+        merged = list(character.events)
+        for event in events:
+            item = _as_item(event)
+            if event.strip() and item not in existing:
+                merged.append(item)
+                existing.add(item)
+                added.append(item)
+        character.set_events(merged)
+
+    removed = {name.strip() for name in delta["remove_new_characters"] if name.strip()}
+    if removed:
+        state.new_characters = [
+            item for item in state.new_characters
+            if re.split(r'[：:]', item.lstrip("- ").strip(), 1)[0].strip() not in removed
+        ]
+    existing_new = set(state.new_characters)
+    for entry in delta["new_characters"]:
+        item = _as_item(entry)
+        if entry.strip() and item not in existing_new:
+            state.new_characters.append(item)
+            existing_new.add(item)
+            state.has_new_characters_section = True
+    return added
@@ -1,22 +1,29 @@
 # -*- coding: utf-8 -*-
 """
 角色状态总结模块
-用于每五章后对角色的"触发或加深的事件"进行总结
+角色的"触发或加深的事件"超过一定长度后进行总结压缩
 """
 
 import os
-import re
-import sys
 import logging
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import Dict, List, Optional
 from llm_adapters import create_llm_adapter
 from novel_generator.common import invoke_with_cleaning
-from utils import read_file, save_string_to_txt
+from tracing import traced
+from novel_generator.state_history import get_state_history
+from character_state_model import parse_character_state, Character, CharacterState, EVENTS_SECTION
+from novel_generator.workspace import get_workspace
+from novel_generator.executor import get_executor, in_worker_thread
+from database.call_context import llm_call_context, STAGE_CHARACTER_SUMMARY
+from database.token_estimator import global_token_estimator, estimate_tokens
+from database.budget import BudgetExceededError
 
 
 def extract_character_events(character_state_content: str) -> str:
     """
     从character_state.txt内容中提取"角色X："格式的角色及其"触发或加深的事件"部分
-    只提取[触发或加深的事件]部分，保持原有的文本格式，仅处理"新出场角色："之前的内容
+    只提取[触发或加深的事件]部分，保持原有的文本格式，不包含"新出场角色："部分
     
     Args:
         character_state_content: character_state.txt的完整内容
@@ -24,91 +31,12 @@ def extract_character_events(character_state_content: str) -> str:
     Returns:
         提取出的角色事件文本，格式：角色X：角色名 + [触发或加深的事件] + 事件列表
     """
-    # 先找到"新出场角色："的位置，只处理之前的内容
-    new_character_match = re.search(r'新出场角色：', character_state_content)
-    if new_character_match:
-        content_to_process = character_state_content[:new_character_match.start()]
-    else:
-        content_to_process = character_state_content
-    
-    result_parts = []
-    
-    # 按"角色X："分割内容
-    character_sections = re.split(r'(?=角色[一二三四五六七八九十]：)', content_to_process)
-    
-    for section in character_sections:
-        if not section.strip():
-            continue
-            
-        # 检查是否是"角色X："格式开头
-        lines = section.strip().split('\n')
-        if not (lines and lines[0].startswith('角色') and '：' in lines[0]):
-            continue
-            
-        # 查找"[触发或加深的事件]"部分
-        events_start_idx = -1
-        events_end_idx = len(lines)
-        
-        for i, line in enumerate(lines):
-            if '[触发或加深的事件]' in line:
-                events_start_idx = i
-                break
-        
-        if events_start_idx == -1:
-            continue  # 没找到事件部分，跳过该角色
-            
-        # 查找下一个"["开头的部分或下一个角色作为结束标志
-        for i in range(events_start_idx + 1, len(lines)):
-            line = lines[i].strip()
-            if line.startswith('[') or line.startswith('角色[一二三四五六七八九十]：'):
-                events_end_idx = i
-                break
-        
-        # 提取角色名称和事件部分
-        character_header = lines[0]  # 角色X：角色名
-        events_section = '\n'.join(lines[events_start_idx:events_end_idx])
-        
-        # 组合角色事件信息（只包含角色名和事件部分）
-        character_info = f"{character_header}\n{events_section}"
-        result_parts.append(character_info)
-    
-    return '\n\n'.join(result_parts)
+    return parse_character_state(character_state_content).events_text()
 
 
-def summarize_character_events_text(
-    character_events_text: str,
-    interface_format: str,
-    api_key: str,
-    base_url: str,
-    model_name: str,
-    temperature: float = 0.6,
-    max_tokens: int = 4000,
-    timeout: int = 600
-) -> str:
-    """
-    使用大模型对提取的角色事件文本进行总结
-    
-    Args:
-        character_events_text: 提取的角色事件文本
-        其他参数：LLM配置参数
-    
-    Returns:
-        总结后的事件文本
-    """
-    if not character_events_text.strip():
-        return character_events_text
-        
-    llm_adapter = create_llm_adapter(
-        interface_format=interface_format,
-        base_url=base_url,
-        model_name=model_name,
-        api_key=api_key,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        timeout=timeout
-    )
-    
-    prompt = f"""请对以下角色的[触发或加深的事件]进行总结。
+def build_events_summary_prompt(character_events_text: str) -> str:
+    """构造角色事件总结的提示词"""
+    return f"""请对以下角色的[触发或加深的事件]进行总结。
 
 原始内容：
 {character_events_text}
@@ -137,21 +65,101 @@ def summarize_character_events_text(
 
 请直接返回总结后的内容，保持原有格式："""
 
-    try:
-        summarized_text = invoke_with_cleaning(llm_adapter, prompt, purpose="总结角色状态")
-        
-        if summarized_text and summarized_text.strip():
-            # 移除开头和结尾的空白
-            return summarized_text.strip()
-        else:
-            logging.warning("角色事件总结失败，返回原始内容")
-            return character_events_text
-            
-    except Exception as e:
-        logging.error(f"总结角色事件时出错: {e}")
-        return character_events_text
+
+def _summarize_single_character(llm_adapter, character: Character, max_retries: int = 2) -> Optional[List[str]]:
+    """
+    总结单个角色的事件列表并校验：返回内容必须只包含该角色，事件非空且比原来短。
+    校验失败时重试，仍失败返回None（保留原事件）。
+    """
+    original_text = character.to_text(sections=[EVENTS_SECTION])
+    model_name = getattr(llm_adapter, 'model_name', None)
+    original_size = estimate_event_tokens(character, model_name)
+    prompt = build_events_summary_prompt(original_text)
+    for attempt in range(1, max_retries + 1):
+        summarized = parse_character_state(
+            invoke_with_cleaning(llm_adapter, prompt, purpose="总结角色状态")
+        )
+        events = []
+        if len(summarized.characters) == 1 and summarized.characters[0].name == character.name:
+            events = summarized.characters[0].events
+        if events and estimate_tokens("\n".join(events), model_name) < original_size:
+            return events
+        logging.warning(f"角色 '{character.name}' 的事件总结未通过校验（第{attempt}次）")
+    return None
+
+
+def summarize_characters_parallel(
+    characters: List[Character],
+    llm_adapter,
+    max_workers: int = 4,
+    max_retries: int = 2
+) -> Dict[str, List[str]]:
+    """
+    每个角色一次LLM调用，并发总结事件列表，耗时取决于最慢的角色而不是总输出长度。
+    返回 角色名 -> 总结后的事件列表，未通过校验的角色不包含在结果中（保留原事件）。
+    """
+    results = {}
+    if not characters:
+        return results
+    if in_worker_thread():
+        # 已在线程池任务中：再提交子任务并等待可能因线程池占满而死锁，改为逐个角色直接执行
+        logging.info("在线程池任务中总结角色事件，逐个角色执行")
+        for character in characters:
+            try:
+                events = _summarize_single_character(llm_adapter, character, max_retries)
+            except BudgetExceededError:
+                raise
+            except Exception as e:
+                logging.error(f"总结角色 '{character.name}' 的事件时出错: {e}")
+                continue
+            if events is not None:
+                results[character.name] = events
+        return results
+    # 提交到共享线程池（会复制调用上下文，使线程中的调用仍记在当前阶段和章节下），
+    # 同时进行中的角色不超过 max_workers 个，某个角色完成后再提交下一个
+    pool = get_executor()
+    remaining = list(characters)
+    pending = {}
+    while remaining or pending:
+        while remaining and len(pending) < max_workers:
+            character = remaining.pop(0)
+            pending[pool.submit(_summarize_single_character, llm_adapter, character, max_retries)] = character
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            character = pending.pop(future)
+            try:
+                events = future.result()
+            except BudgetExceededError:
+                # 预算用尽时不再提交其余角色，交给调用方暂停生成
+                raise
+            except Exception as e:
+                logging.error(f"总结角色 '{character.name}' 的事件时出错: {e}")
+                continue
+            if events is not None:
+                results[character.name] = events
+    return results
+
+
+# 单个角色[触发或加深的事件]的token数超过该值时进行压缩
+DEFAULT_EVENT_TOKEN_THRESHOLD = 1500
+
+
+def estimate_event_tokens(character: Character, model_name: Optional[str] = None) -> int:
+    """估算角色事件列表的token数"""
+    return estimate_tokens("\n".join(character.events), model_name)
 
 
+def find_oversized_characters(state: CharacterState, max_event_tokens: int,
+                              model_name: Optional[str] = None) -> List[Character]:
+    """事件列表超过 max_event_tokens 的角色，max_event_tokens 为0时返回所有有事件的角色"""
+    candidates = [character for character in state.characters if character.events]
+    sizes = global_token_estimator.estimate_batch(
+        ["\n".join(character.events) for character in candidates], model_name
+    )
+    return [character for character, size in zip(candidates, sizes) if size > max_event_tokens]
+
+
+@traced("stage.character_summary")
 def update_character_state_file(
     filepath: str,
     interface_format: str,
@@ -161,125 +169,86 @@ def update_character_state_file(
     chapter_num: int,
     temperature: float = 0.6,
     max_tokens: int = 4000,
-    timeout: int = 600
-):
+    timeout: int = 600,
+    max_event_tokens: int = 0,
+    max_workers: int = 4
+) -> List[str]:
     """
-    更新character_state.txt文件，对所有角色的"触发或加深的事件"进行总结
-    并保存一份以章节号命名的备份文件
+    更新character_state.txt文件，对"触发或加深的事件"超过 max_event_tokens 的角色进行总结
+    （max_event_tokens 为0时总结所有角色），并把总结后的状态追加到角色状态版本历史
     
     Args:
         filepath: Novel_Output目录路径
-        chapter_num: 当前章节号，用于命名备份文件
+        chapter_num: 当前章节号，记入版本历史
+        max_event_tokens: 触发压缩的事件token数阈值
+        max_workers: 同时总结的角色数
         其他参数：LLM配置参数
+
+    Returns:
+        被压缩的角色名称列表
     """
     character_state_file = os.path.join(filepath, "character_state.txt")
+    workspace = get_workspace(filepath)
     
-    if not os.path.exists(character_state_file):
+    if not workspace.exists(character_state_file):
         logging.warning(f"角色状态文件不存在: {character_state_file}")
-        return
+        return []
     
     try:
         # 读取原始角色状态
-        original_content = read_file(character_state_file)
+        original_content = workspace.read(character_state_file)
         if not original_content.strip():
             logging.warning("角色状态文件为空")
-            return
-        
-        # 提取角色事件文本
-        character_events_text = extract_character_events(original_content)
-        
-        if not character_events_text.strip():
-            logging.warning("未找到任何角色事件")
-            sys.exit(1)
+            return []
         
-        logging.info("找到角色事件，开始进行总结...")
+        # 解析为结构化模型，只提取超过阈值的角色的事件文本
+        state = parse_character_state(original_content)
+        oversized = find_oversized_characters(state, max_event_tokens, model_name)
+        if not oversized:
+            logging.info(f"没有角色的事件超过 {max_event_tokens} tokens，无需压缩")
+            return []
+        logging.info(f"找到 {len(oversized)} 个需要压缩的角色：{', '.join(c.name for c in oversized)}，开始进行总结...")
         
-        # 使用大模型进行总结
-        summarized_events_text = summarize_character_events_text(
-            character_events_text=character_events_text,
+        # 每个角色单独调用大模型并发总结，单个角色失败不影响其它角色
+        llm_adapter = create_llm_adapter(
             interface_format=interface_format,
-            api_key=api_key,
             base_url=base_url,
             model_name=model_name,
+            api_key=api_key,
             temperature=temperature,
             max_tokens=max_tokens,
             timeout=timeout
         )
-        
-        # 在原内容中替换角色事件部分
-        # 对每个角色的[触发或加深的事件]部分进行替换
-        updated_content = original_content
-        
-        # 解析总结概况后的内容，提取每个角色的事件部分
-        # 是一个列表，包含多个字符串，每个字符串表示一个角色
-        summarized_sections = re.split(r'(?=角色[一二三四五六七八九十]：)', summarized_events_text)
-        #print(f"summarized_sections: {summarized_sections}")
+        with llm_call_context(stage=STAGE_CHARACTER_SUMMARY, chapter_number=chapter_num):
+            summarized = summarize_characters_parallel(oversized, llm_adapter, max_workers=max_workers)
 
-        # 遍历每个角色
-        for section in summarized_sections:
-            # 跳过空的部分
-            if not section.strip():
-                continue
-            
-            # 验证是否以"角色X："格式开头
-            # 根据换行符\n进行切分
-            lines = section.strip().split('\n')
-            #print(f"lines: {lines}")
-            if not (lines and lines[0].startswith('角色') and '：' in lines[0]):
-                continue
-                
-            # 提取角色名称，例如从"角色一：顾清霜"中提取出"顾清霜"，用于在原文件中定位该角色
-            character_name = lines[0].split('：')[1].strip()
-            
-            # 找到新的事件列表
-            events_start = -1
-            for i, line in enumerate(lines):
-                if '[触发或加深的事件]' in line:
-                    # [触发或加深的事件]之后的元素都是具体事件
-                    events_start = i + 1
-                    break
-            
-            if events_start == -1:
-                continue
-                
-            # 提取新的事件列表
-            new_events_lines = lines[events_start:]
-            # 重新加入换行符
-            new_events_text = '\n'.join(new_events_lines)
-            
-            # 在原内容中找到该角色的[触发或加深的事件]部分并替换
-            # 使用正则表达式匹配该角色的事件部分，确保保持正确的换行符格式
-            character_pattern = rf'(角色[一二三四五六七八九十]：{re.escape(character_name)}.*?\[触发或加深的事件\]\n)(.*?)(?=\n\n角色[一二三四五六七八九十]：|\n\n新出场角色：|$)'
-            
-            # 执行替换[触发或加深的事件]操作
-            if re.search(character_pattern, updated_content, re.DOTALL):
-                # 确保新事件内容后面有正确的换行符以保持角色间的分隔
-                replacement_text = new_events_text
-                if not replacement_text.endswith('\n'):
-                    replacement_text += '\n'
-                
-                updated_content = re.sub(
-                    character_pattern,
-                    lambda m: m.group(1) + replacement_text,
-                    updated_content,
-                    flags=re.DOTALL
-                )
-                logging.info(f"角色 '{character_name}' 的[触发或加深的事件]替换完成")
+        # 用总结后的事件列表替换模型中同名角色的事件，其余分区保持不变
+        for character in oversized:
+            if character.name in summarized:
+                character.set_events(summarized[character.name])
             else:
-                logging.warning(f"未能找到角色 '{character_name}' 的[触发或加深的事件]部分进行替换")
+                logging.warning(f"角色 '{character.name}' 的事件总结失败，保留原有事件")
+        if not summarized:
+            return []
+        updated_content = state.to_text()
         
         # 保存更新后的内容到原文件
-        save_string_to_txt(updated_content, character_state_file)
+        workspace.write(character_state_file, updated_content)
         logging.info("角色状态文件更新完成")
         
-        # 保存一份以章节号命名的备份文件
-        backup_filename = f"character_state{chapter_num}.txt"
-        backup_file_path = os.path.join(filepath, backup_filename)
-        save_string_to_txt(updated_content, backup_file_path)
-        logging.info(f"已保存第{chapter_num}章角色状态备份文件: {backup_filename}")
+        # 总结前后的状态都记入版本历史（替代原来以章节号命名的备份文件），可随时回滚
+        history = get_state_history(filepath)
+        if history.latest() != original_content:
+            history.append(chapter_num, original_content)
+        version = history.append(chapter_num, updated_content)
+        logging.info(f"已记录第{chapter_num}章角色状态版本: {version}")
+        return [character.name for character in oversized if character.name in summarized]
         
+    except BudgetExceededError:
+        raise
     except Exception as e:
         logging.error(f"更新角色状态文件时出错: {e}")
+        return []
 
 
 if __name__ == "__main__":
@@ -7,6 +7,9 @@
 from .config_manager import Config, global_config, set_monitoring_enabled
 from .db_config import DatabaseConfig, LLMCallLogger, default_db_config, default_llm_logger  
 from .llm_monitor import LLMMonitor, global_llm_monitor
+from .call_context import llm_call_context, get_call_context
+from .budget import BudgetTracker, BudgetExceededError, global_budget_tracker, calculate_cost
+from .token_estimator import TokenEstimator, PromptTooLongError, global_token_estimator, estimate_tokens
 
 __all__ = [
     'Config',
@@ -17,5 +20,15 @@ __all__ = [
     'default_db_config',
     'default_llm_logger',
     'LLMMonitor',
-    'global_llm_monitor'
+    'global_llm_monitor',
+    'llm_call_context',
+    'get_call_context',
+    'BudgetTracker',
+    'BudgetExceededError',
+    'global_budget_tracker',
+    'calculate_cost',
+    'TokenEstimator',
+    'PromptTooLongError',
+    'global_token_estimator',
+    'estimate_tokens'
 ]
\ No newline at end of file
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+成本核算与预算控制
+根据模型价格表计算每次调用的费用，按章节累计，
+并依据最近若干章的平均花费预估整部小说的总花费；
+预计超出预算时对指定阶段降级模型（如 gemini-2.5-pro -> gemini-2.5-flash），
+已达到预算上限时暂停生成（抛出 BudgetExceededError）
+"""
+import logging
+import threading
+from typing import Dict, Any, Optional
+from .config_manager import global_config
+from .call_context import get_call_context
+
+
+# 默认价格表，单位：美元/百万token（input：未命中缓存的输入，cached_input：命中缓存的输入，output：输出）
+# 价格会随服务商调整，可在 llm_monitor_config.json 的 pricing 中覆盖或补充
+DEFAULT_MODEL_PRICING = {
+    "gemini-2.5-pro": {"input": 1.25, "cached_input": 0.31, "output": 10.0},
+    "gemini-2.5-flash": {"input": 0.30, "cached_input": 0.075, "output": 2.50},
+    "qwen-plus": {"input": 0.40, "cached_input": 0.16, "output": 1.20},
+    "doubao-seed-1-6-250615": {"input": 0.11, "cached_input": 0.022, "output": 1.10},
+    "doubao-seed-1-6-flash-250715": {"input": 0.02, "cached_input": 0.004, "output": 0.21},
+}
+
+
+class BudgetExceededError(RuntimeError):
+    """已达到预算上限，需要暂停生成"""
+
+
+def get_model_pricing(model_name: str) -> Optional[Dict[str, float]]:
+    """获取模型价格，配置文件中的 pricing 优先于默认价格表"""
+    configured = global_config.get('pricing', {}) or {}
+    return configured.get(model_name) or DEFAULT_MODEL_PRICING.get(model_name)
+
+
+def calculate_cost(model_name: str, prompt_tokens: int, completion_tokens: int,
+                   cached_tokens: int = 0) -> float:
+    """按价格表计算一次调用的费用，未知模型返回0"""
+    pricing = get_model_pricing(model_name)
+    if not pricing:
+        return 0.0
+    cached_tokens = min(cached_tokens or 0, prompt_tokens or 0)
+    uncached_tokens = (prompt_tokens or 0) - cached_tokens
+    cost = (
+        uncached_tokens * pricing.get("input", 0.0)
+        + cached_tokens * pricing.get("cached_input", pricing.get("input", 0.0))
+        + (completion_tokens or 0) * pricing.get("output", 0.0)
+    )
+    return cost / 1_000_000
+
+
+class BudgetTracker:
+    """
+    预算跟踪器，由 LLMMonitor 在每次调用成功后喂入usage。
+    配置项（llm_monitor_config.json 的 budget 部分）：
+      enabled           是否启用预算控制
+      max_cost          费用上限（美元），null表示不限
+      max_tokens        token上限，null表示不限
+      action            预计超支时的动作："downgrade" 降级模型，"pause" 暂停生成
+      downgrade_models  降级映射，如 {"gemini-2.5-pro": "gemini-2.5-flash"}
+      downgrade_stages  允许降级的流程阶段（见 call_context 中的 STAGE_*）
+      window_chapters   预估时参考最近多少章的平均花费
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.target_chapters = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """清空已累计的花费"""
+        with self._lock:
+            self.spent_cost = 0.0
+            self.spent_tokens = 0
+            # 章节号 -> {"cost": 费用, "tokens": token数}，不属于任何章节的调用（架构、目录）计入总数
+            self.chapter_usage: Dict[int, Dict[str, float]] = {}
+            self._downgrade_logged = set()
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        return global_config.get('budget', {}) or {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.settings.get('enabled', False))
+
+    def set_target_chapters(self, number_of_chapters: int) -> None:
+        """设置小说总章节数，用于预估完成全部章节的花费"""
+        self.target_chapters = number_of_chapters
+
+    def record(self, model_name: str, usage_info: Dict[str, int],
+               chapter_number: Optional[int] = None) -> float:
+        """累计一次调用的花费，返回本次费用"""
+        cost = calculate_cost(
+            model_name,
+            usage_info.get('prompt_tokens', 0),
+            usage_info.get('completion_tokens', 0),
+            usage_info.get('cached_tokens', 0)
+        )
+        tokens = usage_info.get('total_tokens', 0) or 0
+        with self._lock:
+            self.spent_cost += cost
+            self.spent_tokens += tokens
+            if chapter_number is not None:
+                usage = self.chapter_usage.setdefault(chapter_number, {"cost": 0.0, "tokens": 0})
+                usage["cost"] += cost
+                usage["tokens"] += tokens
+        return cost
+
+    def load_history(self, rows: list) -> None:
+        """
+        用历史调用记录初始化花费（断点续写时使用），
+        rows 为 LLMCallLogger.get_usage_by_chapter_model 的返回结果
+        """
+        self.reset()
+        for row in rows:
+            self.record(
+                row['model_name'],
+                {
+                    'prompt_tokens': int(row.get('prompt_tokens') or 0),
+                    'completion_tokens': int(row.get('completion_tokens') or 0),
+                    'cached_tokens': int(row.get('cached_tokens') or 0),
+                    'total_tokens': int(row.get('total_tokens') or 0),
+                },
+                row.get('chapter_number')
+            )
+
+    def projection(self) -> Dict[str, Optional[float]]:
+        """
+        根据最近 window_chapters 个已完成章节的平均花费预估完成全部章节时的总花费和总token。
+        当前章节（调用上下文中的章节号，未设置时为记录中最新的一章）仍在生成中，不参与平均；
+        还没有任何章节完成时 projected_cost / projected_tokens 为 None（不做预估）。
+        """
+        window = int(self.settings.get('window_chapters', 5) or 5)
+        current = get_call_context().get("chapter_number")
+        with self._lock:
+            chapters = sorted(self.chapter_usage)
+            spent_cost, spent_tokens = self.spent_cost, self.spent_tokens
+            if current is None:
+                completed = chapters[:-1]
+            else:
+                completed = [chapter for chapter in chapters if chapter < current]
+            recent = completed[-window:]
+            avg_cost = sum(self.chapter_usage[c]["cost"] for c in recent) / len(recent) if recent else 0.0
+            avg_tokens = sum(self.chapter_usage[c]["tokens"] for c in recent) / len(recent) if recent else 0.0
+            remaining = max(0, self.target_chapters - len(completed)) if self.target_chapters else 0
+        return {
+            "spent_cost": spent_cost,
+            "spent_tokens": spent_tokens,
+            "avg_chapter_cost": avg_cost,
+            "avg_chapter_tokens": avg_tokens,
+            "projected_cost": spent_cost + avg_cost * remaining if recent else None,
+            "projected_tokens": spent_tokens + avg_tokens * remaining if recent else None,
+        }
+
+    def _over(self, cost: float, tokens: float) -> bool:
+        """给定的费用/token是否超出配置的预算"""
+        max_cost = self.settings.get('max_cost')
+        max_tokens = self.settings.get('max_tokens')
+        return (max_cost is not None and cost >= max_cost) or \
+               (max_tokens is not None and tokens >= max_tokens)
+
+    def select_model(self, model_name: str, stage: Optional[str] = None) -> str:
+        """
+        按预估总花费选择本次调用实际使用的模型名：
+        - 预计超出预算：action 为 downgrade 且阶段允许时返回降级模型，否则抛出 BudgetExceededError
+        - 其余情况返回 model_name
+        """
+        if not self.enabled:
+            return model_name
+        stats = self.projection()
+        if stats["projected_cost"] is None or not self._over(stats["projected_cost"], stats["projected_tokens"]):
+            return model_name
+
+        settings = self.settings
+        if settings.get('action', 'downgrade') != 'downgrade':
+            raise BudgetExceededError(
+                f"预计总花费 ${stats['projected_cost']:.4f} 超出预算，暂停生成"
+            )
+        stage = stage or get_call_context().get("stage")
+        downgrade_to = (settings.get('downgrade_models') or {}).get(model_name)
+        if downgrade_to and stage in (settings.get('downgrade_stages') or []):
+            if (model_name, stage) not in self._downgrade_logged:
+                self._downgrade_logged.add((model_name, stage))
+                logging.warning(
+                    f"预计总花费 ${stats['projected_cost']:.4f} 超出预算，"
+                    f"阶段 {stage} 的模型由 {model_name} 降级为 {downgrade_to}"
+                )
+            return downgrade_to
+        return model_name
+
+    def before_call(self, model_name: str, prompt_tokens: int = 0) -> None:
+        """
+        调用前检查预算上限：已花费加上本次提示词（按实际调用的模型 model_name 估算的
+        prompt_tokens 及其费用）达到上限时抛出 BudgetExceededError
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            spent_cost, spent_tokens = self.spent_cost, self.spent_tokens
+        prompt_cost = calculate_cost(model_name, prompt_tokens, 0)
+        if self._over(spent_cost + prompt_cost, spent_tokens + prompt_tokens):
+            raise BudgetExceededError(
+                f"已达到预算上限：已花费 ${spent_cost:.4f}，{spent_tokens} tokens"
+                f"（本次提示词约 {prompt_tokens} tokens）"
+            )
+
+
+# 全局预算跟踪器实例
+global_budget_tracker = BudgetTracker()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+LLM调用上下文
+由生成流程设置 run_id / novel_id / stage / chapter_number，
+监控记录时自动读取，避免在 call_purpose 中拼接章节号
+"""
+import os
+import uuid
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+
+# 流程阶段（stage列取值）
+STAGE_ARCHITECTURE = "architecture"              # 角色、世界观、剧情架构
+STAGE_BLUEPRINT = "blueprint"                    # 章节目录
+STAGE_CHAPTER_SUMMARY = "chapter_summary"        # 正文前的当前章节摘要
+STAGE_CHAPTER_DRAFT = "chapter_draft"            # 章节正文
+STAGE_FINALIZE_SUMMARY = "finalize_summary"      # 定稿：章节概括
+STAGE_FINALIZE_STATE = "finalize_state"          # 定稿：角色状态更新
+STAGE_CHARACTER_SUMMARY = "character_summary"    # 角色事件总结
+STAGE_RETRIEVAL_QUERY = "retrieval_query"        # 知识库检索查询改写（召回不足时）
+
+
+# 输出目录中保存小说ID的文件，首次生成时写入一次，续写时复用
+NOVEL_ID_FILENAME = "novel_id.txt"
+
+# 每次进程运行生成一个run_id，同一次运行中的所有调用共享
+_DEFAULT_RUN_ID = uuid.uuid4().hex
+
+_call_context: contextvars.ContextVar = contextvars.ContextVar(
+    "llm_call_context",
+    default={"run_id": _DEFAULT_RUN_ID, "novel_id": None, "stage": None, "chapter_number": None}
+)
+
+
+def load_novel_id(filepath: str) -> str:
+    """
+    读取输出目录中的小说ID，不存在时生成一个UUID写入 novel_id.txt。
+    同一部小说续写时ID不变，不同的小说即使使用同名的输出目录（如默认的 Novel_Output）也不会混在一起。
+    """
+    id_file = os.path.join(filepath, NOVEL_ID_FILENAME)
+    try:
+        with open(id_file, 'r', encoding='utf-8') as f:
+            novel_id = f.read().strip()
+        if novel_id:
+            return novel_id
+    except FileNotFoundError:
+        pass
+    novel_id = uuid.uuid4().hex
+    tmp_file = id_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(novel_id)
+    os.replace(tmp_file, id_file)
+    return novel_id
+
+
+def get_call_context() -> Dict[str, Any]:
+    """获取当前的调用上下文（返回副本）"""
+    return dict(_call_context.get())
+
+
+def bind_call_context(**fields) -> contextvars.Token:
+    """
+    直接在当前上下文中设置调用上下文字段（不自动恢复），返回可用于 reset 的 token。
+    适合在 asyncio.run() 的主协程开头调用，作用域即为该协程。
+    """
+    updated = get_call_context()
+    updated.update({k: v for k, v in fields.items() if v is not None})
+    return _call_context.set(updated)
+
+
+@contextmanager
+def llm_call_context(run_id: Optional[str] = None,
+                     novel_id: Optional[str] = None,
+                     stage: Optional[str] = None,
+                     chapter_number: Optional[int] = None):
+    """
+    在with块内设置调用上下文，未指定的字段继承外层上下文。
+    例如：
+        with llm_call_context(novel_id=load_novel_id("Novel_Output")):
+            with llm_call_context(stage=STAGE_CHAPTER_DRAFT, chapter_number=3):
+                llm_adapter.invoke(prompt)
+    """
+    updated = get_call_context()
+    for key, value in (("run_id", run_id), ("novel_id", novel_id),
+                       ("stage", stage), ("chapter_number", chapter_number)):
+        if value is not None:
+            updated[key] = value
+    token = _call_context.set(updated)
+    try:
+        yield updated
+    finally:
+        _call_context.reset(token)
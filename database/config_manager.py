@@ -4,24 +4,52 @@
 用于管理LLM监控功能和数据库连接等配置
 """
 import os
+import copy
 import json
+import time
 import logging
+import tempfile
+import threading
 from typing import Dict, Any, Optional
 
 
 class Config:
-    """配置管理类"""
+    """
+    配置管理类
+    - 配置保存在内存快照中，set() 只修改内存，需要持久化时显式调用 save()
+    - save() 先写临时文件再 os.replace，多进程并发读写时不会读到写了一半的文件
+    - 环境变量覆盖：LLM_MONITOR__<一级键>__<二级键>=值，如 LLM_MONITOR__LLM_MONITORING__ENABLED=false，
+      值按JSON解析，解析失败时作为字符串
+    - 配置文件被其它进程修改后（按mtime判断），下次 get() 时自动重新加载
+    优先级：默认配置 < 配置文件 < 环境变量 < set()
+    """
+
+    ENV_PREFIX = "LLM_MONITOR__"
+    # 检查配置文件mtime的最小间隔（秒），避免每次get()都stat文件
+    RELOAD_CHECK_INTERVAL = 1.0
     
     def __init__(self, config_file: str = "llm_monitor_config.json"):
         self.config_file = config_file
-        self.config_data = self._load_config()
-    
-    def _load_config(self) -> Dict[str, Any]:
-        """加载配置文件"""
-        default_config = {
+        self._lock = threading.RLock()
+        self._file_mtime_ns: Optional[int] = None
+        self._last_reload_check = 0.0
+        # 通过set()修改但尚未保存的值：点分割路径 -> 值
+        self._runtime_values: Dict[str, Any] = {}
+        self._file_data = self._load_config()
+        self.config_data = self._build_snapshot()
+
+    @staticmethod
+    def _default_config() -> Dict[str, Any]:
+        """默认配置"""
+        return {
             "llm_monitoring": {
                 "enabled": True,
-                "log_detailed_response": False
+                "log_detailed_response": False,   # 是否在 llm_call_payloads 中保存压缩后的提示词/响应
+                "payload_retention_days": 30,      # 提示词/响应正文保留天数，0表示不清理
+                "stream_responses": False,         # 流式接收响应以记录首token耗时
+                "payload_log_level": "DEBUG",      # 提示词/响应写入日志的级别
+                "payload_log_max_chars": 500,      # 写入日志时截断到的字符数，0表示不截断
+                "payload_log_sample_rate": 1.0     # 记录提示词/响应的调用比例
             },
             "database": {
                 "host": "localhost",
@@ -31,49 +59,144 @@ class Config:
                 "database": "novel_generator",
                 "charset": "utf8mb4"
             },
+            "budget": {
+                "enabled": False,
+                "max_cost": None,          # 费用上限（美元）
+                "max_tokens": None,        # token上限
+                "action": "downgrade",     # 预计超支时："downgrade" 降级模型 / "pause" 暂停生成
+                "downgrade_models": {"gemini-2.5-pro": "gemini-2.5-flash"},
+                "downgrade_stages": ["chapter_summary", "finalize_summary", "finalize_state", "character_summary", "retrieval_query"],
+                "window_chapters": 5       # 按最近几章的平均花费预估总花费
+            },
+            "pricing": {},                 # 覆盖 database.budget.DEFAULT_MODEL_PRICING 中的模型价格
+            "executor": {
+                "max_workers": 8           # 共享线程池大小，即全局同时进行的LLM调用/文件读写上限
+            },
             "logging": {
                 "level": "INFO",
-                "file": "llm_monitor.log"
+                "file": "llm_monitor.log",
+                "max_bytes": 10485760,     # 单个日志文件超过该大小时轮转
+                "backup_count": 5,         # 保留的轮转文件个数
+                "compress": True,          # 轮转出的文件gzip压缩
+                "stage_levels": {}         # 按流程阶段设置日志级别，如 {"chapter_draft": "DEBUG"}
             }
         }
-        
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    loaded_config = json.load(f)
-                # 合并默认配置和加载的配置
-                self._merge_config(default_config, loaded_config)
-                return default_config
-            except Exception as e:
-                logging.warning(f"加载配置文件失败，使用默认配置: {e}")
-                return default_config
-        else:
-            # 如果配置文件不存在，创建一个
-            self._save_config(default_config)
+
+    def _read_mtime_ns(self) -> Optional[int]:
+        """配置文件的mtime（纳秒），文件不存在时返回None"""
+        try:
+            return os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load_config(self) -> Dict[str, Any]:
+        """加载配置文件（默认配置 + 配置文件），文件不存在时只使用默认配置，不会创建文件"""
+        default_config = self._default_config()
+        self._file_mtime_ns = self._read_mtime_ns()
+        if self._file_mtime_ns is None:
             return default_config
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                loaded_config = json.load(f)
+            # 合并默认配置和加载的配置
+            self._merge_config(default_config, loaded_config)
+        except Exception as e:
+            logging.warning(f"加载配置文件失败，使用默认配置: {e}")
+        return default_config
+
+    def _env_overrides(self) -> Dict[str, Any]:
+        """读取 LLM_MONITOR__ 开头的环境变量，返回 点分割路径 -> 值"""
+        overrides = {}
+        for name, raw in os.environ.items():
+            if not name.startswith(self.ENV_PREFIX):
+                continue
+            key_path = '.'.join(part.lower() for part in name[len(self.ENV_PREFIX):].split('__') if part)
+            if not key_path:
+                continue
+            try:
+                overrides[key_path] = json.loads(raw)
+            except ValueError:
+                overrides[key_path] = raw
+        return overrides
+
+    @staticmethod
+    def _set_path(config: Dict[str, Any], key_path: str, value: Any) -> None:
+        """按点分割路径在字典中设置值，缺失的中间层级自动创建"""
+        keys = key_path.split('.')
+        for key in keys[:-1]:
+            if not isinstance(config.get(key), dict):
+                config[key] = {}
+            config = config[key]
+        config[keys[-1]] = value
+
+    def _build_snapshot(self, include_env: bool = True) -> Dict[str, Any]:
+        """按优先级合并出当前生效的配置"""
+        snapshot = copy.deepcopy(self._file_data)
+        if include_env:
+            for key_path, value in self._env_overrides().items():
+                self._set_path(snapshot, key_path, value)
+        for key_path, value in self._runtime_values.items():
+            self._set_path(snapshot, key_path, value)
+        return snapshot
+
+    def _reload_if_changed(self) -> None:
+        """配置文件mtime变化时重新加载"""
+        now = time.monotonic()
+        if now - self._last_reload_check < self.RELOAD_CHECK_INTERVAL:
+            return
+        self._last_reload_check = now
+        if self._read_mtime_ns() == self._file_mtime_ns:
+            return
+        with self._lock:
+            self._file_data = self._load_config()
+            self.config_data = self._build_snapshot()
+            logging.info(f"配置文件已变化，重新加载: {self.config_file}")
+
+    def reload(self) -> None:
+        """强制重新加载配置文件和环境变量"""
+        with self._lock:
+            self._file_data = self._load_config()
+            self.config_data = self._build_snapshot()
     
     def _merge_config(self, default: Dict[str, Any], loaded: Dict[str, Any]) -> None:
         """递归合并配置，如果llm_monitor_config.json中的配置与默认配置不同，
             则使用llm_monitor_config.json中的配置"""
         for key, value in loaded.items():
-            if key in default:
-                if isinstance(value, dict) and isinstance(default[key], dict):
-                    self._merge_config(default[key], value)
-                else:
-                    default[key] = value
+            if key in default and isinstance(value, dict) and isinstance(default[key], dict):
+                self._merge_config(default[key], value)
+            else:
+                # 默认配置中没有的键（如 pricing 中的模型）同样保留
+                default[key] = value
     
-    def _save_config(self, config: Dict[str, Any] = None) -> None:
-        """保存配置到文件"""
-        config = config or self.config_data
-        try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logging.error(f"保存配置文件失败: {e}")
+    def save(self) -> None:
+        """
+        将当前配置（不含环境变量覆盖）原子地写入配置文件：
+        写同目录下的临时文件并fsync，再用os.replace替换原文件
+        """
+        with self._lock:
+            config = self._build_snapshot(include_env=False)
+            directory = os.path.dirname(os.path.abspath(self.config_file))
+            fd, tmp_path = tempfile.mkstemp(prefix='.llm_monitor_config.', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(config, f, indent=2, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.config_file)
+            except Exception as e:
+                logging.error(f"保存配置文件失败: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            self._file_data = config
+            self._runtime_values.clear()
+            self._file_mtime_ns = self._read_mtime_ns()
+            self.config_data = self._build_snapshot()
     
     def get(self, key_path: str, default: Any = None) -> Any:
         """获取config_data中的配置值，支持点分割的路径，如 'llm_monitoring.enabled'则返回True，
         如果配置文件中没有该配置项，则返回默认值default"""
+        self._reload_if_changed()
         keys = key_path.split('.')
         value = self.config_data
         
@@ -85,27 +208,20 @@ class Config:
         return value
     
     def set(self, key_path: str, value: Any) -> None:
-        """设置配置值，支持点分割的路径"""
-        keys = key_path.split('.')
-        config = self.config_data
-        
-        # 导航到最后一级的父字典
-        for key in keys[:-1]:
-            if key not in config:
-                config[key] = {}
-            config = config[key]
-        
-        # 设置最后一级的值
-        config[keys[-1]] = value
-        self._save_config()
+        """设置配置值（仅修改内存，调用save()后才写入文件），支持点分割的路径"""
+        with self._lock:
+            self._runtime_values[key_path] = value
+            self._set_path(self.config_data, key_path, value)
     
     def get_monitoring_enabled(self) -> bool:
         """获取监控开启状态"""
         return self.get('llm_monitoring.enabled', True)
     
-    def set_monitoring_enabled(self, enabled: bool) -> None:
-        """设置监控开启状态"""
+    def set_monitoring_enabled(self, enabled: bool, persist: bool = False) -> None:
+        """设置监控开启状态，persist为True时同时写入配置文件"""
         self.set('llm_monitoring.enabled', enabled)
+        if persist:
+            self.save()
         logging.info(f"LLM监控功能{'已开启' if enabled else '已关闭'}")
     
     def get_database_config(self) -> Dict[str, Any]:
@@ -114,13 +230,13 @@ class Config:
     
 
 
-# 全局配置实例
+# 全局配置实例（只读取配置，不会写文件）
 global_config = Config()
 
 
-def set_monitoring_enabled(enabled: bool) -> None:
-    """全局设置监控开启状态"""
-    global_config.set_monitoring_enabled(enabled)
+def set_monitoring_enabled(enabled: bool, persist: bool = False) -> None:
+    """全局设置监控开启状态，默认只在当前进程内生效，persist为True时写入配置文件"""
+    global_config.set_monitoring_enabled(enabled, persist=persist)
     
     # 同时更新监控器状态
     try:
@@ -128,4 +244,3 @@ def set_monitoring_enabled(enabled: bool) -> None:
         global_llm_monitor.set_enabled(enabled)
     except ImportError:
         logging.warning("无法导入llm_monitor模块")
-
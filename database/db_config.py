@@ -3,6 +3,7 @@
 数据库配置和LLM调用记录表结构
 """
 import os
+import zlib
 import logging
 import pymysql
 from datetime import datetime
@@ -102,43 +103,118 @@ class LLMCallLogger:
             success BOOLEAN DEFAULT TRUE COMMENT '是否成功',
             error_message TEXT COMMENT '错误信息',
             temperature FLOAT COMMENT '温度参数',
+            run_id VARCHAR(64) COMMENT '运行ID',
+            novel_id VARCHAR(200) COMMENT '小说ID',
+            stage VARCHAR(50) COMMENT '流程阶段',
+            chapter_number INT COMMENT '章节号',
+            prompt_chars INT COMMENT '提示词字符数',
+            response_chars INT COMMENT '响应字符数',
+            latency_ms INT COMMENT '调用耗时(毫秒)',
+            ttft_ms INT COMMENT '首token耗时(毫秒)，仅流式调用记录',
+            output_tokens_per_s FLOAT COMMENT '输出速度(token/秒)',
             INDEX idx_model_name (model_name),
             INDEX idx_call_purpose (call_purpose),
-            INDEX idx_call_start_time (call_start_time)
+            INDEX idx_call_start_time (call_start_time),
+            INDEX idx_run_id (run_id),
+            INDEX idx_novel_stage (novel_id, stage),
+            INDEX idx_novel_chapter (novel_id, chapter_number)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci 
         COMMENT='LLM调用记录表';
         """
         
+        # 提示词/响应正文单独存放（zlib压缩），避免主表行过大
+        create_payload_table_sql = """
+        CREATE TABLE IF NOT EXISTS llm_call_payloads (
+            call_id VARCHAR(100) PRIMARY KEY COMMENT '调用ID',
+            prompt_body MEDIUMBLOB COMMENT '压缩后的提示词',
+            response_body MEDIUMBLOB COMMENT '压缩后的响应',
+            created_at DATETIME NOT NULL COMMENT '写入时间',
+            INDEX idx_created_at (created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci 
+        COMMENT='LLM调用正文表';
+        """
+        
         try:
             with self.db_config.get_connection() as conn:
                 with conn.cursor() as cursor:
                     cursor.execute(create_table_sql)
+                    self._migrate_table(cursor)
+                    cursor.execute(create_payload_table_sql)
                     logging.info("LLM调用记录表初始化成功")
         except Exception as e:
             logging.error(f"创建表失败: {e}")
             raise
     
+    # 旧版本表中缺少的列和索引：(列名, 列定义)，(索引名, 索引列)
+    _ADDED_COLUMNS = [
+        ("run_id", "VARCHAR(64) COMMENT '运行ID'"),
+        ("novel_id", "VARCHAR(200) COMMENT '小说ID'"),
+        ("stage", "VARCHAR(50) COMMENT '流程阶段'"),
+        ("chapter_number", "INT COMMENT '章节号'"),
+        ("prompt_chars", "INT COMMENT '提示词字符数'"),
+        ("response_chars", "INT COMMENT '响应字符数'"),
+        ("latency_ms", "INT COMMENT '调用耗时(毫秒)'"),
+        ("ttft_ms", "INT COMMENT '首token耗时(毫秒)，仅流式调用记录'"),
+        ("output_tokens_per_s", "FLOAT COMMENT '输出速度(token/秒)'"),
+    ]
+    _ADDED_INDEXES = [
+        ("idx_run_id", "run_id"),
+        ("idx_novel_stage", "novel_id, stage"),
+        ("idx_novel_chapter", "novel_id, chapter_number"),
+    ]
+
+    def _migrate_table(self, cursor) -> None:
+        """为已存在的旧表补充新增的列和索引"""
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'llm_call_logs'",
+            (self.db_config.database,)
+        )
+        existing_columns = {row[0] for row in cursor.fetchall()}
+        for column, definition in self._ADDED_COLUMNS:
+            if column not in existing_columns:
+                cursor.execute(f"ALTER TABLE llm_call_logs ADD COLUMN {column} {definition}")
+                logging.info(f"llm_call_logs 已添加列: {column}")
+
+        cursor.execute(
+            "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'llm_call_logs'",
+            (self.db_config.database,)
+        )
+        existing_indexes = {row[0] for row in cursor.fetchall()}
+        for index, columns in self._ADDED_INDEXES:
+            if index not in existing_indexes:
+                cursor.execute(f"ALTER TABLE llm_call_logs ADD INDEX {index} ({columns})")
+                logging.info(f"llm_call_logs 已添加索引: {index}")
+
     def log_call_start(self, call_id: str, model_name: str, call_purpose: str, 
-                      temperature: float) -> None:
+                      temperature: float, run_id: Optional[str] = None,
+                      novel_id: Optional[str] = None, stage: Optional[str] = None,
+                      chapter_number: Optional[int] = None) -> None:
         """记录LLM调用开始前的信息"""
         insert_sql = """
         INSERT INTO llm_call_logs (
-            call_id, model_name, call_purpose, call_start_time, temperature
-        ) VALUES (%s, %s, %s, %s, %s)
+            call_id, model_name, call_purpose, call_start_time, temperature,
+            run_id, novel_id, stage, chapter_number
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
         
         try:
             with self.db_config.get_connection() as conn:
                 with conn.cursor() as cursor:
                     cursor.execute(insert_sql, (
-                        call_id, model_name, call_purpose, datetime.now(), temperature
+                        call_id, model_name, call_purpose, datetime.now(), temperature,
+                        run_id, novel_id, stage, chapter_number
                     ))
         except Exception as e:
             logging.error(f"记录调用开始失败: {e}")
     
     def log_call_end(self, call_id: str, prompt_tokens: int, completion_tokens: int, 
                     total_tokens: int, cached_tokens: int, success: bool, 
-                    error_message: Optional[str] = None) -> None:
+                    error_message: Optional[str] = None,
+                    prompt_chars: Optional[int] = None, response_chars: Optional[int] = None,
+                    latency_ms: Optional[int] = None, ttft_ms: Optional[int] = None,
+                    output_tokens_per_s: Optional[float] = None) -> None:
         """用于在LLM调用完成后更新数据库中的调用记录"""
         update_sql = """
         UPDATE llm_call_logs SET 
@@ -149,7 +225,12 @@ class LLMCallLogger:
             total_tokens = %s,
             cached_tokens = %s,
             success = %s,
-            error_message = %s
+            error_message = %s,
+            prompt_chars = %s,
+            response_chars = %s,
+            latency_ms = %s,
+            ttft_ms = %s,
+            output_tokens_per_s = %s
         WHERE call_id = %s
         """
         
@@ -159,11 +240,141 @@ class LLMCallLogger:
                 with conn.cursor() as cursor:
                     cursor.execute(update_sql, (
                         end_time, end_time, prompt_tokens, completion_tokens, 
-                        total_tokens, cached_tokens, success, error_message, call_id
+                        total_tokens, cached_tokens, success, error_message,
+                        prompt_chars, response_chars, latency_ms, ttft_ms,
+                        output_tokens_per_s, call_id
                     ))
         except Exception as e:
             logging.error(f"记录调用结束失败: {e}")
-    
+
+    def save_payload(self, call_id: str, prompt: str, response: str) -> None:
+        """将提示词和响应正文压缩后写入 llm_call_payloads"""
+        insert_sql = """
+        REPLACE INTO llm_call_payloads (call_id, prompt_body, response_body, created_at)
+        VALUES (%s, %s, %s, %s)
+        """
+        try:
+            with self.db_config.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(insert_sql, (
+                        call_id,
+                        zlib.compress(prompt.encode('utf-8')),
+                        zlib.compress(response.encode('utf-8')),
+                        datetime.now()
+                    ))
+        except Exception as e:
+            logging.error(f"保存调用正文失败: {e}")
+
+    def load_payload(self, call_id: str) -> Optional[Dict[str, str]]:
+        """读取并解压某次调用的提示词和响应正文，不存在时返回None"""
+        rows = self._query(
+            "SELECT prompt_body, response_body FROM llm_call_payloads WHERE call_id = %s",
+            (call_id,)
+        )
+        if not rows:
+            return None
+        return {
+            'prompt': zlib.decompress(rows[0]['prompt_body']).decode('utf-8'),
+            'response': zlib.decompress(rows[0]['response_body']).decode('utf-8')
+        }
+
+    def purge_payloads(self, retention_days: int) -> int:
+        """删除超过保留天数的调用正文，返回删除的行数"""
+        delete_sql = "DELETE FROM llm_call_payloads WHERE created_at < NOW() - INTERVAL %s DAY"
+        try:
+            with self.db_config.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    deleted = cursor.execute(delete_sql, (retention_days,))
+            if deleted:
+                logging.info(f"已清理 {deleted} 条超过 {retention_days} 天的调用正文")
+            return deleted
+        except Exception as e:
+            logging.error(f"清理调用正文失败: {e}")
+            return 0
+
+    def _query(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        """执行查询并以字典列表返回结果"""
+        try:
+            with self.db_config.get_connection() as conn:
+                with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+                    cursor.execute(sql, params)
+                    return list(cursor.fetchall())
+        except Exception as e:
+            logging.error(f"查询调用记录失败: {e}")
+            return []
+
+    def get_stage_report(self, novel_id: str) -> List[Dict[str, Any]]:
+        """按流程阶段汇总某部小说的调用次数、token和耗时（走idx_novel_stage索引）"""
+        sql = """
+        SELECT stage, model_name,
+               COUNT(*) AS calls,
+               SUM(success = FALSE) AS failed_calls,
+               SUM(prompt_tokens) AS prompt_tokens,
+               SUM(completion_tokens) AS completion_tokens,
+               SUM(cached_tokens) AS cached_tokens,
+               AVG(waiting_time_s) AS avg_waiting_time_s,
+               MAX(waiting_time_s) AS max_waiting_time_s,
+               AVG(ttft_ms) AS avg_ttft_ms,
+               AVG(output_tokens_per_s) AS avg_output_tokens_per_s
+        FROM llm_call_logs
+        WHERE novel_id = %s
+        GROUP BY stage, model_name
+        ORDER BY stage, model_name
+        """
+        return self._query(sql, (novel_id,))
+
+    def get_chapter_report(self, novel_id: str, start_chapter: Optional[int] = None,
+                           end_chapter: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按章节汇总某部小说的调用次数、token和耗时（走idx_novel_chapter索引）"""
+        sql = """
+        SELECT chapter_number,
+               COUNT(*) AS calls,
+               SUM(prompt_tokens) AS prompt_tokens,
+               SUM(completion_tokens) AS completion_tokens,
+               SUM(cached_tokens) AS cached_tokens,
+               SUM(waiting_time_s) AS total_waiting_time_s,
+               MAX(prompt_chars) AS max_prompt_chars,
+               SUM(response_chars) AS response_chars
+        FROM llm_call_logs
+        WHERE novel_id = %s AND chapter_number BETWEEN %s AND %s
+        GROUP BY chapter_number
+        ORDER BY chapter_number
+        """
+        # 只有未指定（None）时才不限范围，0 是有效的章节号上下限
+        start_chapter = 0 if start_chapter is None else start_chapter
+        end_chapter = 2 ** 31 - 1 if end_chapter is None else end_chapter
+        return self._query(sql, (novel_id, start_chapter, end_chapter))
+
+    def get_usage_by_chapter_model(self, novel_id: str) -> List[Dict[str, Any]]:
+        """按章节和模型汇总某部小说成功调用的token，用于断点续写时恢复预算跟踪"""
+        sql = """
+        SELECT chapter_number, model_name,
+               SUM(prompt_tokens) AS prompt_tokens,
+               SUM(completion_tokens) AS completion_tokens,
+               SUM(cached_tokens) AS cached_tokens,
+               SUM(total_tokens) AS total_tokens
+        FROM llm_call_logs
+        WHERE novel_id = %s AND success = TRUE
+        GROUP BY chapter_number, model_name
+        """
+        return self._query(sql, (novel_id,))
+
+    def get_throughput_report(self, days: int = 30) -> List[Dict[str, Any]]:
+        """按模型和日期汇总最近days天成功调用的耗时与输出速度，用于发现服务商吞吐下降"""
+        sql = """
+        SELECT model_name, DATE(call_start_time) AS call_date,
+               COUNT(*) AS calls,
+               AVG(latency_ms) AS avg_latency_ms,
+               AVG(ttft_ms) AS avg_ttft_ms,
+               AVG(output_tokens_per_s) AS avg_output_tokens_per_s,
+               AVG(prompt_chars) AS avg_prompt_chars
+        FROM llm_call_logs
+        WHERE call_start_time >= NOW() - INTERVAL %s DAY AND success = TRUE
+        GROUP BY model_name, DATE(call_start_time)
+        ORDER BY model_name, call_date
+        """
+        return self._query(sql, (days,))
+
 
 
 # 默认数据库配置实例
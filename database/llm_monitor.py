@@ -7,8 +7,13 @@ import uuid
 import time
 import logging
 import functools
+import threading
 from typing import Dict, Any, Optional, Callable
+from .config_manager import global_config
 from .db_config import default_llm_logger, LLMCallLogger
+from .call_context import get_call_context
+from .budget import global_budget_tracker
+from .token_estimator import global_token_estimator
 
 
 class LLMMonitor:
@@ -17,6 +22,10 @@ class LLMMonitor:
     def __init__(self, logger: Optional[LLMCallLogger] = None, enabled: bool = True):
         self.logger = logger or default_llm_logger
         self.enabled = enabled
+        # 进行中的调用：call_id -> (开始时间perf_counter, 提示词)
+        self._pending: Dict[str, tuple] = {}
+        self._pending_lock = threading.Lock()
+        self._payload_purged = False
         
     def set_enabled(self, enabled: bool):
         """设置监控开启状态"""
@@ -48,6 +57,110 @@ class LLMMonitor:
             
         return usage_info
 
+    def _log_detailed_response(self) -> bool:
+        """是否保存提示词/响应正文（llm_monitoring.log_detailed_response）"""
+        return bool(global_config.get('llm_monitoring.log_detailed_response', False))
+
+    def _purge_payloads_once(self) -> None:
+        """进程内首次保存正文时按保留天数清理一次旧正文"""
+        if self._payload_purged:
+            return
+        self._payload_purged = True
+        retention_days = global_config.get('llm_monitoring.payload_retention_days', 30)
+        if retention_days:
+            self.logger.purge_payloads(int(retention_days))
+
+    def log_start(self, call_id: str, model_name: str, call_purpose: Optional[str],
+                  temperature: float, prompt: str = "", **context_overrides) -> None:
+        """
+        记录调用开始，run_id/novel_id/stage/chapter_number 默认取自当前调用上下文，
+        也可通过关键字参数显式覆盖
+        """
+        if not self.enabled:
+            return
+        with self._pending_lock:
+            self._pending[call_id] = (time.perf_counter(), prompt)
+        context = get_call_context()
+        context.update({k: v for k, v in context_overrides.items() if v is not None})
+        self.logger.log_call_start(
+            call_id=call_id,
+            model_name=model_name,
+            call_purpose=call_purpose or "未指定",
+            temperature=temperature,
+            run_id=context.get("run_id"),
+            novel_id=context.get("novel_id"),
+            stage=context.get("stage"),
+            chapter_number=context.get("chapter_number")
+        )
+
+    def _pop_pending(self, call_id: str) -> tuple:
+        """取出调用开始时记录的(开始时间, 提示词)"""
+        with self._pending_lock:
+            return self._pending.pop(call_id, (None, ""))
+
+    def log_success(self, call_id: str, response, ttft_s: Optional[float] = None,
+                    model_name: Optional[str] = None) -> None:
+        """
+        根据响应中的usage记录调用成功，同时记录提示词/响应字符数、耗时、
+        首token耗时（仅流式调用时有值）和输出速度，并把花费计入预算跟踪器
+        """
+        usage_info = self._parse_usage_from_response(response)
+        # 预算跟踪不受监控开关影响
+        if global_budget_tracker.enabled:
+            global_budget_tracker.record(model_name, usage_info, get_call_context().get("chapter_number"))
+        if not self.enabled:
+            return
+        started, prompt = self._pop_pending(call_id)
+        # 用实际的prompt token数校准离线估算
+        global_token_estimator.observe(model_name, prompt, usage_info['prompt_tokens'])
+        latency_s = (time.perf_counter() - started) if started is not None else None
+        try:
+            content = response.choices[0].message.content or ""
+        except Exception:
+            content = ""
+
+        # 输出速度按生成阶段计算：流式时扣除首token前的等待
+        output_tokens_per_s = None
+        if latency_s and usage_info['completion_tokens']:
+            generation_s = latency_s - ttft_s if ttft_s is not None else latency_s
+            if generation_s > 0:
+                output_tokens_per_s = round(usage_info['completion_tokens'] / generation_s, 2)
+
+        self.logger.log_call_end(
+            call_id=call_id,
+            prompt_tokens=usage_info['prompt_tokens'],
+            completion_tokens=usage_info['completion_tokens'],
+            total_tokens=usage_info['total_tokens'],
+            cached_tokens=usage_info['cached_tokens'],
+            success=True,
+            prompt_chars=len(prompt),
+            response_chars=len(content),
+            latency_ms=int(latency_s * 1000) if latency_s is not None else None,
+            ttft_ms=int(ttft_s * 1000) if ttft_s is not None else None,
+            output_tokens_per_s=output_tokens_per_s
+        )
+
+        if self._log_detailed_response():
+            self._purge_payloads_once()
+            self.logger.save_payload(call_id, prompt, content)
+
+    def log_failure(self, call_id: str, error_message: str) -> None:
+        """记录调用失败"""
+        if not self.enabled:
+            return
+        started, prompt = self._pop_pending(call_id)
+        self.logger.log_call_end(
+            call_id=call_id,
+            prompt_tokens=0,
+            completion_tokens=0,
+            total_tokens=0,
+            cached_tokens=0,
+            success=False,
+            error_message=error_message,
+            prompt_chars=len(prompt),
+            latency_ms=int((time.perf_counter() - started) * 1000) if started is not None else None
+        )
+
 
 # 全局监控器实例
 global_llm_monitor = LLMMonitor()
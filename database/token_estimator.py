@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+离线token估算
+发送请求前估算提示词的token数，用于预算检查、按上下文窗口收紧 max_tokens、
+在提示词超长时直接报错（不再等一次往返后才失败），以及角色事件压缩的阈值判断。
+- 安装了 tiktoken 且本地已有对应编码文件时，OpenAI系模型使用精确分词
+- 其他模型按"每个汉字/全角字符的token数"和"每个其他字符的token数"两个比例估算，
+  比例可在 llm_monitor_config.json 的 token_ratios 中覆盖，
+  并在每次调用成功后用服务端返回的 prompt_tokens 自动校准
+字符分类利用UTF-8编码长度在C层完成（汉字和全角标点为3字节，ASCII为1字节），
+不逐字符遍历，批量估算大量提示词时开销可以忽略。
+"""
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from .config_manager import global_config
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# 模型名前缀 -> (每个宽字符的token数, 每个其他字符的token数)
+DEFAULT_TOKEN_RATIOS = {
+    "gemini": (0.8, 0.27),
+    "qwen": (0.65, 0.27),
+    "doubao": (0.6, 0.27),
+    "gpt": (0.75, 0.25),
+}
+# 未知模型按偏保守的比例估算
+FALLBACK_TOKEN_RATIO = (1.0, 0.3)
+
+# 模型上下文窗口（token），可在 llm_monitor_config.json 的 context_windows 中覆盖或补充
+DEFAULT_CONTEXT_WINDOWS = {
+    "gemini-2.5-pro": 1_048_576,
+    "gemini-2.5-flash": 1_048_576,
+    "qwen-plus": 131_072,
+    "doubao-seed-1-6-250615": 262_144,
+    "doubao-seed-1-6-flash-250715": 262_144,
+}
+
+# 校准系数的平滑系数和取值范围
+CALIBRATION_ALPHA = 0.2
+CALIBRATION_RANGE = (0.5, 2.0)
+
+
+class PromptTooLongError(ValueError):
+    """提示词超出模型上下文窗口"""
+
+
+def count_chars(text: str) -> Tuple[int, int]:
+    """返回 (宽字符数, 其他字符数)，宽字符为UTF-8编码占3字节及以上的字符（汉字、全角标点等）"""
+    chars = len(text)
+    extra_bytes = len(text.encode('utf-8', 'surrogatepass')) - chars
+    # 每个3字节字符多出2字节；少量2字节字符（拉丁扩展、西里尔字母）按半个宽字符计
+    wide = min(chars, extra_bytes // 2)
+    return wide, chars - wide
+
+
+class TokenEstimator:
+    """按模型估算token数，并根据实际用量校准"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 模型名 -> 校准系数（实际token数 / 估算token数 的指数平滑）
+        self._calibration: Dict[str, float] = {}
+        # 模型名 -> tiktoken编码，None表示没有可用的精确分词
+        self._encodings: Dict[str, object] = {}
+
+    def _ratio(self, model_name: Optional[str]) -> Tuple[float, float]:
+        name = (model_name or "").lower()
+        configured = global_config.get('token_ratios', {}) or {}
+        for ratios in (configured, DEFAULT_TOKEN_RATIOS):
+            if name in ratios:
+                return tuple(ratios[name])
+            for prefix, ratio in ratios.items():
+                if name.startswith(prefix.lower()):
+                    return tuple(ratio)
+        return FALLBACK_TOKEN_RATIO
+
+    def _encoding(self, model_name: Optional[str]):
+        """OpenAI系模型的tiktoken编码，编码文件不在本地（需要联网下载）时返回None"""
+        if tiktoken is None or not model_name or not model_name.lower().startswith(("gpt", "o1", "o3", "o4")):
+            return None
+        with self._lock:
+            if model_name in self._encodings:
+                return self._encodings[model_name]
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except Exception as e:
+            logging.debug(f"模型 {model_name} 没有可用的离线分词，改用比例估算: {e}")
+            encoding = None
+        with self._lock:
+            self._encodings[model_name] = encoding
+        return encoding
+
+    def _raw_estimate(self, text: str, model_name: Optional[str]) -> float:
+        wide_ratio, other_ratio = self._ratio(model_name)
+        wide, other = count_chars(text)
+        return wide * wide_ratio + other * other_ratio
+
+    def estimate(self, text: str, model_name: Optional[str] = None) -> int:
+        """估算一段文本的token数"""
+        return self.estimate_batch([text], model_name)[0]
+
+    def estimate_batch(self, texts: List[str], model_name: Optional[str] = None) -> List[int]:
+        """批量估算同一模型下多段文本的token数"""
+        encoding = self._encoding(model_name)
+        if encoding is not None:
+            return [len(tokens) for tokens in encoding.encode_batch(texts, disallowed_special=())]
+        wide_ratio, other_ratio = self._ratio(model_name)
+        with self._lock:
+            factor = self._calibration.get(model_name or "", 1.0)
+        estimates = []
+        for text in texts:
+            wide, other = count_chars(text)
+            estimates.append(int((wide * wide_ratio + other * other_ratio) * factor + 0.5))
+        return estimates
+
+    def observe(self, model_name: Optional[str], text: str, actual_tokens: int) -> None:
+        """用服务端返回的实际prompt token数校准比例估算（精确分词的模型无需校准）"""
+        if not model_name or not text or not actual_tokens or self._encoding(model_name) is not None:
+            return
+        raw = self._raw_estimate(text, model_name)
+        if raw <= 0:
+            return
+        low, high = CALIBRATION_RANGE
+        ratio = min(high, max(low, actual_tokens / raw))
+        with self._lock:
+            previous = self._calibration.get(model_name)
+            self._calibration[model_name] = ratio if previous is None else \
+                previous + CALIBRATION_ALPHA * (ratio - previous)
+
+    def calibration(self) -> Dict[str, float]:
+        """当前各模型的校准系数"""
+        with self._lock:
+            return dict(self._calibration)
+
+    @staticmethod
+    def context_window(model_name: Optional[str]) -> Optional[int]:
+        """模型的上下文窗口，未知模型返回None"""
+        configured = global_config.get('context_windows', {}) or {}
+        return configured.get(model_name) or DEFAULT_CONTEXT_WINDOWS.get(model_name)
+
+    def preflight(self, prompt: str, model_name: Optional[str], max_tokens: int,
+                  prompt_tokens: Optional[int] = None) -> Tuple[int, int]:
+        """
+        发送前检查提示词长度，返回 (估算的prompt token数, 本次调用应使用的max_tokens)：
+        - 提示词本身超出上下文窗口：抛出 PromptTooLongError
+        - 提示词 + max_tokens 超出上下文窗口：把 max_tokens 收紧到剩余空间
+        调用方已按 model_name 估算过时通过 prompt_tokens 传入，不再重复估算。
+        """
+        if prompt_tokens is None:
+            prompt_tokens = self.estimate(prompt, model_name)
+        window = self.context_window(model_name)
+        if not window:
+            return prompt_tokens, max_tokens
+        if prompt_tokens >= window:
+            raise PromptTooLongError(
+                f"提示词约 {prompt_tokens} tokens，超出模型 {model_name} 的上下文窗口 {window}"
+            )
+        if max_tokens and prompt_tokens + max_tokens > window:
+            logging.info(
+                f"提示词约 {prompt_tokens} tokens，max_tokens 由 {max_tokens} 收紧为 {window - prompt_tokens}"
+            )
+            max_tokens = window - prompt_tokens
+        return prompt_tokens, max_tokens
+
+
+# 全局token估算器实例
+global_token_estimator = TokenEstimator()
+
+
+def estimate_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """估算一段文本的token数"""
+    return global_token_estimator.estimate(text, model_name)
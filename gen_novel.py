@@ -5,6 +5,7 @@
 """
 
 import os
+import asyncio
 import logging
 from novel_generator import (
     Novel_architecture_generate,
@@ -15,16 +16,15 @@ from novel_generator import (
 )
 from character_summary import update_character_state_file
 from database.config_manager import set_monitoring_enabled
+from database.call_context import bind_call_context, llm_call_context, load_novel_id, STAGE_ARCHITECTURE, STAGE_BLUEPRINT
+from database.budget import global_budget_tracker, BudgetExceededError
+from tracing import span, enable_tracing
+from novel_generator.novel_store import open_novel_store
+from novel_generator.executor import run_in_own_thread, get_executor
+from log_setup import setup_logging
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('novel_generation.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# 配置日志（异步写入，日志文件按大小轮转并压缩，级别见 llm_monitor_config.json 的 logging）
+setup_logging('novel_generation.log')
 
 # API配置
 #interface_format = "qwen"  
@@ -45,6 +45,22 @@ logging.basicConfig(
 #topic = "男主追求女主，但女主看不起男主，常常在男主面前与男二做亲密动作，男主即伤心又愤怒，却又无可奈何，突然有一天男主获得了超能力，吸引了女主的注意，女主开始追求男主，同时也有其它女生追求男主。反转：女主由于父亲负债被迫与男二在一起"
 
 
+async def _wait_for_compaction(compaction):
+    """等待后台的角色事件压缩完成，压缩失败只记录日志，预算用尽时向上抛出"""
+    if compaction is None:
+        return
+    try:
+        compacted = await compaction
+        if compacted:
+            print(f"✅ 角色事件压缩完成：{', '.join(compacted)}")
+    except BudgetExceededError:
+        # 预算用尽要传到主流程暂停生成，不能当作普通的压缩失败
+        raise
+    except Exception as e:
+        print(f"⚠️ 角色状态总结失败：{str(e)}")
+        logging.error(f"角色状态总结错误：{str(e)}", exc_info=True)
+
+
 async def main():
     """
     主函数：演示完整的小说生成流程
@@ -59,7 +75,7 @@ async def main():
     # api_key =
 
     base_url = "https://generativelanguage.googleapis.com/v1beta/openai/"
-    model_name1 = "gemini-2.5-flash"   # 更新角色和总结角色
+    model_name1 = "gemini-2.5-flash"   # 更新角色和总结角色，改写检索查询
     model_name2 = "gemini-2.5-pro"   # 小说架构，章节目录和章节正文
     
     # 生成参数
@@ -78,12 +94,19 @@ async def main():
     word_number = 1200             # 每章字数（小说要求每章至少1200字）
     chunk_size = 25                # 章节目录生成时，每次生成多少章节
     limit_chapters = 25            # 每次生成章节时，提供多少章已经生成好的章节信息
+    blueprint_parallel = False     # 章节目录并行生成：先生成每章一行的骨架，再同时生成各分块
+    blueprint_parts_parallel = False  # 按剧情部分生成目录时同时生成各部分，False为严格按顺序逐部分生成
 
     # 用户指导（可选）
     user_guidance = "故事情节要丰富，循序渐进地推进剧情。叙述手法多样化。人物的背景不要一开始就全盘托出，而是要随着剧情的展开逐步揭示。在剧情需要时，可以加入新的角色。"
     
     # 文件保存路径
     filepath = "./Novel_Output"  # 小说输出目录
+    trace_file = None  # 链路追踪输出文件（JSON Lines），如 "./Novel_Output/trace.jsonl"，None表示不开启
+    event_token_threshold = 1500  # 单个角色的[触发或加深的事件]超过该token数时在后台压缩
+    state_update_mode = "delta"  # 角色状态更新方式："delta" 模型只输出新增内容（失败时回退），"full" 每章整份重新生成
+    novel_id = None  # 小说ID（监控记录、预算恢复按它区分小说），None表示使用输出目录中 novel_id.txt 保存的ID（首次运行时生成）
+    storage_backend = "txt"  # 存储后端："txt" 仅使用txt文件，"sqlite" 同时写入 Novel_Output/novel_store.db
     
     # ==================== 开始生成流程 ====================
     
@@ -93,120 +116,147 @@ async def main():
     
     # 创建输出目录
     os.makedirs(filepath, exist_ok=True)
+    if trace_file:
+        enable_tracing(trace_file)
+    # SQLite存储首次启用时导入已有的txt文件
+    store = open_novel_store(filepath) if storage_backend == "sqlite" else None
+
+    # 监控记录和预算恢复使用同一个小说ID：显式指定的 novel_id，否则为输出目录中 novel_id.txt 保存的UUID
+    novel_id = novel_id or load_novel_id(filepath)
+    bind_call_context(novel_id=novel_id)
+
+    # 预算控制（llm_monitor_config.json 的 budget 部分），续写时从调用记录中恢复已花费的金额
+    global_budget_tracker.set_target_chapters(number_of_chapters)
+    if global_budget_tracker.enabled:
+        from database.llm_monitor import global_llm_monitor
+        global_budget_tracker.load_history(global_llm_monitor.logger.get_usage_by_chapter_model(novel_id))
     
     try:
         # 第一步：生成小说架构
         print("\n📋 第一步：生成小说架构...")
-        await Novel_architecture_generate(
-            interface_format=interface_format,
-            api_key=api_key,
-            base_url=base_url,
-            llm_model=model_name2,
-            topic=topic,
-            genre=genre,
-            number_of_chapters=number_of_chapters,
-            word_number=word_number,
-            filepath=filepath,
-            user_guidance=user_guidance,
-            temperature=temperature1,
-            temperature_plot=temperature3,
-            max_tokens=max_tokens,
-            timeout=timeout
-        )
+        with llm_call_context(stage=STAGE_ARCHITECTURE):
+            await Novel_architecture_generate(
+                interface_format=interface_format,
+                api_key=api_key,
+                base_url=base_url,
+                llm_model=model_name2,
+                topic=topic,
+                genre=genre,
+                number_of_chapters=number_of_chapters,
+                word_number=word_number,
+                filepath=filepath,
+                user_guidance=user_guidance,
+                temperature=temperature1,
+                temperature_plot=temperature3,
+                max_tokens=max_tokens,
+                timeout=timeout
+            )
         print("✅ 小说架构生成完成！")
 
         # 第二步：生成章节蓝图
         print("\n📖 第二步：生成章节蓝图...")
-        Chapter_blueprint_generate(
-            interface_format=interface_format,
-            api_key=api_key,
-            base_url=base_url,
-            llm_model=model_name2,
-            filepath=filepath,
-            number_of_chapters=number_of_chapters,
-            temperature=temperature2,
-            max_tokens=max_tokens,
-            chunk_size=chunk_size,
-            limit_chapters=limit_chapters,
-            timeout=timeout
-        )
+        with llm_call_context(stage=STAGE_BLUEPRINT):
+            Chapter_blueprint_generate(
+                interface_format=interface_format,
+                api_key=api_key,
+                base_url=base_url,
+                llm_model=model_name2,
+                filepath=filepath,
+                number_of_chapters=number_of_chapters,
+                temperature=temperature2,
+                max_tokens=max_tokens,
+                chunk_size=chunk_size,
+                limit_chapters=limit_chapters,
+                timeout=timeout,
+                parallel=blueprint_parallel
+            )
         print("✅ 章节蓝图生成完成！")
 
         print("\n📖 第二步：生成章节蓝图...")
-        Chapter_blueprint_generate_by_parts(
-            interface_format=interface_format,
-            api_key=api_key,
-            base_url=base_url,
-            llm_model=model_name2, 
-            filepath=filepath,
-            max_tokens=max_tokens,
-            min_chapters_per_part=15  # 每个剧情部分至少生成的章节数
-        )
+        with llm_call_context(stage=STAGE_BLUEPRINT):
+            Chapter_blueprint_generate_by_parts(
+                interface_format=interface_format,
+                api_key=api_key,
+                base_url=base_url,
+                llm_model=model_name2, 
+                filepath=filepath,
+                max_tokens=max_tokens,
+                min_chapters_per_part=15,  # 每个剧情部分至少生成的章节数
+                parallel=blueprint_parts_parallel
+            )
         print("✅ 章节蓝图生成完成！")
+        if store is not None:
+            store.sync_artifacts_from_txt(filepath)
 
         # 第三步：逐章生成内容
         print("\n✍️ 第三步：开始生成章节内容...")
+        compaction = None
         for chapter_num in range(1, number_of_chapters + 1):
-            print(f"\n--- 正在生成第 {chapter_num} 章 ---")
+            # 每章一个追踪span，其下嵌套各阶段、LLM调用和文件读写
+            with span("chapter", chapter_number=chapter_num):
+                print(f"\n--- 正在生成第 {chapter_num} 章 ---")
 
-            # 生成章节正文（先生成摘要，再基于摘要生成正文）
-            draft_content = generate_chapter_draft(
-                api_key=api_key,
-                base_url=base_url,
-                model_name=model_name2,
-                filepath=filepath,
-                novel_number=chapter_num,
-                word_number=word_number,
-                temperature=temperature1,
-                user_guidance=user_guidance,
-                interface_format=interface_format,
-                max_tokens=max_tokens,
-                genre=genre,
-                timeout=timeout
-            )
-            
-            if draft_content:
-                print(f"✅ 第 {chapter_num} 章正文生成完成！")
-                
-                # 定稿章节
-                print(f"🎯 正在定稿第 {chapter_num} 章...")
-                await finalize_chapter(
-                    novel_number=chapter_num,
+                # 生成章节正文（先生成摘要，再基于摘要生成正文）
+                draft_content = generate_chapter_draft(
                     api_key=api_key,
                     base_url=base_url,
-                    model_name=model_name1,
-                    temperature=temperature2,
+                    model_name=model_name2,
                     filepath=filepath,
+                    novel_number=chapter_num,
+                    word_number=word_number,
+                    temperature=temperature1,
+                    user_guidance=user_guidance,
                     interface_format=interface_format,
                     max_tokens=max_tokens,
-                    timeout=timeout
+                    genre=genre,
+                    timeout=timeout,
+                    query_model_name=model_name1
                 )
-                print(f"✅ 第 {chapter_num} 章定稿完成！")
-
-                # 每五章进行角色状态总结
-                if chapter_num % 10 == 0:
-                    print(f"\n🔄 正在对前 {chapter_num} 章进行角色状态总结...")
-                    try:
-                        update_character_state_file(
-                            filepath=filepath,
-                            interface_format=interface_format,
-                            api_key=api_key,
-                            base_url=base_url,
-                            model_name=model_name1,
-                            chapter_num=chapter_num,
-                            temperature=temperature2,
-                            max_tokens=max_tokens,
-                            timeout=timeout
-                        )
-                        print(f"✅ 第 {chapter_num} 章角色状态总结完成！")
-                        break
-                    except Exception as e:
-                        print(f"⚠️ 角色状态总结失败：{str(e)}")
-                        logging.error(f"角色状态总结错误：{str(e)}", exc_info=True)
-            else:
-                print(f"❌ 第 {chapter_num} 章生成失败！")
-                break
+            
+                if draft_content:
+                    print(f"✅ 第 {chapter_num} 章正文生成完成！")
+
+                    # 定稿会改写角色状态，需等上一章的事件压缩完成
+                    await _wait_for_compaction(compaction)
+                    compaction = None
+                
+                    # 定稿章节
+                    print(f"🎯 正在定稿第 {chapter_num} 章...")
+                    await finalize_chapter(
+                        novel_number=chapter_num,
+                        api_key=api_key,
+                        base_url=base_url,
+                        model_name=model_name1,
+                        temperature=temperature2,
+                        filepath=filepath,
+                        interface_format=interface_format,
+                        max_tokens=max_tokens,
+                        timeout=timeout,
+                        state_update_mode=state_update_mode
+                    )
+                    print(f"✅ 第 {chapter_num} 章定稿完成！")
 
+                    # 事件过长的角色在后台压缩，与下一章正文生成并行，下一章定稿前等待完成；
+                    # 压缩会向线程池提交各角色的总结任务并等待，本身在单独的线程中执行，不占用线程池
+                    print(f"🔄 后台检查角色事件长度（阈值 {event_token_threshold} tokens）...")
+                    compaction = asyncio.ensure_future(run_in_own_thread(
+                        update_character_state_file,
+                        filepath=filepath,
+                        interface_format=interface_format,
+                        api_key=api_key,
+                        base_url=base_url,
+                        model_name=model_name1,
+                        chapter_num=chapter_num,
+                        temperature=temperature2,
+                        max_tokens=max_tokens,
+                        timeout=timeout,
+                        max_event_tokens=event_token_threshold
+                    ))
+                else:
+                    print(f"❌ 第 {chapter_num} 章生成失败！")
+                    break
+        await _wait_for_compaction(compaction)
+        logging.info(f"线程池统计：{get_executor().stats()}")
 
         print("\n" + "=" * 60)
         print("🎉 小说生成完成！")
@@ -221,11 +271,13 @@ async def main():
                 rel_path = os.path.relpath(file_path, filepath)
                 print(f"  - {rel_path}")
                 
+    except BudgetExceededError as e:
+        print(f"⏸️ 预算已用尽，暂停生成：{str(e)}")
+        logging.warning(f"预算已用尽，暂停生成：{str(e)}")
     except Exception as e:
         print(f"❌ 生成过程中出现错误：{str(e)}")
         logging.error(f"生成错误：{str(e)}", exc_info=True)
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
\ No newline at end of file
@@ -1,10 +1,15 @@
 # llm_adapters.py
 # -*- coding: utf-8 -*-
 import logging
+import time
 import uuid
-from typing import Optional
+from types import SimpleNamespace
+from typing import Optional, Tuple
 from openai import OpenAI
+from database.config_manager import global_config
 from database.llm_monitor import global_llm_monitor
+from database.budget import global_budget_tracker
+from database.token_estimator import global_token_estimator
 
 
 class BaseLLMAdapter:
@@ -17,10 +22,56 @@ class BaseLLMAdapter:
         self.base_url = ""
         self.temperature = 0.0
         self.max_tokens = 0
+        # 流式接收响应，用于记录首token耗时（llm_monitoring.stream_responses）
+        self.stream = bool(global_config.get('llm_monitoring.stream_responses', False))
         
     def invoke(self, prompt: str) -> str:
         raise NotImplementedError("Subclasses must implement .invoke(prompt) method.")
 
+    def _prepare_call(self, prompt: str, stage: Optional[str]) -> Tuple[str, int]:
+        """
+        发送前的检查，返回 (实际使用的模型名, 本次调用的max_tokens)：
+        先按预估总花费选择模型（可能降级），再按该模型估算一次提示词token数，
+        用于预算上限检查（达到上限时抛出 BudgetExceededError）
+        和提示词长度检查（超出上下文窗口时抛出 PromptTooLongError，否则按剩余空间收紧max_tokens）
+        """
+        model_name = global_budget_tracker.select_model(self.model_name, stage)
+        prompt_tokens = global_token_estimator.estimate(prompt, model_name)
+        global_budget_tracker.before_call(model_name, prompt_tokens)
+        _, max_tokens = global_token_estimator.preflight(prompt, model_name, self.max_tokens, prompt_tokens)
+        return model_name, max_tokens
+
+    def _create_completion(self, client, **create_kwargs) -> Tuple[object, Optional[float]]:
+        """
+        调用 chat.completions.create，返回 (response, 首token耗时秒数)。
+        非流式时首token耗时为None；流式时把分片拼装成与非流式相同结构的response。
+        """
+        if not self.stream:
+            return client.chat.completions.create(**create_kwargs), None
+
+        started = time.perf_counter()
+        stream = client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **create_kwargs
+        )
+        ttft_s = None
+        parts = []
+        usage = None
+        for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if ttft_s is None:
+                    ttft_s = time.perf_counter() - started
+                parts.append(delta)
+        message = SimpleNamespace(content="".join(parts))
+        response = SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+        return response, ttft_s
+
 
 class DoubaoAdapter(BaseLLMAdapter):
     def __init__(self, api_key: str, base_url: str, model_name: str, max_tokens: int, temperature: float = 0.7, timeout: Optional[int] = 600):
@@ -39,42 +90,33 @@ class DoubaoAdapter(BaseLLMAdapter):
             base_url=self.base_url
         )
 
-    def invoke_with_monitoring(self, prompt: str, call_purpose: Optional[str] = None) -> str:
-        """带监控的调用方法"""
+    def invoke_with_monitoring(self, prompt: str, call_purpose: Optional[str] = None,
+                               stage: Optional[str] = None, chapter_number: Optional[int] = None) -> str:
+        """带监控的调用方法，stage/chapter_number 未指定时取自当前调用上下文"""
         call_id = str(uuid.uuid4())
+        # 预算和提示词长度检查放在try之外：BudgetExceededError / PromptTooLongError 需要向上抛出
+        model_name, max_tokens = self._prepare_call(prompt, stage)
         
         try:
             # 记录调用开始
-            if global_llm_monitor.enabled:
-                final_call_purpose = call_purpose or "未指定"
-                global_llm_monitor.logger.log_call_start(
-                    call_id=call_id,
-                    model_name=self.model_name,
-                    call_purpose=final_call_purpose,
-                    temperature=self.temperature
-                )
+            global_llm_monitor.log_start(
+                call_id, model_name, call_purpose, self.temperature, prompt=prompt,
+                stage=stage, chapter_number=chapter_number
+            )
             
             # 执行实际调用
-            completion = self.client.chat.completions.create(
-                model=self.model,
+            completion, ttft_s = self._create_completion(
+                self.client,
+                model=model_name,
                 messages=[
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=self.max_tokens,
+                max_tokens=max_tokens,
                 temperature=self.temperature,
             )
             
             # 记录调用结束
-            if global_llm_monitor.enabled:
-                usage_info = global_llm_monitor._parse_usage_from_response(completion)
-                global_llm_monitor.logger.log_call_end(
-                    call_id=call_id,
-                    prompt_tokens=usage_info['prompt_tokens'],
-                    completion_tokens=usage_info['completion_tokens'],
-                    total_tokens=usage_info['total_tokens'],
-                    cached_tokens=usage_info['cached_tokens'],
-                    success=True
-                )
+            global_llm_monitor.log_success(call_id, completion, ttft_s, model_name)
             
             # 确保返回值不为None
             content = completion.choices[0].message.content
@@ -82,16 +124,7 @@ class DoubaoAdapter(BaseLLMAdapter):
             
         except Exception as e:
             # 记录调用失败
-            if global_llm_monitor.enabled:
-                global_llm_monitor.logger.log_call_end(
-                    call_id=call_id,
-                    prompt_tokens=0,
-                    completion_tokens=0,
-                    total_tokens=0,
-                    cached_tokens=0,
-                    success=False,
-                    error_message=str(e)
-                )
+            global_llm_monitor.log_failure(call_id, str(e))
             raise e
     
     def invoke(self, prompt: str, purpose: str = "未指定") -> str:
@@ -119,48 +152,37 @@ class GeminiAdapter(BaseLLMAdapter):
                 base_url=self.base_url
             )
 
-    def invoke_with_monitoring(self, prompt: str, call_purpose: Optional[str] = None) -> str:
-        """带监控的调用方法"""
+    def invoke_with_monitoring(self, prompt: str, call_purpose: Optional[str] = None,
+                               stage: Optional[str] = None, chapter_number: Optional[int] = None) -> str:
+        """带监控的调用方法，stage/chapter_number 未指定时取自当前调用上下文"""
         call_id = str(uuid.uuid4())
+        # 预算和提示词长度检查放在try之外：BudgetExceededError / PromptTooLongError 需要向上抛出
+        model_name, max_tokens = self._prepare_call(prompt, stage)
         
         try:
             # 记录调用开始
-            if global_llm_monitor.enabled:
-                final_call_purpose = call_purpose or "未指定"
-                global_llm_monitor.logger.log_call_start(
-                    call_id=call_id,
-                    model_name=self.model_name,
-                    call_purpose=final_call_purpose,
-                    temperature=self.temperature
-                )
+            global_llm_monitor.log_start(
+                call_id, model_name, call_purpose, self.temperature, prompt=prompt,
+                stage=stage, chapter_number=chapter_number
+            )
             
             # 执行实际调用
-            response = self._client.chat.completions.create(
-                model=self.model_name,
+            response, ttft_s = self._create_completion(
+                self._client,
+                model=model_name,
                 messages=[{
                         "role": "user",
                         "content": prompt
                     }],
                 reasoning_effort="high",
-                max_tokens=self.max_tokens,
+                max_tokens=max_tokens,
                 temperature=self.temperature,
                 timeout=self.timeout if self.timeout is not None else 600000           
                 )
             
             if response:
-                print(f"response是：{response}")
-                
                 # 记录调用结束
-                if global_llm_monitor.enabled:
-                    usage_info = global_llm_monitor._parse_usage_from_response(response)
-                    global_llm_monitor.logger.log_call_end(
-                        call_id=call_id,
-                        prompt_tokens=usage_info['prompt_tokens'],
-                        completion_tokens=usage_info['completion_tokens'],
-                        total_tokens=usage_info['total_tokens'],
-                        cached_tokens=usage_info['cached_tokens'],
-                        success=True
-                    )
+                global_llm_monitor.log_success(call_id, response, ttft_s, model_name)
                 
                 # 确保返回值不为None
                 content = response.choices[0].message.content
@@ -168,30 +190,12 @@ class GeminiAdapter(BaseLLMAdapter):
             else:
                 logging.warning("No text response from Gemini API.")
                 # 记录调用失败
-                if global_llm_monitor.enabled:
-                    global_llm_monitor.logger.log_call_end(
-                        call_id=call_id,
-                        prompt_tokens=0,
-                        completion_tokens=0,
-                        total_tokens=0,
-                        cached_tokens=0,
-                        success=False,
-                        error_message="No text response from Gemini API"
-                    )
+                global_llm_monitor.log_failure(call_id, "No text response from Gemini API")
                 return ""
         except Exception as e:
             logging.error(f"Gemini API 调用失败: {e}")
             # 记录调用失败
-            if global_llm_monitor.enabled:
-                global_llm_monitor.logger.log_call_end(
-                    call_id=call_id,
-                    prompt_tokens=0,
-                    completion_tokens=0,
-                    total_tokens=0,
-                    cached_tokens=0,
-                    success=False,
-                    error_message=str(e)
-                )
+            global_llm_monitor.log_failure(call_id, str(e))
             return ""
     
     def invoke(self, prompt: str, purpose: str = "未指定") -> str:
@@ -215,9 +219,12 @@ class QwenAdapter(BaseLLMAdapter):
             base_url=self.base_url
         )
 
-    def invoke_with_monitoring(self, prompt: str, call_purpose: Optional[str] = None) -> str:
-        """带监控的调用方法"""
+    def invoke_with_monitoring(self, prompt: str, call_purpose: Optional[str] = None,
+                               stage: Optional[str] = None, chapter_number: Optional[int] = None) -> str:
+        """带监控的调用方法，stage/chapter_number 未指定时取自当前调用上下文"""
         call_id = str(uuid.uuid4())
+        # 预算和提示词长度检查放在try之外：BudgetExceededError / PromptTooLongError 需要向上抛出
+        model_name, max_tokens = self._prepare_call(prompt, stage)
         
         try:
             # 检查 _client 是否已正确初始化
@@ -225,18 +232,15 @@ class QwenAdapter(BaseLLMAdapter):
                 raise ValueError("OpenAI client not initialized.")
             
             # 记录调用开始
-            if global_llm_monitor.enabled:
-                final_call_purpose = call_purpose or "未指定"
-                global_llm_monitor.logger.log_call_start(
-                    call_id=call_id,
-                    model_name=self.model_name,
-                    call_purpose=final_call_purpose,
-                    temperature=self.temperature
-                )
+            global_llm_monitor.log_start(
+                call_id, model_name, call_purpose, self.temperature, prompt=prompt,
+                stage=stage, chapter_number=chapter_number
+            )
 
             # 执行实际调用
-            completion = self._client.chat.completions.create(
-                model=self.model_name,
+            completion, ttft_s = self._create_completion(
+                self._client,
+                model=model_name,
                 messages=[
                     {"role": "user", "content": prompt}
                 ],
@@ -244,22 +248,13 @@ class QwenAdapter(BaseLLMAdapter):
                 # 如果直接支持 enable_thinking，则可以这样写：enable_thinking=True/False
                 # 如果需要通过 extra_body 传递，则 extra_body 应该是一个字典
                 extra_body={"enable_thinking": True}, # 假设通过 extra_body 传递
-                max_tokens=self.max_tokens,
+                max_tokens=max_tokens,
                 temperature=self.temperature,
                 timeout=self.timeout if self.timeout is not None else 600
             )
             
             # 记录调用结束
-            if global_llm_monitor.enabled:
-                usage_info = global_llm_monitor._parse_usage_from_response(completion)
-                global_llm_monitor.logger.log_call_end(
-                    call_id=call_id,
-                    prompt_tokens=usage_info['prompt_tokens'],
-                    completion_tokens=usage_info['completion_tokens'],
-                    total_tokens=usage_info['total_tokens'],
-                    cached_tokens=usage_info['cached_tokens'],
-                    success=True
-                )
+            global_llm_monitor.log_success(call_id, completion, ttft_s, model_name)
             
             # 确保返回值不为None
             content = completion.choices[0].message.content
@@ -267,16 +262,7 @@ class QwenAdapter(BaseLLMAdapter):
         except Exception as e:
             logging.error(f"Qwen API 调用失败: {e}")
             # 记录调用失败
-            if global_llm_monitor.enabled:
-                global_llm_monitor.logger.log_call_end(
-                    call_id=call_id,
-                    prompt_tokens=0,
-                    completion_tokens=0,
-                    total_tokens=0,
-                    cached_tokens=0,
-                    success=False,
-                    error_message=str(e)
-                )
+            global_llm_monitor.log_failure(call_id, str(e))
             return ""
     
     def invoke(self, prompt: str, purpose: str = "未指定") -> str:
@@ -0,0 +1,134 @@
+# log_setup.py
+# -*- coding: utf-8 -*-
+"""
+异步日志
+调用方（包括线程池中的任务）只把日志记录放进内存队列（QueueHandler），
+由后台线程（QueueListener）写入控制台和日志文件，写磁盘/终端不再阻塞生成流程。
+日志文件按大小轮转，轮转出的旧文件压缩为 .gz。
+可按流程阶段（call_context 中的 stage）设置不同的日志级别，例如只对 chapter_draft 打开 DEBUG。
+
+配置（llm_monitor_config.json 的 logging 部分）：
+    level          默认日志级别
+    file           日志文件（setup_logging 未指定文件时使用）
+    max_bytes      单个日志文件的最大字节数，超过后轮转，0表示不轮转
+    backup_count   保留的轮转文件个数
+    compress       轮转出的文件是否gzip压缩
+    stage_levels   阶段 -> 日志级别，如 {"chapter_draft": "DEBUG", "finalize_state": "WARNING"}
+"""
+import os
+import gzip
+import queue
+import shutil
+import atexit
+import logging
+import logging.handlers
+from typing import Dict, Optional
+from database.config_manager import global_config
+from database.call_context import get_call_context
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - [%(stage)s] %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_stage_filter: Optional["StageLevelFilter"] = None
+
+
+def _to_level(value, default: int = logging.INFO) -> int:
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).upper())
+    return level if isinstance(level, int) else default
+
+
+class StageLevelFilter(logging.Filter):
+    """在调用方线程中读取当前阶段写入 record.stage，并按阶段的日志级别过滤"""
+
+    def __init__(self, default_level: int, stage_levels: Dict[str, int]):
+        super().__init__()
+        self.default_level = default_level
+        self.stage_levels = stage_levels
+
+    def level_for(self, stage: Optional[str]) -> int:
+        return self.stage_levels.get(stage, self.default_level)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        stage = get_call_context().get("stage")
+        record.stage = stage or "-"
+        return record.levelno >= self.level_for(stage)
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _build_file_handler(log_file: str, settings: Dict) -> logging.Handler:
+    max_bytes = int(settings.get('max_bytes', 10 * 1024 * 1024) or 0)
+    handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=int(settings.get('backup_count', 5) or 0),
+        encoding='utf-8'
+    )
+    if settings.get('compress', True):
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = _gzip_rotator
+    return handler
+
+
+def setup_logging(log_file: Optional[str] = None, console: bool = True) -> None:
+    """
+    配置根日志器：QueueHandler -> 后台线程 -> (控制台, 轮转日志文件)。
+    重复调用时先停止之前的后台线程。
+    """
+    global _listener, _stage_filter
+    stop_logging()
+    settings = global_config.get('logging', {}) or {}
+    default_level = _to_level(settings.get('level', 'INFO'))
+    stage_levels = {stage: _to_level(level, default_level)
+                    for stage, level in (settings.get('stage_levels') or {}).items()}
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    log_file = log_file or settings.get('file')
+    if log_file:
+        handlers.append(_build_file_handler(log_file, settings))
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    _stage_filter = StageLevelFilter(default_level, stage_levels)
+    queue_handler.addFilter(_stage_filter)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    # 根日志器取所有阶段中最低的级别，具体是否输出由阶段过滤器决定
+    root.setLevel(min([default_level] + list(stage_levels.values())))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """停止后台写日志线程，并写完队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def is_enabled_for(level: int) -> bool:
+    """当前阶段是否会输出该级别的日志（用于跳过构造开销较大的日志内容）"""
+    if not logging.getLogger().isEnabledFor(level):
+        return False
+    if _stage_filter is None:
+        return True
+    return level >= _stage_filter.level_for(get_call_context().get("stage"))
+
+
+atexit.register(stop_logging)
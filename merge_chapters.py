@@ -1,39 +1,295 @@
+"""
+合并章节并导出为 txt / Markdown / EPUB
+逐章读取、逐章写出，内存占用与章节总数无关；章节标题和目录取自 Novel_directory.txt。
+导出时在输出文件旁记录清单（<输出文件>.manifest.json），再次导出时：
+    - txt / Markdown：从第一个发生变化的章节处截断并续写，之前的章节不再重写（只新增章节时即为追加）；
+      Markdown 的目录写在全书末尾，每次导出随续写的章节一起重写
+    - EPUB：未变化章节的XHTML直接从上一次导出的EPUB中复制，只重新渲染变化的章节
+"""
 import os
+import re
+import json
+import contextlib
+import html
+import uuid
+import shutil
+import zipfile
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from chapter_directory_parser import parse_chapter_blueprint
 
-def merge_chapters(input_folder, output_file):
-    merged_content = []
-    chapter_files = []
-
-    # 遍历输入文件夹，收集所有txt文件
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.txt'):
-            try:
-                # 提取文件名中的数字作为章节号
-                chapter_num = int(filename.replace('chapter_', '').replace('.txt', ''))
-                chapter_files.append((chapter_num, filename))
-            except ValueError:
-                # 忽略不符合命名规范的文件
-                continue
-
-    # 按章节号排序文件
-    chapter_files.sort()
-
-    for i, (chapter_num, filename) in enumerate(chapter_files):
-        file_path = os.path.join(input_folder, filename)
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            # 添加章节标题
-            merged_content.append(f"第{chapter_num}章\n")
-            merged_content.append(content)
-            merged_content.append("\n\n") # 在章节之间添加空行以便阅读
-
-    # 将合并后的内容写入输出文件
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(''.join(merged_content))
+_CHAPTER_FILE_PATTERN = re.compile(r'^chapter_(\d+)\.txt$')
+
+FORMATS = ("txt", "md", "epub")
+
+
+def list_chapter_files(input_folder: str) -> List[Tuple[int, str]]:
+    """按章节号排序的 (章节号, 文件路径) 列表，忽略不符合 chapter_N.txt 命名的文件"""
+    chapters = []
+    with os.scandir(input_folder) as entries:
+        for entry in entries:
+            match = _CHAPTER_FILE_PATTERN.match(entry.name)
+            if match and entry.is_file():
+                chapters.append((int(match.group(1)), entry.path))
+    chapters.sort()
+    return chapters
+
+
+def load_chapter_titles(filepath: str) -> Dict[int, str]:
+    """从 Novel_directory.txt 读取 章节号 -> 标题"""
+    directory_file = os.path.join(filepath, "Novel_directory.txt")
+    if not os.path.exists(directory_file):
+        return {}
+    with open(directory_file, 'r', encoding='utf-8') as f:
+        chapters = parse_chapter_blueprint(f.read())
+    return {ch["chapter_number"]: ch["chapter_title"] for ch in chapters if ch.get("chapter_title")}
+
+
+def chapter_heading(chapter_num: int, titles: Dict[int, str]) -> str:
+    title = titles.get(chapter_num)
+    return f"第{chapter_num}章 {title}" if title else f"第{chapter_num}章"
+
+
+def _file_key(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _read_chapter(path: str) -> str:
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def _load_manifest(manifest_file: str) -> dict:
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest_file: str, manifest: dict) -> None:
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_file, manifest_file)
+
+
+# ---------------- txt / Markdown ----------------
+
+def _render_text_chapter(fmt: str, chapter_num: int, heading: str, content: str) -> str:
+    if fmt == "md":
+        return f'## <a id="chapter-{chapter_num}"></a>{heading}\n\n' + content.replace("\n", "\n\n") + "\n\n"
+    # 章节之间空一行以便阅读
+    return f"{heading}\n{content}\n\n\n"
+
+
+def _render_text_header(fmt: str, book_title: str) -> str:
+    return f"# {book_title}\n\n" if fmt == "md" else ""
+
+
+def _render_text_trailer(fmt: str, chapters: List[Tuple[int, str]], titles: Dict[int, str]) -> str:
+    """Markdown 的目录放在全书末尾：目录随章节增加而变化，放在开头会使每次导出都从头重写"""
+    if fmt != "md":
+        return ""
+    toc = "\n".join(f"- [{chapter_heading(num, titles)}](#chapter-{num})" for num, _ in chapters)
+    return f"## 目录\n\n{toc}\n"
 
+
+def _export_text(fmt: str, chapters: List[Tuple[int, str]], output_file: str, titles: Dict[int, str],
+                 book_title: str, previous: dict) -> Tuple[dict, int]:
+    header = _render_text_header(fmt, book_title)
+    header_hash = hashlib.sha1(header.encode('utf-8')).hexdigest()
+    old_entries = previous.get("chapters", [])
+
+    # 找到可以保留的最长前缀：目录和之前的章节都未变化
+    keep = 0
+    if (previous.get("format") == fmt and previous.get("header") == header_hash
+            and os.path.exists(output_file) and os.path.getsize(output_file) == previous.get("size")):
+        for old, (chapter_num, path) in zip(old_entries, chapters):
+            if old["chapter"] != chapter_num or old["source"] != _file_key(path) \
+                    or old["heading"] != chapter_heading(chapter_num, titles):
+                break
+            keep += 1
+
+    entries = old_entries[:keep]
+    with open(output_file, 'r+b' if keep else 'wb') as f:
+        if keep:
+            # 从最后一个保留章节的末尾截断（同时去掉上次写在末尾的目录）
+            f.seek(entries[-1]["end"])
+            f.truncate()
+        else:
+            f.write(header.encode('utf-8'))
+        for chapter_num, path in chapters[keep:]:
+            start = f.tell()
+            heading = chapter_heading(chapter_num, titles)
+            f.write(_render_text_chapter(fmt, chapter_num, heading, _read_chapter(path)).encode('utf-8'))
+            entries.append({"chapter": chapter_num, "source": _file_key(path), "heading": heading,
+                            "start": start, "end": f.tell()})
+        f.write(_render_text_trailer(fmt, chapters, titles).encode('utf-8'))
+        size = f.tell()
+    manifest = {"format": fmt, "header": header_hash, "size": size, "chapters": entries}
+    return manifest, len(chapters) - keep
+
+
+# ---------------- EPUB ----------------
+
+_CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+def _render_xhtml_chapter(heading: str, content: str) -> str:
+    paragraphs = "\n".join(f"<p>{html.escape(line.strip())}</p>" for line in content.splitlines() if line.strip())
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="zh-CN">
+<head><meta charset="UTF-8"/><title>{html.escape(heading)}</title></head>
+<body>
+<h2>{html.escape(heading)}</h2>
+{paragraphs}
+</body>
+</html>
+"""
+
+
+def _render_opf(book_id: str, book_title: str, chapters: List[Tuple[int, str]]) -> str:
+    items = "\n".join(
+        f'    <item id="chapter-{num}" href="chapter_{num}.xhtml" media-type="application/xhtml+xml"/>'
+        for num, _ in chapters
+    )
+    spine = "\n".join(f'    <itemref idref="chapter-{num}"/>' for num, _ in chapters)
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id" xml:lang="zh-CN">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">urn:uuid:{book_id}</dc:identifier>
+    <dc:title>{html.escape(book_title)}</dc:title>
+    <dc:language>zh-CN</dc:language>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+{items}
+  </manifest>
+  <spine>
+{spine}
+  </spine>
+</package>
+"""
+
+
+def _render_nav(book_title: str, chapters: List[Tuple[int, str]], titles: Dict[int, str]) -> str:
+    links = "\n".join(
+        f'      <li><a href="chapter_{num}.xhtml">{html.escape(chapter_heading(num, titles))}</a></li>'
+        for num, _ in chapters
+    )
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="zh-CN">
+<head><meta charset="UTF-8"/><title>{html.escape(book_title)}</title></head>
+<body>
+  <nav epub:type="toc" id="toc">
+    <h1>目录</h1>
+    <ol>
+{links}
+    </ol>
+  </nav>
+</body>
+</html>
+"""
+
+
+def _export_epub(chapters: List[Tuple[int, str]], output_file: str, titles: Dict[int, str],
+                 book_title: str, previous: dict) -> Tuple[dict, int]:
+    old_entries = {}
+    old_epub = None
+    if previous.get("format") == "epub" and os.path.exists(output_file):
+        old_entries = {entry["chapter"]: entry for entry in previous.get("chapters", [])}
+        old_epub = output_file + ".old"
+        shutil.move(output_file, old_epub)
+    book_id = previous.get("book_id") or str(uuid.uuid4())
+
+    entries, rendered = [], 0
+    try:
+        with (zipfile.ZipFile(old_epub) if old_epub else contextlib.nullcontext()) as old_zip, \
+                zipfile.ZipFile(output_file, 'w') as zf:
+            # mimetype 必须是第一个且不压缩
+            zf.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+            zf.writestr("META-INF/container.xml", _CONTAINER_XML, compress_type=zipfile.ZIP_DEFLATED)
+            for chapter_num, path in chapters:
+                heading = chapter_heading(chapter_num, titles)
+                name = f"OEBPS/chapter_{chapter_num}.xhtml"
+                old = old_entries.get(chapter_num)
+                entry = {"chapter": chapter_num, "source": _file_key(path), "heading": heading}
+                if old_zip is not None and old and old["source"] == entry["source"] and old["heading"] == heading:
+                    with old_zip.open(name) as src, zf.open(name, 'w', force_zip64=True) as dst:
+                        shutil.copyfileobj(src, dst)
+                else:
+                    zf.writestr(name, _render_xhtml_chapter(heading, _read_chapter(path)),
+                                compress_type=zipfile.ZIP_DEFLATED)
+                    rendered += 1
+                entries.append(entry)
+            zf.writestr("OEBPS/nav.xhtml", _render_nav(book_title, chapters, titles),
+                        compress_type=zipfile.ZIP_DEFLATED)
+            zf.writestr("OEBPS/content.opf", _render_opf(book_id, book_title, chapters),
+                        compress_type=zipfile.ZIP_DEFLATED)
+    except Exception:
+        if old_epub and os.path.exists(old_epub):
+            shutil.move(old_epub, output_file)
+        raise
+    if old_epub:
+        os.remove(old_epub)
+    return {"format": "epub", "book_id": book_id, "chapters": entries}, rendered
+
+
+def export_novel(filepath: str, output_file: str, fmt: Optional[str] = None,
+                 book_title: Optional[str] = None, incremental: bool = True,
+                 input_folder: Optional[str] = None) -> int:
+    """
+    把 input_folder（默认为 filepath/chapters）下的章节按顺序导出到 output_file，章节标题取自 filepath/Novel_directory.txt。
+    fmt 为 "txt" / "md" / "epub"，默认按扩展名判断；incremental 为True时只重写变化的章节。
+    返回重新写入的章节数。
+    """
+    fmt = (fmt or os.path.splitext(output_file)[1].lstrip(".") or "txt").lower()
+    if fmt == "markdown":
+        fmt = "md"
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+
+    chapters = list_chapter_files(input_folder or os.path.join(filepath, "chapters"))
+    titles = load_chapter_titles(filepath)
+    book_title = book_title or os.path.basename(os.path.abspath(filepath))
+    manifest_file = output_file + ".manifest.json"
+    previous = _load_manifest(manifest_file) if incremental else {}
+
+    if fmt == "epub":
+        manifest, written = _export_epub(chapters, output_file, titles, book_title, previous)
+    else:
+        manifest, written = _export_text(fmt, chapters, output_file, titles, book_title, previous)
+    _save_manifest(manifest_file, manifest)
+    logging.info(f"已导出 {len(chapters)} 章到 {output_file}，其中重新写入 {written} 章")
+    return written
+
+
+def merge_chapters(input_folder, output_file):
+    """把 input_folder 中的章节合并为一个txt文件（流式写入）"""
+    filepath = os.path.dirname(os.path.abspath(input_folder))
+    export_novel(filepath, output_file, fmt="txt", input_folder=input_folder)
     print(f"所有章节已成功合并到 {output_file}")
 
+
 if __name__ == "__main__":
-    input_folder = 'Novel_Output/chapters'
-    output_file = 'Novel_Output/merged_novel.txt'
-    merge_chapters(input_folder, output_file)
\ No newline at end of file
+    import sys
+    # 用法：python merge_chapters.py [txt|md|epub]
+    fmt = sys.argv[1] if len(sys.argv) > 1 else "txt"
+    filepath = 'Novel_Output'
+    output_file = os.path.join(filepath, f"merged_novel.{fmt}")
+    export_novel(filepath, output_file, fmt=fmt)
+    print(f"所有章节已成功导出到 {output_file}")
@@ -12,9 +12,12 @@ from prompts.character_dynamics_prompt import character_dynamics_prompt
 from prompts.world_building_prompt import world_building_prompt
 from prompts.plot_architecture_prompt import plot_architecture_prompt
 from prompt_definitions import create_character_state_prompt
-from utils import clear_file_content, save_string_to_txt
+from utils import save_string_to_txt
+from tracing import traced
+from novel_generator.executor import run_blocking
 
 
+@traced("stage.architecture")
 async def Novel_architecture_generate(
     interface_format: str,
     api_key: str,
@@ -66,7 +69,6 @@ async def Novel_architecture_generate(
         if not character_dynamics_result.strip():
             logging.warning("角色信息生成失败")
             return
-        clear_file_content(character_information_file)
         save_string_to_txt(character_dynamics_result, character_information_file)
     else:
         logging.info("角色信息文件已存在，跳过生成...")
@@ -84,7 +86,6 @@ async def Novel_architecture_generate(
         if not character_state_init.strip():
             logging.warning("角色初始状态生成失败")
             return
-        clear_file_content(character_state_file)
         save_string_to_txt(character_state_init, character_state_file)
         logging.info("角色初始状态生成完毕")
     elif os.path.exists(character_state_file):
@@ -106,7 +107,6 @@ async def Novel_architecture_generate(
         if not world_building_result.strip():
             logging.warning("世界观生成失败")
             return
-        clear_file_content(world_building_file)
         save_string_to_txt(world_building_result, world_building_file)
     else:
         logging.info("世界观已经存在，跳过生成...")
@@ -142,7 +142,6 @@ async def Novel_architecture_generate(
     )
 
     arch_file = os.path.join(filepath, "Novel_architecture.txt")
-    clear_file_content(arch_file)
     save_string_to_txt(final_content, arch_file)
     logging.info("Novel_architecture.txt文件已生成.")
 
@@ -291,7 +290,6 @@ async def generate_multi_model_plot_architecture(
     comparison_content += "4. 重新运行生成流程以继续后续步骤\n"
     comparison_content += "=" * 60 + "\n"
     
-    clear_file_content(comparison_file)
     save_string_to_txt(comparison_content, comparison_file)
     
     logging.info(f"多模型情节架构生成完成！已保存 {len(plot_results)} 个版本")
@@ -351,21 +349,16 @@ async def _generate_single_plot_async(
             world_building=world_building_result.strip()
         )
         
-        # 在单独的线程中运行同步的LLM调用，避免阻塞事件循环
-        loop = asyncio.get_running_loop()
-        # 调用 run_in_executor 将同步的LLM调用提交到线程池
-        plot_result = await loop.run_in_executor(
-            None,  # 使用默认的线程池执行器
-            lambda: invoke_with_cleaning(
-                llm_adapter, 
-                prompt_plot, 
-                purpose=f"{config['name']}生成情节架构"
-            )
+        # 在共享线程池中运行同步的LLM调用，避免阻塞事件循环（会复制当前上下文以保留监控用的 novel_id/stage）
+        plot_result = await run_blocking(
+            invoke_with_cleaning,
+            llm_adapter,
+            prompt_plot,
+            purpose=f"{config['name']}生成情节架构"
         )
         
         if plot_result.strip():
             # 保存结果到对应文件
-            clear_file_content(plot_file)
             save_string_to_txt(plot_result, plot_file)
             return plot_result.strip()
         else:
@@ -6,10 +6,25 @@
 import os
 import re
 import logging
+from typing import Dict, List, Optional, Tuple
 from novel_generator.common import invoke_with_cleaning
+from novel_generator.executor import get_executor
+from novel_generator.blueprint_assembly import BlueprintAssembler
 from llm_adapters import create_llm_adapter
-from prompt_definitions import chapter_blueprint_prompt, chunked_chapter_blueprint_prompt, part_based_chapter_blueprint_prompt
-from utils import read_file, clear_file_content, save_string_to_txt
+from prompt_definitions import (
+    chapter_blueprint_prompt, chunked_chapter_blueprint_prompt, part_based_chapter_blueprint_prompt,
+    chapter_skeleton_prompt, skeleton_chunk_blueprint_prompt, blueprint_boundary_reconcile_prompt,
+    parallel_part_chapter_blueprint_prompt
+)
+from utils import read_file, save_string_to_txt
+from chapter_directory_parser import tokenize_blueprint, last_blueprint_entries, split_blueprint_entries
+from tracing import traced
+
+
+# 剧情部分：第一部分：标题\n\n内容
+_PLOT_PART_PATTERN = re.compile(
+    r'第([一二三四五六七八九十]+)部分：([^\n]+)\n\n(.*?)(?=第[一二三四五六七八九十]+部分：|$)', re.DOTALL
+)
 
 
 def parse_plot_parts(plot_text: str) -> list:
@@ -17,11 +32,7 @@ def parse_plot_parts(plot_text: str) -> list:
     从plot.txt文件中解析出各个剧情部分
     返回剧情部分列表，每个元素包含部分标题和内容
     """
-    import re
-    
-    # 使用正则表达式匹配每个部分
-    pattern = r'第([一二三四五六七八九十]+)部分：([^\n]+)\n\n(.*?)(?=第[一二三四五六七八九十]+部分：|$)'
-    matches = re.findall(pattern, plot_text, re.DOTALL)
+    matches = _PLOT_PART_PATTERN.findall(plot_text)
     
     parts = []
     for match in matches:
@@ -42,18 +53,7 @@ def get_recent_part_chapters(blueprint_text: str, chapters_per_part: int = 15) -
     """
     if not blueprint_text.strip():
         return ""
-    
-    # 提取所有章节
-    pattern = r"(第\s*\d+\s*章.*?)(?=第\s*\d+\s*章|$)"
-    chapters = re.findall(pattern, blueprint_text, flags=re.DOTALL)
-    
-    if not chapters:
-        return ""
-    
-    # 获取最近的一个部分的章节（按chapters_per_part数量）
-    recent_chapters = chapters[-chapters_per_part:] if len(chapters) >= chapters_per_part else chapters
-    
-    return "\n\n".join(recent_chapters).strip()
+    return last_blueprint_entries(blueprint_text, chapters_per_part)
 
 
 
@@ -97,18 +97,201 @@ def limit_chapter_blueprint(blueprint_text: str, limit_chapters: int = 50) -> st
     从已有章节目录中只取最近的 limit_chapters 章，限制章节目录的长度，
     以避免在生成章节蓝图时，传递给大语言模型的提示（prompt）过长
     """
-    # 捕获每个章节的完整内容，包括章节标题和其后的文本，直到下一个章节的开始
-    pattern = r"(第\s*\d+\s*章.*?)(?=第\s*\d+\s*章|$)"
-    # 在 blueprint_text（章节蓝图文本）中查找所有符合 pattern 定义的章节
-    chapters = re.findall(pattern, blueprint_text, flags=re.DOTALL)
-    if not chapters:
+    entries = tokenize_blueprint(blueprint_text)
+    if len(entries) <= limit_chapters:
         return blueprint_text
-    if len(chapters) <= limit_chapters:
-        return blueprint_text
-    # 如果提取出的章节数量超过了 limit_chapters （默认是50章），它会只保留最近的 limit_chapters 章
-    selected = chapters[-limit_chapters:]
-    return "\n\n".join(selected).strip()
+    # 章节数量超过 limit_chapters （默认是50章）时，只保留最近的 limit_chapters 章
+    return "\n\n".join(entry.raw_text for entry in entries[-limit_chapters:]) if limit_chapters > 0 else ""
+
+
+# 并行生成时，交界处前后各修订的章节数
+BOUNDARY_CHAPTERS = 2
+
+
+def allocate_part_chapters(parts: list, number_of_chapters: int) -> List[Tuple[dict, int, int]]:
+    """
+    按各剧情部分内容的长度把章节分配给剧情部分，返回 [(部分, 起始章, 结束章), ...]。
+    章节数不少于部分数时每个部分至少分到一章；按最大余数法取整，保证总数正好是 number_of_chapters。
+    """
+    if not parts or number_of_chapters <= 0:
+        return []
+    parts = parts[:number_of_chapters]
+    weights = [max(1, len(part['content'])) for part in parts]
+    spare = number_of_chapters - len(parts)
+    shares = [spare * weight / sum(weights) for weight in weights]
+    counts = [1 + int(share) for share in shares]
+    by_remainder = sorted(range(len(parts)), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_remainder[:number_of_chapters - sum(counts)]:
+        counts[i] += 1
+
+    allocation = []
+    first = 1
+    for part, count in zip(parts, counts):
+        allocation.append((part, first, first + count - 1))
+        first += count
+    return allocation
+
+
+def format_part_ranges(allocation: List[Tuple[dict, int, int]]) -> str:
+    """剧情部分分界的文本形式，如 "第一部分：标题（第1-20章）"，没有剧情部分时返回"（无）\""""
+    if not allocation:
+        return "（无）"
+    return "\n".join(f"第{part['number']}部分：{part['title']}（第{first}-{last}章）"
+                     for part, first, last in allocation)
+
+
+def _load_skeleton(skeleton_file: str, chapters: range) -> Optional[Dict[int, str]]:
+    """读取已保存的章节骨架，覆盖全部 chapters 时才复用"""
+    if not os.path.exists(skeleton_file):
+        return None
+    lines = split_blueprint_entries(read_file(skeleton_file))
+    if all(number in lines for number in chapters):
+        return lines
+    return None
+
+
+def _expand_chunk(assembler: BlueprintAssembler, llm_adapter, prompt: str, index: int, chunk: range) -> None:
+    """生成一个分块的章节目录，作为定号片段交给装配器（范围外的章节在装配时丢弃）"""
+    result = invoke_with_cleaning(llm_adapter, prompt, purpose=f"按骨架生成[{chunk.start}..{chunk.stop - 1}]章目录")
+    assembler.add(result, sequence=index, expected=chunk)
+
+
+def _skeleton_reference(skeleton: Dict[int, str], before: range, after: range) -> str:
+    """交界前后（各多一章）的骨架行"""
+    return "\n".join(skeleton[number] for number in range(before.start - 1, after.stop + 1) if number in skeleton)
+
+
+def _reconcile_boundary(llm_adapter, reference: str, entries: Dict[int, str],
+                        before: range, after: range) -> Dict[int, str]:
+    """
+    修订一个交界处前后的章节，reference 为交界附近的章节骨架或剧情部分，
+    返回 章节号 -> 修订后的文本（只含交界范围内的章节）
+    """
+    window = range(before.start, after.stop)
+    prompt = blueprint_boundary_reconcile_prompt.format(
+        reference=reference,
+        before="\n\n".join(entries[number] for number in before),
+        after="\n\n".join(entries[number] for number in after),
+    )
+    result = invoke_with_cleaning(llm_adapter, prompt, purpose=f"修订第{before.stop - 1}/{after.start}章交界")
+    return {number: text for number, text in split_blueprint_entries(result).items() if number in window}
+
+
+def boundary_windows(blocks: List[range]) -> List[Tuple[range, range]]:
+    """
+    相邻两块（章节号首尾相接）交界处需要修订的章节：前一块的最后几章和后一块的开头几章，
+    每侧不超过 BOUNDARY_CHAPTERS 章和该块的一半
+    """
+    windows = []
+    for left, right in zip(blocks, blocks[1:]):
+        if left.stop != right.start:
+            continue
+        width = max(1, min(BOUNDARY_CHAPTERS, len(left) // 2, len(right) // 2))
+        windows.append((range(left.stop - width, left.stop), range(right.start, right.start + width)))
+    return windows
+
+
+def reconcile_boundaries(llm_adapter, entries: Dict[int, str], boundaries: List[Tuple[range, range, str]]) -> None:
+    """
+    同时修订各交界，boundaries 为 [(前一块的最后几章, 后一块的开头几章, 参考内容), ...]，
+    全部完成后把修订结果写回 entries；修订失败的交界保留原文。
+    """
+    if not boundaries:
+        return
+    logging.info(f"修订{len(boundaries)}个交界")
+    pool = get_executor()
+    futures = [pool.submit(_reconcile_boundary, llm_adapter, reference, entries, before, after)
+               for before, after, reference in boundaries]
+    revised = {}
+    for (before, after, _), future in zip(boundaries, futures):
+        try:
+            revised.update(future.result())
+        except Exception as e:
+            logging.warning(f"第{before.stop - 1}/{after.start}章交界修订失败，保留原目录: {e}")
+    entries.update(revised)
 
+
+@traced("stage.blueprint_parallel")
+def generate_blueprint_parallel(
+    llm_adapter,
+    filepath: str,
+    architecture_text: str,
+    existing_blueprint: str,
+    number_of_chapters: int,
+    chunk_size: int,
+    limit_chapters: int
+) -> str:
+    """
+    并行生成剩余章节的目录，返回合并后的完整目录（同时写入 Novel_directory.txt）：
+    1. 章节骨架：一次调用列出剩余每章一行的标题和核心事件，剧情部分的分界按 plot.txt 中各部分的篇幅分配，
+       骨架保存在 Novel_skeleton.txt，续写时复用
+    2. 各分块以骨架为准同时展开，不再等待前一块的结果，结果作为定号片段交给 BlueprintAssembler
+    3. 交界修订：每两个完整且相接的分块交界处前后各 BOUNDARY_CHAPTERS 章一起修订一次，各交界同时进行
+    剩余章节从已有目录的最大章节号之后开始；已有目录中间的缺章和分块缺少的章节留给顺序生成补齐。
+    骨架没有覆盖全部剩余章节时直接返回原目录，由顺序生成处理。
+    """
+    assembler = BlueprintAssembler(existing_blueprint)
+    # 中间的缺章由之后的顺序生成补齐（分块范围截止到下一个已有章节），这里只并行生成已有目录之后的章节
+    first_chapter = max(assembler.assemble().entries, default=0) + 1
+    chapters = range(first_chapter, number_of_chapters + 1)
+    chunks = [range(start, min(start + chunk_size, number_of_chapters + 1))
+              for start in range(first_chapter, number_of_chapters + 1, chunk_size)]
+    if len(chunks) < 2:
+        return existing_blueprint
+
+    limited_blueprint = limit_chapter_blueprint(existing_blueprint, limit_chapters)
+    skeleton_file = os.path.join(filepath, "Novel_skeleton.txt")
+    skeleton = _load_skeleton(skeleton_file, chapters)
+    if skeleton is None:
+        allocation = allocate_part_chapters(parse_plot_parts(architecture_text), number_of_chapters)
+        skeleton_prompt = chapter_skeleton_prompt.format(
+            novel_architecture=architecture_text,
+            part_ranges=format_part_ranges(allocation),
+            chapter_list=limited_blueprint,
+            number_of_chapters=number_of_chapters,
+            n=first_chapter,
+            m=number_of_chapters,
+        )
+        logging.info(f"生成第{first_chapter}..{number_of_chapters}章的章节骨架")
+        skeleton_text = invoke_with_cleaning(llm_adapter, skeleton_prompt, purpose="生成章节骨架")
+        skeleton = split_blueprint_entries(skeleton_text)
+        missing = [number for number in chapters if number not in skeleton]
+        if missing:
+            logging.warning(f"章节骨架缺少{len(missing)}章（如第{missing[0]}章），改为顺序生成")
+            return existing_blueprint
+        save_string_to_txt("\n".join(skeleton[number] for number in chapters), skeleton_file)
+    skeleton_text = "\n".join(skeleton[number] for number in sorted(skeleton))
+
+    logging.info(f"按骨架同时生成{len(chunks)}个分块，每块{chunk_size}章")
+    pool = get_executor()
+    futures = []
+    for index, chunk in enumerate(chunks):
+        chunk_prompt = skeleton_chunk_blueprint_prompt.format(
+            novel_architecture=architecture_text,
+            skeleton=skeleton_text,
+            chapter_list=limited_blueprint if chunk.start == first_chapter else "",
+            number_of_chapters=number_of_chapters,
+            n=chunk.start,
+            m=chunk.stop - 1,
+        )
+        futures.append(pool.submit(_expand_chunk, assembler, llm_adapter, chunk_prompt, index, chunk))
+    for chunk, future in zip(chunks, futures):
+        try:
+            future.result()
+        except Exception as e:
+            logging.error(f"分块[{chunk.start}..{chunk.stop - 1}]生成失败: {e}")
+
+    assembly = assembler.assemble()
+    reconcile_boundaries(llm_adapter, assembly.entries, [
+        (before, after, _skeleton_reference(skeleton, before, after))
+        for before, after in boundary_windows(assembly.complete_blocks())
+    ])
+    final_blueprint = assembly.write(os.path.join(filepath, "Novel_directory.txt"))
+    logging.info(f"并行生成后目录共{len(assembly.entries)}章")
+    return final_blueprint
+
+
+@traced("stage.blueprint")
 def Chapter_blueprint_generate(
     interface_format: str,
     api_key: str,
@@ -120,7 +303,8 @@ def Chapter_blueprint_generate(
     chunk_size: int = 25,      # 每次生成多少章节的目录
     limit_chapters: int = 25,  # 每次生成章节目录时，传入已经生成好的最近25章的目录以供模型参考
     temperature: float = 0.7,
-    timeout: int = 300
+    timeout: int = 300,
+    parallel: bool = False     # 先生成章节骨架，再同时生成各分块（见 generate_blueprint_parallel）
 ) -> None:
     """
     函数作用：根据小说架构 ( Novel_architecture.txt 由architecture.py输出) 和用户指定的章节数量，生成详细的章节目录或蓝图。
@@ -130,6 +314,9 @@ def Chapter_blueprint_generate(
     否则：
       - 若章节数 <= chunk_size，直接一次性生成
       - 若章节数 > chunk_size，进行分块生成
+    续写从第一个缺失的章节开始（见 BlueprintAssembler），每块的结果按其中的章节号归位后再写入；
+    补中间的缺章时分块截止到下一个已有章节之前，并提供缺口之后的几章。
+    parallel为True且剩余章节超过一个分块时，先并行生成剩余章节，并行生成未完成的部分再按顺序补齐。
     生成完成后输出至 Novel_directory.txt。
     """
     '''
@@ -163,51 +350,23 @@ def Chapter_blueprint_generate(
     filename_dir = os.path.join(filepath, "Novel_directory.txt")
     # 如果Novel_directory.txt不存在，则创建一个
     if not os.path.exists(filename_dir):
-        open(filename_dir, "w", encoding="utf-8").close()
+        save_string_to_txt("", filename_dir)
 
     existing_blueprint = read_file(filename_dir).strip()
     logging.info(f"一共需要生成{number_of_chapters}章, 每次生成{chunk_size}章.")
 
-    # 如果 Novel_directory.txt 文件已存在且包含内容，函数会解析已有的章节数，并从下一个章节开始继续生成，实现断点续写功能
+    if parallel:
+        existing_blueprint = generate_blueprint_parallel(
+            llm_adapter, filepath, architecture_text, existing_blueprint,
+            number_of_chapters, chunk_size, limit_chapters
+        )
+
+    assembler = BlueprintAssembler(existing_blueprint)
+    # 如果 Novel_directory.txt 文件已存在且包含内容，从第一个缺失的章节开始继续生成，实现断点续写功能
     if existing_blueprint:
         logging.info("识别到已经生成的部分章节目录，将继续生成")
-        pattern = r"第\s*(\d+)\s*章"
-        existing_chapter_numbers = re.findall(pattern, existing_blueprint)
-        existing_chapter_numbers = [int(x) for x in existing_chapter_numbers if x.isdigit()]
-        # 当前已生成的最大章节数，如果还没又生成具体章节内容则为0
-        max_existing_chap = max(existing_chapter_numbers) if existing_chapter_numbers else 0
-        logging.info(f"已经生成了{max_existing_chap}章，将继续生成")
-        final_blueprint = existing_blueprint
-        # 准备开始生成的章节数
-        current_start = max_existing_chap + 1
-        while current_start <= number_of_chapters:
-            # 一次生成chunk_size个章节的目录
-            current_end = min(current_start + chunk_size - 1, number_of_chapters)
-            limited_blueprint = limit_chapter_blueprint(final_blueprint, limit_chapters)
-            chunk_prompt = chunked_chapter_blueprint_prompt.format(
-                novel_architecture=architecture_text,
-                chapter_list=limited_blueprint,
-                number_of_chapters=number_of_chapters,
-                n=current_start,
-                m=current_end,
-            )
-            logging.info(f"生成[{current_start}..{current_end}]章目录")
-            chunk_result = invoke_with_cleaning(llm_adapter, chunk_prompt, purpose="分块生成章节目录")
-            if not chunk_result.strip():
-                logging.warning(f"Chunk generation for chapters [{current_start}..{current_end}] is empty.")
-                clear_file_content(filename_dir)
-                save_string_to_txt(final_blueprint.strip(), filename_dir)
-                return
-            final_blueprint += "\n\n" + chunk_result.strip()
-            clear_file_content(filename_dir)
-            save_string_to_txt(final_blueprint.strip(), filename_dir)
-            current_start = current_end + 1
-
-        logging.info("所有的章节目录生成完毕")
-        return
-
     # 如果分块生成章节大小大于总共章节数，则可以一次生成所有章节
-    if chunk_size >= number_of_chapters:
+    elif chunk_size >= number_of_chapters:
         prompt = chapter_blueprint_prompt.format(
             novel_architecture=architecture_text,
             number_of_chapters=number_of_chapters,
@@ -218,18 +377,28 @@ def Chapter_blueprint_generate(
             logging.warning("Chapter blueprint generation result is empty.")
             return
 
-        clear_file_content(filename_dir)
-        save_string_to_txt(blueprint_text, filename_dir)
+        assembler.add(blueprint_text, expected=range(1, number_of_chapters + 1))
+        assembler.assemble().write(filename_dir)
         logging.info("Novel_directory.txt (chapter blueprint) has been generated successfully (single-shot).")
         return
+    else:
+        logging.info("Will generate chapter blueprint in chunked mode from scratch.")
 
-    logging.info("Will generate chapter blueprint in chunked mode from scratch.")
-    final_blueprint = ""
-    current_start = 1
+    assembly = assembler.assemble()
+    current_start = assembly.next_number
+    if existing_blueprint:
+        logging.info(f"已经生成了{len(assembly.entries)}章，将从第{current_start}章继续生成")
     # 不断生成章节目录，直到达到总章节数量
     while current_start <= number_of_chapters:
+        # 一次生成chunk_size个章节的目录
         current_end = min(current_start + chunk_size - 1, number_of_chapters)
-        limited_blueprint = limit_chapter_blueprint(final_blueprint, limit_chapters)
+        limited_blueprint = limit_chapter_blueprint(assembly.text(before=current_start), limit_chapters)
+        following = assembly.next_existing(current_start)
+        if following is not None:
+            # 补中间的缺章：只生成到下一个已有章节之前，并把缺口之后的几章一起提供给模型以便衔接
+            current_end = min(current_end, following - 1)
+            after_gap = [assembly.entries[number] for number in sorted(assembly.entries) if number >= following]
+            limited_blueprint = "\n\n".join([limited_blueprint] + after_gap[:BOUNDARY_CHAPTERS]).strip()
         chunk_prompt = chunked_chapter_blueprint_prompt.format(
             novel_architecture=architecture_text,
             chapter_list=limited_blueprint,
@@ -237,24 +406,83 @@ def Chapter_blueprint_generate(
             n=current_start,
             m=current_end,
         )
-        logging.info(f"Generating chapters [{current_start}..{current_end}] in a chunk...")
+        logging.info(f"生成[{current_start}..{current_end}]章目录")
         chunk_result = invoke_with_cleaning(llm_adapter, chunk_prompt, purpose="分块生成章节目录")
         if not chunk_result.strip():
             logging.warning(f"Chunk generation for chapters [{current_start}..{current_end}] is empty.")
-            clear_file_content(filename_dir)
-            save_string_to_txt(final_blueprint.strip(), filename_dir)
             return
-        if final_blueprint.strip():
-            final_blueprint += "\n\n" + chunk_result.strip()
-        else:
-            final_blueprint = chunk_result.strip()
-        clear_file_content(filename_dir)
-        save_string_to_txt(final_blueprint.strip(), filename_dir)
-        current_start = current_end + 1
+        # 分块的结果按其中的章节号归位，缺章、重复章由装配器检查，每块结束后写入一次
+        assembler.add(chunk_result, sequence=current_start, expected=range(current_start, current_end + 1))
+        assembly = assembler.assemble()
+        assembly.write(filename_dir, report=False)
+        if assembly.next_number <= current_start:
+            assembly.log_problems()
+            logging.warning(f"分块[{current_start}..{current_end}]没有生成第{current_start}章，停止生成")
+            return
+        current_start = assembly.next_number
 
+    assembly.log_problems()
     logging.info("Novel_directory.txt 章节目录已经成功生成")
 
 
+def _parts_reference(*parts: dict) -> str:
+    """交界两侧剧情部分的标题和内容"""
+    return "\n\n".join(f"第{part['number']}部分：{part['title']}\n\n{part['content']}" for part in parts)
+
+
+def _generate_part(assembler: BlueprintAssembler, llm_adapter, plot_parts: list,
+                   part_index: int, min_chapters: int) -> None:
+    """不依赖其他部分的结果生成一个剧情部分的章节目录，作为自由编号片段交给装配器"""
+    part = plot_parts[part_index]
+    part_prompt = parallel_part_chapter_blueprint_prompt.format(
+        plot_context=get_plot_context_for_part(plot_parts, part_index),
+        current_part_title=part['title'],
+        current_part_number=part['number'],
+        min_chapters=min_chapters
+    )
+    part_result = invoke_with_cleaning(llm_adapter, part_prompt, purpose=f"第{part['number']}部分章节目录生成")
+    if not part_result.strip():
+        logging.warning(f"第{part['number']}部分章节目录为空，跳过")
+        return
+    assembler.add(part_result, part=part_index)
+
+
+@traced("stage.blueprint_by_parts_parallel")
+def generate_parts_parallel(llm_adapter, filename_dir: str, plot_parts: list,
+                            existing_blueprint: str, min_chapters_per_part: int) -> str:
+    """
+    同时生成所有剧情部分的章节目录，每个部分只依赖自己的剧情上下文（get_plot_context_for_part），
+    各部分作为自由编号片段交给 BlueprintAssembler，按部分顺序统一编号（接在已有目录的最大章节号之后），
+    再同时修订每两个相邻部分交界处前后各 BOUNDARY_CHAPTERS 章，最后一次写入目录。
+    返回合并后的完整目录；生成结果为空的部分被跳过。
+    """
+    assembler = BlueprintAssembler(existing_blueprint)
+    pool = get_executor()
+    logging.info(f"同时生成{len(plot_parts)}个剧情部分的章节目录（每部分至少{min_chapters_per_part}章）")
+    futures = [pool.submit(_generate_part, assembler, llm_adapter, plot_parts, part_index, min_chapters_per_part)
+               for part_index in range(len(plot_parts))]
+    for part, future in zip(plot_parts, futures):
+        try:
+            future.result()
+        except Exception as e:
+            logging.error(f"第{part['number']}部分章节目录生成失败: {e}")
+
+    assembly = assembler.assemble()
+    # 各部分按部分顺序统一编号后的章节号范围，生成结果为空的部分不参与交界修订
+    blocks = [(plot_parts[part_index], assembly.blocks[(part_index, 0)])
+              for part_index in range(len(plot_parts))
+              if assembly.blocks.get((part_index, 0))]
+    for part, block in blocks:
+        logging.info(f"第{part['number']}部分：{part['title']} 生成{len(block)}章，编号为第{block.start}-{block.stop - 1}章")
+    windows = boundary_windows([block for _, block in blocks])
+    reconcile_boundaries(llm_adapter, assembly.entries, [
+        (before, after, _parts_reference(blocks[index][0], blocks[index + 1][0]))
+        for index, (before, after) in enumerate(windows)
+    ])
+    return assembly.write(filename_dir)
+
+
+@traced("stage.blueprint_by_parts")
 def Chapter_blueprint_generate_by_parts(
     interface_format: str,
     api_key: str,
@@ -264,7 +492,8 @@ def Chapter_blueprint_generate_by_parts(
     max_tokens: int,
     min_chapters_per_part: int = 15,  # 每个部分至少生成的章节数（用于提取最近部分章节）
     temperature: float = 0.7,
-    timeout: int = 300
+    timeout: int = 300,
+    parallel: bool = False  # True：同时生成所有部分后统一编号并修订交界；False：严格按顺序逐部分生成
 ) -> None:
     """
     基于plot.txt中的剧情部分来依次生成章节目录
@@ -280,6 +509,8 @@ def Chapter_blueprint_generate_by_parts(
     - 只提供最近一个部分已生成的章节目录
     - 每个部分要求生成至少{min_chapters_per_part}章，不指定具体数量
     - 在prompt中明确告知当前是根据第几部分生成目录
+
+    parallel为True时各部分不再等待前一部分的章节目录，见 generate_parts_parallel
     """
     plot_file = os.path.join(filepath, "plot.txt")
     if not os.path.exists(plot_file):
@@ -311,9 +542,15 @@ def Chapter_blueprint_generate_by_parts(
 
     filename_dir = os.path.join(filepath, "Novel_directory.txt")
     if not os.path.exists(filename_dir):
-        open(filename_dir, "w", encoding="utf-8").close()
+        save_string_to_txt("", filename_dir)
 
     existing_blueprint = read_file(filename_dir).strip()
+    if parallel:
+        generate_parts_parallel(llm_adapter, filename_dir, plot_parts, existing_blueprint, min_chapters_per_part)
+        logging.info("基于剧情部分的章节目录生成完成")
+        return
+
+    assembler = BlueprintAssembler(existing_blueprint)
     final_blueprint = existing_blueprint
     
     # 为每个剧情部分生成章节
@@ -350,15 +587,9 @@ def Chapter_blueprint_generate_by_parts(
             logging.warning(f"Part {part_index + 1} chapter generation result is empty.")
             continue
         
-        # 添加到总目录
-        if final_blueprint.strip():
-            final_blueprint += "\n\n" + part_result.strip()
-        else:
-            final_blueprint = part_result.strip()
-        
-        # 保存当前进度
-        clear_file_content(filename_dir)
-        save_string_to_txt(final_blueprint.strip(), filename_dir)
+        # 添加到总目录（按部分顺序接在已有章节之后统一编号），并保存当前进度
+        assembler.add(part_result, part=part_index)
+        final_blueprint = assembler.assemble().write(filename_dir)
         
         logging.info(f"第{part['number']}部分章节目录生成完成")
     
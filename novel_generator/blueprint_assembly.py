@@ -0,0 +1,177 @@
+#novel_generator/blueprint_assembly.py
+# -*- coding: utf-8 -*-
+"""
+章节目录装配
+分块、按剧情部分、并发或乱序生成的目录片段都先交给 BlueprintAssembler，
+按 (部分, 序号) 的顺序统一确定章节号，检查缺章和重复章，最后一次写入 Novel_directory.txt。
+续写时从第一个缺失的章节号开始（而不是目录中最大的章节号），中间缺的章节会被补上。
+
+片段分两种：
+- 定号片段（expected 给出应覆盖的章节号范围，如按骨架或分块生成的 n..m 章）：
+  按片段自带的章节号归位，范围外的章节丢弃，范围内缺少的章节记为缺章
+- 自由编号片段（expected 为 None，如按剧情部分生成、每部分从第1章编号的目录）：
+  按出现顺序接在已装配的最大章节号之后重新编号；片段内重复出现的原章节号只保留第一次，
+  重复和跳过的原章节号都会记录下来
+同一章节号出现多次时保留先装配的（已有目录优先，其次按 (部分, 序号) 的顺序），其余记为重复章。
+"""
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from chapter_directory_parser import BlueprintEntry, tokenize_blueprint, renumber_entry_text
+from utils import save_string_to_txt
+
+
+class BlueprintFragment(NamedTuple):
+    """一段生成结果：所属部分、部分内的序号、解析出的章节条目、应覆盖的章节号范围（None表示自由编号）"""
+    part: int
+    sequence: int
+    entries: Tuple[BlueprintEntry, ...]
+    expected: Optional[range]
+
+
+@dataclass
+class Assembly:
+    """装配结果，entries 为 章节号 -> 该章文本（已改为全书编号），修订后可直接修改再写入"""
+    entries: Dict[int, str] = field(default_factory=dict)
+    # (部分, 序号) -> 该片段实际得到的章节号范围
+    blocks: Dict[Tuple[int, int], range] = field(default_factory=dict)
+    # 装配到的最大章节号以内缺少的章节号
+    gaps: List[int] = field(default_factory=list)
+    # 重复出现而被丢弃的章节号
+    duplicates: List[int] = field(default_factory=list)
+    # 定号片段中超出应覆盖范围而被丢弃的章节号
+    dropped: List[int] = field(default_factory=list)
+    # 自由编号片段内重复出现而被丢弃的原章节号：(部分, 序号) -> 原章节号
+    repeated: Dict[Tuple[int, int], List[int]] = field(default_factory=dict)
+    # 自由编号片段内跳过的原章节号（片段按出现顺序重新编号，不会留下缺章）：(部分, 序号) -> 原章节号
+    skipped: Dict[Tuple[int, int], List[int]] = field(default_factory=dict)
+
+    @property
+    def next_number(self) -> int:
+        """续写应开始的章节号：第一个缺失的章节号，没有缺章时为最大章节号+1"""
+        if self.gaps:
+            return self.gaps[0]
+        return max(self.entries) + 1 if self.entries else 1
+
+    def next_existing(self, number: int) -> Optional[int]:
+        """number 之后第一个已有的章节号，没有时为None；用于把补缺章的范围限制在缺口之内"""
+        return min((existing for existing in self.entries if existing > number), default=None)
+
+    def complete_blocks(self) -> List[range]:
+        """没有缺章的片段所覆盖的章节号范围，按章节号排序"""
+        return sorted((block for block in self.blocks.values()
+                       if block and all(number in self.entries for number in block)),
+                      key=lambda block: block.start)
+
+    def text(self, before: Optional[int] = None) -> str:
+        """按章节号顺序合并的目录文本，before 不为None时只包含章节号小于 before 的章节"""
+        numbers = sorted(self.entries)
+        if before is not None:
+            numbers = [number for number in numbers if number < before]
+        return "\n\n".join(self.entries[number] for number in numbers)
+
+    def log_problems(self) -> None:
+        if self.gaps:
+            logging.warning(f"章节目录缺少{len(self.gaps)}章：{_format_numbers(self.gaps)}")
+        if self.duplicates:
+            logging.warning(f"章节目录中重复的章节已丢弃：{_format_numbers(self.duplicates)}")
+        if self.dropped:
+            logging.warning(f"超出生成范围的章节已丢弃：{_format_numbers(self.dropped)}")
+        for (part, sequence), numbers in self.repeated.items():
+            logging.warning(f"片段(部分{part}, 序号{sequence})中重复的章节已丢弃：{_format_numbers(numbers)}")
+        for (part, sequence), numbers in self.skipped.items():
+            logging.warning(f"片段(部分{part}, 序号{sequence})中跳过了{_format_numbers(numbers)}，已按顺序重新编号")
+
+    def write(self, filename: str, report: bool = True) -> str:
+        """一次写入合并后的目录，返回写入的文本；report为True时先记录缺章、重复章"""
+        if report:
+            self.log_problems()
+        text = self.text()
+        save_string_to_txt(text, filename)
+        return text
+
+
+def _format_numbers(numbers: List[int], limit: int = 10) -> str:
+    shown = "、".join(f"第{number}章" for number in numbers[:limit])
+    return shown + (f" 等{len(numbers)}章" if len(numbers) > limit else "")
+
+
+def _check_free_fragment(assembly: Assembly, key: Tuple[int, int],
+                         fragment_entries: Tuple[BlueprintEntry, ...]) -> List[BlueprintEntry]:
+    """自由编号片段中去掉重复的原章节号（保留第一次出现的），重复和跳过的原章节号记入 assembly"""
+    kept, seen, repeated = [], set(), []
+    for entry in fragment_entries:
+        if entry.chapter_number in seen:
+            repeated.append(entry.chapter_number)
+            continue
+        seen.add(entry.chapter_number)
+        kept.append(entry)
+    if repeated:
+        assembly.repeated[key] = repeated
+    if seen:
+        skipped = [number for number in range(min(seen), max(seen) + 1) if number not in seen]
+        if skipped:
+            assembly.skipped[key] = skipped
+    return kept
+
+
+class BlueprintAssembler:
+    """
+    收集目录片段并装配为完整目录，add 可在多个线程中同时调用；
+    装配结果只取决于已有目录和各片段的 (部分, 序号)，与片段加入的先后无关。
+    """
+
+    def __init__(self, base_text: str = ""):
+        # 已有目录中的章节，按原章节号装配，优先于所有片段
+        self.base = tokenize_blueprint(base_text) if base_text else []
+        self._fragments: Dict[Tuple[int, int], BlueprintFragment] = {}
+        self._lock = threading.Lock()
+
+    def add(self, text: str, part: int = 0, sequence: int = 0,
+            expected: Optional[range] = None) -> BlueprintFragment:
+        """加入一段生成结果，相同 (部分, 序号) 的片段会被替换"""
+        fragment = BlueprintFragment(part, sequence, tuple(tokenize_blueprint(text)), expected)
+        with self._lock:
+            self._fragments[(part, sequence)] = fragment
+        return fragment
+
+    def fragments(self) -> List[BlueprintFragment]:
+        with self._lock:
+            return [self._fragments[key] for key in sorted(self._fragments)]
+
+    def assemble(self) -> Assembly:
+        """按已有目录、各片段 (部分, 序号) 的顺序装配"""
+        assembly = Assembly()
+        entries = assembly.entries
+        for entry in self.base:
+            if entry.chapter_number in entries:
+                assembly.duplicates.append(entry.chapter_number)
+            else:
+                entries[entry.chapter_number] = entry.raw_text
+
+        for fragment in self.fragments():
+            key = (fragment.part, fragment.sequence)
+            if fragment.expected is None:
+                # 自由编号：去掉片段内重复的原章节号后，接在当前最大章节号之后
+                kept = _check_free_fragment(assembly, key, fragment.entries)
+                start = max(entries) + 1 if entries else 1
+                block = range(start, start + len(kept))
+                for number, entry in zip(block, kept):
+                    entries[number] = renumber_entry_text(entry.raw_text, number)
+                assembly.blocks[key] = block
+                continue
+            for entry in fragment.entries:
+                number = entry.chapter_number
+                if number not in fragment.expected:
+                    assembly.dropped.append(number)
+                elif number in entries:
+                    assembly.duplicates.append(number)
+                else:
+                    entries[number] = entry.raw_text
+            assembly.blocks[key] = fragment.expected
+
+        if entries:
+            assembly.gaps = [number for number in range(1, max(entries) + 1) if number not in entries]
+        assembly.duplicates.sort()
+        return assembly
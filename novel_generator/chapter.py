@@ -11,10 +11,18 @@ from prompt_definitions import (
     next_chapter_draft_prompt, 
     summarize_recent_chapters_prompt,
 )
-from chapter_directory_parser import get_chapter_info_from_blueprint
+from chapter_directory_parser import parse_chapter_blueprint, find_chapter_info, split_blueprint_entries
 from novel_generator.common import invoke_with_cleaning
-from utils import read_file, clear_file_content, save_string_to_txt
-import re
+from database.call_context import llm_call_context, STAGE_CHAPTER_SUMMARY, STAGE_CHAPTER_DRAFT
+from novel_generator.workspace import get_workspace
+from novel_generator.novel_store import get_novel_store
+from novel_generator.vector_store import get_vector_store, format_snippets
+from novel_generator.text_index import get_text_index
+from novel_generator.retrieval_query import (
+    search_with_fallback, characters_in, query_text, QUERY_REWRITE_MAX_TOKENS
+)
+from character_state_model import parse_character_state
+from tracing import traced
 
 
 def get_last_n_chapters_summaries(filepath: str, current_chapter_num: int, n: int = 10) -> str:
@@ -34,11 +42,6 @@ def get_last_n_chapters_summaries(filepath: str, current_chapter_num: int, n: in
         则获取第10到第19章的章节摘要
     """
     try:
-        summary_result_dir = os.path.join(filepath, "summary_result")
-        if not os.path.exists(summary_result_dir):
-            logging.warning(f"章节摘要文件夹不存在: {summary_result_dir}")
-            return ""
-        
         # 计算要获取的章节范围
         start_chapter = max(1, current_chapter_num - n)
         end_chapter = current_chapter_num - 1  # 不包括当前章节
@@ -48,15 +51,32 @@ def get_last_n_chapters_summaries(filepath: str, current_chapter_num: int, n: in
             return ""
         
         summaries = []
+        store = get_novel_store(filepath)
+        if store is not None:
+            # SQLite存储：一次范围查询
+            for chapter_num, summary_content in store.get_summaries(start_chapter, end_chapter).items():
+                if summary_content.strip():
+                    summaries.append(f"第{chapter_num}章摘要：{summary_content.strip()}")
+            if not summaries:
+                logging.warning(f"未找到第{start_chapter}到第{end_chapter}章的摘要")
+                return ""
+            logging.info(f"成功获取第{start_chapter}到第{end_chapter}章的摘要，共{len(summaries)}章")
+            return "\n\n".join(summaries)
+
+        summary_result_dir = os.path.join(filepath, "summary_result")
+        if not os.path.exists(summary_result_dir):
+            logging.warning(f"章节摘要文件夹不存在: {summary_result_dir}")
+            return ""
+        
+        workspace = get_workspace(filepath)
         
         for chapter_num in range(start_chapter, end_chapter + 1):
             summary_file = os.path.join(summary_result_dir, f"chapter_{chapter_num}_summary.txt")
-            if os.path.exists(summary_file):
-                summary_content = read_file(summary_file).strip()
-                if summary_content:
-                    summaries.append(f"第{chapter_num}章摘要：{summary_content}")
-                else:
-                    logging.warning(f"第{chapter_num}章摘要文件为空: {summary_file}")
+            summary_content = workspace.read(summary_file).strip()
+            if summary_content:
+                summaries.append(f"第{chapter_num}章摘要：{summary_content}")
+            elif workspace.exists(summary_file):
+                logging.warning(f"第{chapter_num}章摘要文件为空: {summary_file}")
             else:
                 logging.warning(f"第{chapter_num}章摘要文件不存在: {summary_file}")
         
@@ -77,27 +97,17 @@ def get_last_n_chapters_text(chapters_dir: str, current_chapter_num: int, n: int
     从目录 chapters_dir 中获取最近 n 章的文本内容，返回文本列表。
     """
     texts = []
+    filepath = os.path.dirname(os.path.abspath(chapters_dir))
+    workspace = get_workspace(filepath)
     start_chap = max(1, current_chapter_num - n)
+    store = get_novel_store(filepath)
+    if store is not None:
+        chapters = store.get_chapters(start_chap, current_chapter_num - 1)
+        return [chapters.get(c, "").strip() for c in range(start_chap, current_chapter_num)]
     for c in range(start_chap, current_chapter_num):
         chap_file = os.path.join(chapters_dir, f"chapter_{c}.txt")
-        if os.path.exists(chap_file):
-            text = read_file(chap_file).strip()
-            texts.append(text)
-        else:
-            texts.append("")
-    return texts
-    """
-    从目录 chapters_dir 中获取最近 n 章的文本内容，返回文本列表。
-    """
-    texts = []
-    start_chap = max(1, current_chapter_num - n)
-    for c in range(start_chap, current_chapter_num):
-        chap_file = os.path.join(chapters_dir, f"chapter_{c}.txt")
-        if os.path.exists(chap_file):
-            text = read_file(chap_file).strip()
-            texts.append(text)
-        else:
-            texts.append("")
+        # 文件不存在时返回空字符串
+        texts.append(workspace.read(chap_file).strip())
     return texts
 
 def extract_chapters_directory(filepath: str, current_chapter_num: int, extract_count: int) -> str:
@@ -118,11 +128,12 @@ def extract_chapters_directory(filepath: str, current_chapter_num: int, extract_
     """
     try:
         directory_file = os.path.join(filepath, "Novel_directory.txt")
-        if not os.path.exists(directory_file):
+        workspace = get_workspace(filepath)
+        if not workspace.exists(directory_file):
             logging.warning(f"章节目录文件不存在: {directory_file}")
             return ""
             
-        directory_content = read_file(directory_file)
+        directory_content = workspace.read(directory_file)
         if not directory_content:
             logging.warning("章节目录文件为空")
             return ""
@@ -135,40 +146,16 @@ def extract_chapters_directory(filepath: str, current_chapter_num: int, extract_
             logging.warning(f"无有效章节可提取: start={start_chapter}, end={end_chapter}")
             return ""
             
-        extracted_chapters = []
-        
-        # 使用正则表达式匹配章节信息
-        chapter_pattern = r'第(\d+)章\s*-\s*([^\n]+)\n本章定位：([^\n]+)\n核心作用：([^\n]+)\n章节类型：([^\n]+)\n衔接要素：([^\n]+)\n本章简述：([^\n]+(?:\n(?!第\d+章)[^\n]+)*)'
-        
-        matches = re.finditer(chapter_pattern, directory_content)
-        
-        for match in matches:
-            chapter_num = int(match.group(1))
-            if start_chapter <= chapter_num <= end_chapter:
-                chapter_title = match.group(2).strip()
-                chapter_role = match.group(3).strip()
-                chapter_purpose = match.group(4).strip()
-                suspense_level = match.group(5).strip()
-                connection_elements = match.group(6).strip()
-                chapter_summary = match.group(7).strip()
-                
-                # 格式化章节信息
-                chapter_info = f"""第{chapter_num}章 - {chapter_title}
-本章定位：{chapter_role}
-核心作用：{chapter_purpose}
-章节类型：{suspense_level}
-衔接要素：{connection_elements}
-本章简述：{chapter_summary}"""
-                
-                extracted_chapters.append(chapter_info)
+        # 目录条目只在文件变化后重新切分，保留原文（"语言风格"/"章节类型"两种写法都原样输出）
+        entries = workspace.read_derived(directory_file, "blueprint_entries", split_blueprint_entries)
+        extracted_chapters = [
+            entries[number] for number in range(start_chapter, end_chapter + 1) if number in entries
+        ]
                 
         if not extracted_chapters:
             logging.warning(f"未找到第{start_chapter}到第{end_chapter}章的目录信息")
             return ""
             
-        # 按章节编号排序（虽然正则匹配通常已经是有序的）
-        extracted_chapters.sort(key=lambda x: int(re.search(r'第(\d+)章', x).group(1)))
-        
         result = "\n\n".join(extracted_chapters)
         logging.info(f"成功提取第{start_chapter}到第{end_chapter}章的目录信息，共{len(extracted_chapters)}章")
         
@@ -178,6 +165,62 @@ def extract_chapters_directory(filepath: str, current_chapter_num: int, extract_
         logging.error(f"提取章节目录时发生错误: {str(e)}")
         return ""
 
+def _load_character_state(filepath: str):
+    """解析后的角色状态（文件未变化时复用）"""
+    return get_workspace(filepath).read_derived(
+        os.path.join(filepath, "character_state.txt"), "character_state", parse_character_state)
+
+
+@traced("stage.retrieve")
+def retrieve_relevant_snippets(filepath: str, novel_number: int, chapter_info: dict, top_k: int = 5,
+                               make_llm_adapter=None) -> str:
+    """
+    按章节目录字段和涉及的角色名构造查询，在向量知识库中检索更早章节的相关片段
+    （前一章已提供完整正文，不参与检索）；召回不足且提供了 make_llm_adapter 时才创建适配器让模型改写查询。
+    知识库不可用时返回空字符串。
+    """
+    store = get_vector_store(filepath)
+    if store is None:
+        return ""
+    try:
+        results = search_with_fallback(
+            lambda query: store.search(query, top_k=top_k, before_chapter=novel_number - 1),
+            chapter_info, novel_number,
+            state=_load_character_state(filepath), top_k=top_k, make_llm_adapter=make_llm_adapter,
+            available=store.count(before_chapter=novel_number - 1)
+        )
+    except Exception as e:
+        logging.warning(f"知识库检索失败: {e}")
+        return ""
+    logging.info(f"第{novel_number}章从知识库检索到 {len(results)} 个相关片段")
+    return format_snippets(results)
+
+
+@traced("stage.retrieve_scenes")
+def retrieve_earlier_scenes(filepath: str, novel_number: int, chapter_info: dict,
+                            limit: int = 2, max_chars: int = 1200) -> str:
+    """
+    找出当前章节简述/衔接要素中提到的角色，在倒排索引中查找这些角色最近一次同时出现的前文原文
+    （前一章已提供完整正文，不参与检索），没有匹配时返回空字符串。
+    """
+    # 按在简述中首次出现的顺序取前两个角色
+    names = characters_in(_load_character_state(filepath), query_text(chapter_info))[:2]
+    if not names:
+        return ""
+    try:
+        index = get_text_index(filepath)
+        scenes = index.find_scenes(names, before_chapter=novel_number - 1, limit=limit)
+        if not scenes and len(names) > 1:
+            scenes = index.find_scenes(names[:1], before_chapter=novel_number - 1, limit=limit)
+    except Exception as e:
+        logging.warning(f"倒排索引检索失败: {e}")
+        return ""
+    logging.info(f"第{novel_number}章按角色 {'、'.join(names)} 检索到 {len(scenes)} 段前文")
+    # 片段没有相似度，篇幅不够时优先保留较近的章节
+    return format_snippets(scenes, max_chars=max_chars, priority=lambda scene: scene["chapter"])
+
+
+@traced("stage.chapter_summary")
 def summarize_recent_chapters(
     interface_format: str,
     api_key: str,
@@ -206,6 +249,9 @@ def summarize_recent_chapters(
         # 获取最近n章的章节摘要
         # novel_number-1是因为前一章会提供完整文本，不需要摘要
         recent_summaries = get_last_n_chapters_summaries(filepath, novel_number-1, summary_count)
+
+        # 当前章节涉及角色的前文原场景（倒排索引，不调用模型）
+        earlier_scenes = retrieve_earlier_scenes(filepath, novel_number, chapter_info or {})
         
         # 最近十章章节目录
         # recent_dir = extract_chapters_directory(filepath=filepath, current_chapter_num=novel_number, extract_count=10)
@@ -228,6 +274,7 @@ def summarize_recent_chapters(
             combined_text=combined_text,  # 最近一章完整内容
 #            recent_dir=recent_dir,        # 最近十章章节信息
             recent_summaries=recent_summaries,  # 最近n章的章节摘要
+            earlier_scenes=earlier_scenes or "（无）",  # 相关角色的前文原场景
             novel_number=novel_number,
             last_chapter_number=novel_number - 1,
             chapter_title=chapter_info.get("chapter_title", "未命名"),
@@ -243,7 +290,8 @@ def summarize_recent_chapters(
             next_chapter_suspense_level=next_chapter_info.get("suspense_level", "中等"),
         )
         
-        response_text = invoke_with_cleaning(llm_adapter, prompt, purpose=f"生成第{novel_number}章摘要")
+        with llm_call_context(stage=STAGE_CHAPTER_SUMMARY, chapter_number=novel_number):
+            response_text = invoke_with_cleaning(llm_adapter, prompt, purpose="生成当前章节摘要")
         summary = extract_summary_from_response(response_text)
         
         if not summary:
@@ -297,6 +345,7 @@ def format_chapter_info(chapter_info: dict) -> str:
         summary=chapter_info.get('chapter_summary', '未提供')
     )
 
+@traced("stage.build_chapter_prompt")
 def build_chapter_prompt(
     api_key: str,
     base_url: str,
@@ -309,21 +358,24 @@ def build_chapter_prompt(
     interface_format: str,
     max_tokens: int,
     genre: str,  # 题材
-    timeout: int
+    timeout: int,
+    query_model_name: str = None  # 改写检索查询用的模型，None表示使用 model_name
 ) -> str:
     """
     构造当前章节的请求提示词
     """
-    # 读取基础文件
+    # 读取基础文件（文件未变化时直接使用缓存）
+    workspace = get_workspace(filepath)
     arch_file = os.path.join(filepath, "Novel_architecture.txt")
-    novel_architecture_text = read_file(arch_file)
+    novel_architecture_text = workspace.read(arch_file)
     directory_file = os.path.join(filepath, "Novel_directory.txt")
-    blueprint_text = read_file(directory_file)
+    # 章节目录只在文件变化后重新解析
+    blueprint_chapters = workspace.read_derived(directory_file, "blueprint", parse_chapter_blueprint)
     character_state_file = os.path.join(filepath, "character_state.txt")
-    character_state_text = read_file(character_state_file)
+    character_state_text = workspace.read(character_state_file)
     
     # 获取章节信息（从章节目录中获取具体章节信息）
-    chapter_info = get_chapter_info_from_blueprint(blueprint_text, novel_number)
+    chapter_info = find_chapter_info(blueprint_chapters, novel_number)
     chapter_title = chapter_info["chapter_title"]
     chapter_role = chapter_info["chapter_role"]
     chapter_purpose = chapter_info["chapter_purpose"]
@@ -333,7 +385,7 @@ def build_chapter_prompt(
 
     # 获取下一章节信息
     next_chapter_number = novel_number + 1
-    next_chapter_info = get_chapter_info_from_blueprint(blueprint_text, next_chapter_number)
+    next_chapter_info = find_chapter_info(blueprint_chapters, next_chapter_number)
     next_chapter_title = next_chapter_info.get("chapter_title", "（未命名）")
     next_chapter_role = next_chapter_info.get("chapter_role", "过渡章节")
     next_chapter_purpose = next_chapter_info.get("chapter_purpose", "承上启下")
@@ -395,12 +447,27 @@ def build_chapter_prompt(
 
     # 前一章正文
     previous_excerpt = recent_texts[0]
+    # 更早章节中与本章相关的片段
+    # 查询由章节目录直接构造，只有召回不足时才创建适配器，用较便宜的模型改写
+    knowledge_context = retrieve_relevant_snippets(
+        filepath, novel_number, chapter_info,
+        make_llm_adapter=lambda: create_llm_adapter(
+            interface_format=interface_format,
+            base_url=base_url,
+            model_name=query_model_name or model_name,
+            api_key=api_key,
+            temperature=temperature,
+            max_tokens=QUERY_REWRITE_MAX_TOKENS,
+            timeout=timeout
+        )
+    )
 
     # 返回最终提示词
     return next_chapter_draft_prompt.format(
         previous_chapter_excerpt=previous_excerpt,
         character_state=character_state_text,
         short_summary=short_summary,
+        knowledge_context=knowledge_context or "（无）",
         novel_number=novel_number,
         chapter_title=chapter_title,
         chapter_role=chapter_role,
@@ -420,6 +487,7 @@ def build_chapter_prompt(
     )
 
 
+@traced("stage.chapter_draft")
 def generate_chapter_draft(
     api_key: str,
     base_url: str,
@@ -432,10 +500,11 @@ def generate_chapter_draft(
     genre: str, 
     interface_format: str,
     max_tokens: int,
-    timeout: int
+    timeout: int,
+    query_model_name: str = None
 ) -> str:
     """
-    生成章节草稿，支持自定义提示词
+    生成章节草稿，支持自定义提示词；query_model_name 为召回不足时改写检索查询用的模型
     """
 
     prompt_text = build_chapter_prompt(
@@ -450,7 +519,8 @@ def generate_chapter_draft(
         interface_format=interface_format,
         max_tokens=max_tokens,
         genre = genre,
-        timeout=timeout
+        timeout=timeout,
+        query_model_name=query_model_name
     )
 
     chapters_dir = os.path.join(filepath, "chapters")
@@ -466,11 +536,14 @@ def generate_chapter_draft(
         timeout=timeout
     )
 
-    chapter_content = invoke_with_cleaning(llm_adapter, prompt_text, purpose=f"生成第{novel_number}章正文")
+    with llm_call_context(stage=STAGE_CHAPTER_DRAFT, chapter_number=novel_number):
+        chapter_content = invoke_with_cleaning(llm_adapter, prompt_text, purpose="生成章节正文")
     if not chapter_content.strip():
         logging.warning("Generated chapter draft is empty.")
     chapter_file = os.path.join(chapters_dir, f"chapter_{novel_number}.txt")
-    clear_file_content(chapter_file)
-    save_string_to_txt(chapter_content, chapter_file)
+    get_workspace(filepath).write(chapter_file, chapter_content)
+    store = get_novel_store(filepath)
+    if store is not None:
+        store.save_chapter(novel_number, chapter_content)
     logging.info(f"第 {novel_number} 章正文成功生成.")
     return chapter_content
@@ -4,9 +4,16 @@
 通用重试、清洗、日志工具
 """
 import logging
+import random
 import re
 import time
 import traceback
+from typing import Optional
+from database.config_manager import global_config
+from database.budget import BudgetExceededError
+from database.token_estimator import PromptTooLongError
+from tracing import span
+from log_setup import is_enabled_for
 
 def call_with_retry(func, max_retries=2, sleep_time=10, fallback_return=None, **kwargs):
     """
@@ -34,38 +41,70 @@ def remove_think_tags(text: str) -> str:
     """移除 <think>...</think> 包裹的内容"""
     return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
 
+def _payload_log_settings():
+    """提示词/响应日志配置：(日志级别, 最大字符数, 采样率)"""
+    level = global_config.get('llm_monitoring.payload_log_level', 'DEBUG')
+    level = level if isinstance(level, int) else logging.getLevelName(str(level).upper())
+    if not isinstance(level, int):
+        level = logging.DEBUG
+    max_chars = int(global_config.get('llm_monitoring.payload_log_max_chars', 500) or 0)
+    sample_rate = float(global_config.get('llm_monitoring.payload_log_sample_rate', 1.0))
+    return level, max_chars, sample_rate
+
+
+def should_log_payload() -> Optional[int]:
+    """本次调用是否记录提示词/响应（日志级别未开启或未被采样时返回None），返回使用的日志级别"""
+    level, _, sample_rate = _payload_log_settings()
+    if not is_enabled_for(level):
+        return None
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return None
+    return level
+
+
+def log_payload(label: str, text: str, level: Optional[int] = None) -> None:
+    """
+    通过logging记录提示词/响应，超过 payload_log_max_chars 时截断（0表示不截断）。
+    完整正文只保存在监控的 llm_call_payloads 表中（llm_monitoring.log_detailed_response）。
+    """
+    if level is None:
+        level = should_log_payload()
+        if level is None:
+            return
+    _, max_chars, _ = _payload_log_settings()
+    if max_chars and len(text) > max_chars:
+        text = f"{text[:max_chars]}……（共{len(text)}字，已截断）"
+    logging.log(level, f"[{label}] {text}")
+
+
 def debug_log(prompt: str, response_content: str):
-    logging.info(
-        f"\n[#########################################  Prompt  #########################################]\n{prompt}\n"
-    )
-    logging.info(
-        f"\n[######################################### Response #########################################]\n{response_content}\n"
-    )
+    level = should_log_payload()
+    if level is None:
+        return
+    log_payload("Prompt", prompt, level)
+    log_payload("Response", response_content, level)
 
 def invoke_with_cleaning(llm_adapter, prompt: str, purpose: str = "更新角色状态", max_retries: int = 2) -> str:
-    """调用 LLM 并清理返回结果"""
-    print("\n" + "="*50)
-    print("发送到 LLM 的提示词:")
-    print("-"*50)
-    print(prompt)
-    print("="*50 + "\n")
+    """调用 LLM 并清理返回结果，提示词和返回内容按 llm_monitoring.payload_log_* 配置截断/采样后写入日志"""
+    payload_level = should_log_payload()
+    if payload_level is not None:
+        log_payload(f"{purpose} 提示词", prompt, payload_level)
     
     result = ""
     retry_count = 0
     
     while retry_count < max_retries:
         try:
-            # 使用监控调用，传入调用目的
-            if hasattr(llm_adapter, 'invoke_with_monitoring'):
-                result = llm_adapter.invoke_with_monitoring(prompt, call_purpose=purpose)
-            else:
-                result = llm_adapter.invoke(prompt)
+            with span("llm.call", purpose=purpose, model=getattr(llm_adapter, 'model_name', 'unknown'),
+                      prompt_chars=len(prompt), attempt=retry_count + 1):
+                # 使用监控调用，传入调用目的
+                if hasattr(llm_adapter, 'invoke_with_monitoring'):
+                    result = llm_adapter.invoke_with_monitoring(prompt, call_purpose=purpose)
+                else:
+                    result = llm_adapter.invoke(prompt)
             
-            print("\n" + "="*50)
-            print("LLM 返回的内容:")
-            print("-"*50)
-            print(result)
-            print("="*50 + "\n")
+            if payload_level is not None:
+                log_payload(f"{purpose} 返回内容", result, payload_level)
             
             # 清理结果中的特殊格式标记
             result = result.replace("```", "").strip()
@@ -73,8 +112,11 @@ def invoke_with_cleaning(llm_adapter, prompt: str, purpose: str = "更新角色
                 return result
             retry_count += 1
             time.sleep(10)
+        except (PromptTooLongError, BudgetExceededError):
+            # 提示词超长、预算用尽时重试不会成功，直接向上抛出
+            raise
         except Exception as e:
-            print(f"调用失败 ({retry_count + 1}/{max_retries}): {str(e)}")
+            logging.warning(f"调用失败 ({retry_count + 1}/{max_retries}): {str(e)}")
             retry_count += 1
             if retry_count >= max_retries:
                 raise e
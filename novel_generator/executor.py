@@ -0,0 +1,146 @@
+#novel_generator/executor.py
+# -*- coding: utf-8 -*-
+"""
+进程内共享的工作线程池
+所有阻塞的LLM调用和文件读写都提交到同一个线程池，线程数即全局同时进行的调用上限，
+不再每章新建 ThreadPoolExecutor，也不使用大小不受控的默认线程池。
+线程数由 llm_monitor_config.json 的 executor.max_workers 配置（也可调用 configure_executor），
+并统计任务在队列中的等待时间。
+需要向线程池提交子任务并等待其结果的协调任务（如后台的角色事件压缩）不要放进线程池，
+用 run_in_own_thread 在单独的线程中执行；在线程池任务中可用 in_worker_thread() 判断，
+改为直接执行子任务，否则线程池占满时父任务等待子任务会造成死锁。
+"""
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, Optional
+from database.config_manager import global_config
+from tracing import span
+
+DEFAULT_MAX_WORKERS = 8
+
+# 当前线程是否正在执行线程池任务
+_worker_state = threading.local()
+
+
+def in_worker_thread() -> bool:
+    """当前代码是否运行在共享线程池的任务中"""
+    return getattr(_worker_state, "active", False)
+
+
+class WorkerPool:
+    """带排队等待统计的线程池，提交的任务会继承调用方的 contextvars（监控上下文、追踪span）"""
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="novel-worker")
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._running = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """提交任务，返回 concurrent.futures.Future"""
+        ctx = contextvars.copy_context()
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self._submitted += 1
+
+        def run():
+            wait = time.perf_counter() - submitted_at
+            with self._lock:
+                self._running += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            if wait > 1.0:
+                logging.info(f"任务 {getattr(func, '__name__', func)} 在线程池队列中等待了 {wait:.2f}s")
+            _worker_state.active = True
+            try:
+                with span("executor.task", task=getattr(func, '__name__', str(func)),
+                          queue_wait_ms=round(wait * 1000, 1)):
+                    return func(*args, **kwargs)
+            finally:
+                _worker_state.active = False
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        return self._executor.submit(ctx.run, run)
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在线程池中执行同步函数并等待结果（供协程使用）"""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        """线程池统计：提交数、完成数、运行中、排队中、平均/最长排队等待（秒）"""
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "max_workers": self.max_workers,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "running": self._running,
+                "queued": self._submitted - started,
+                "avg_queue_wait": self._total_wait / started if started else 0.0,
+                "max_queue_wait": self._max_wait,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+_pool: Optional[WorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def configure_executor(max_workers: int) -> WorkerPool:
+    """按指定线程数重建共享线程池（已提交的任务会继续执行完）"""
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, WorkerPool(max_workers)
+    if old is not None:
+        old.shutdown(wait=False)
+    return _pool
+
+
+def get_executor() -> WorkerPool:
+    """获取共享线程池，首次使用时按配置创建"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                settings = global_config.get('executor', {}) or {}
+                _pool = WorkerPool(int(settings.get('max_workers') or DEFAULT_MAX_WORKERS))
+    return _pool
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """在共享线程池中执行阻塞函数，替代 loop.run_in_executor"""
+    return await get_executor().run(func, *args, **kwargs)
+
+
+def start_thread(func: Callable, *args, **kwargs) -> Future:
+    """在单独的线程（不占用线程池）中执行函数，继承调用方的 contextvars，返回 concurrent.futures.Future"""
+    future: Future = Future()
+    ctx = contextvars.copy_context()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(ctx.run(func, *args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, name=f"novel-{getattr(func, '__name__', 'task')}", daemon=True).start()
+    return future
+
+
+async def run_in_own_thread(func: Callable, *args, **kwargs) -> Any:
+    """在单独的线程中执行会向线程池提交子任务并等待结果的协调函数（供协程使用）"""
+    return await asyncio.wrap_future(start_thread(func, *args, **kwargs))
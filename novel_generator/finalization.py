@@ -7,13 +7,54 @@ import os
 import logging
 import asyncio
 import sys
-from concurrent.futures import ThreadPoolExecutor
 from llm_adapters import create_llm_adapter
-from prompt_definitions import summary_prompt, update_character_state_prompt
+from prompt_definitions import summary_prompt, update_character_state_prompt, update_character_state_delta_prompt
+from character_state_model import parse_character_state, parse_state_delta, apply_state_delta, StateDeltaError
 from novel_generator.common import invoke_with_cleaning
-from utils import read_file, clear_file_content, save_string_to_txt
+from utils import deferred_fsync
+from novel_generator.workspace import get_workspace
+from novel_generator.executor import run_blocking
+from novel_generator.novel_store import get_novel_store
+from novel_generator.state_history import get_state_history
+from novel_generator.vector_store import get_vector_store
+from tracing import traced
+from database.call_context import llm_call_context, STAGE_FINALIZE_SUMMARY, STAGE_FINALIZE_STATE
 
 
+def _invoke_in_stage(stage: str, novel_number: int, llm_adapter, prompt: str, purpose: str) -> str:
+    """在指定的流程阶段上下文中调用 invoke_with_cleaning（在线程池中执行）"""
+    with llm_call_context(stage=stage, chapter_number=novel_number):
+        return invoke_with_cleaning(llm_adapter, prompt, purpose)
+
+
+def _update_character_state(novel_number: int, llm_adapter, chapter_text: str,
+                            old_state: str, mode: str = "full") -> str:
+    """
+    更新角色状态（供线程池执行）。
+    mode 为 "delta" 时模型只返回新增事件和新出场角色，由程序合并；增量无法解析或校验失败时回退为整份重新生成。
+    """
+    if mode == "delta" and old_state.strip():
+        prompt_delta = update_character_state_delta_prompt.format(
+            chapter_text=chapter_text,
+            old_state=old_state
+        )
+        response = _invoke_in_stage(STAGE_FINALIZE_STATE, novel_number, llm_adapter, prompt_delta, "角色状态增量更新")
+        try:
+            state = parse_character_state(old_state)
+            added = apply_state_delta(state, parse_state_delta(response))
+            logging.info(f"第 {novel_number} 章角色状态增量更新：新增 {len(added)} 条事件")
+            return state.to_text()
+        except StateDeltaError as e:
+            logging.warning(f"第 {novel_number} 章角色状态增量更新失败（{e}），改为整份重新生成")
+
+    prompt_char_state = update_character_state_prompt.format(
+        chapter_text=chapter_text,
+        old_state=old_state
+    )
+    return _invoke_in_stage(STAGE_FINALIZE_STATE, novel_number, llm_adapter, prompt_char_state, "角色状态更新")
+
+
+@traced("stage.finalize")
 async def finalize_chapter(
     novel_number: int,
     api_key: str,
@@ -23,15 +64,18 @@ async def finalize_chapter(
     filepath: str,
     interface_format: str,
     max_tokens: int,
-    timeout: int = 600
+    timeout: int = 600,
+    state_update_mode: str = "full"
 ):
     """
     对章节做最终处理：生成正文摘要、更新角色状态文档。
+    state_update_mode: "full" 每章让模型重新输出整份角色状态，"delta" 只输出新增内容后合并
     """
+    workspace = get_workspace(filepath)
     chapters_dir = os.path.join(filepath, "chapters")
     chapter_file = os.path.join(chapters_dir, f"chapter_{novel_number}.txt")
-    # 刚完成的章节正文
-    chapter_text = read_file(chapter_file).strip()
+    # 刚完成的章节正文（generate_chapter_draft 写入时已缓存）
+    chapter_text = workspace.read(chapter_file).strip()
     if not chapter_text:
         logging.warning(f"Chapter {novel_number} is empty, cannot finalize.")
         return
@@ -43,7 +87,7 @@ async def finalize_chapter(
         logging.info(f"创建summary_result文件夹: {summary_result_dir}")
 
     character_state_file = os.path.join(filepath, "character_state.txt")
-    old_character_state = read_file(character_state_file)
+    old_character_state = workspace.read(character_state_file)
 
     llm_adapter = create_llm_adapter(
         interface_format=interface_format,
@@ -55,42 +99,25 @@ async def finalize_chapter(
         timeout=timeout
     )
 
-    # 使用ThreadPoolExecutor创建一个线程池，with语句确保线程池在使用完毕后会自动关闭，释放资源
-    with ThreadPoolExecutor() as executor:
-        loop = asyncio.get_running_loop()
-
-        # 对新生成的章节内容，进行总结
-        prompt_summary = summary_prompt.format(
-            chapter_text=chapter_text
-        )
-        # run_in_executor用于在异步程序中执行同步函数，避免同步操作阻塞事件循环
-        # 接收三个主要参数：
-        # executor：指定线程池（如 ThreadPoolExecutor），若为 None 则使用默认线程池
-        # func：需要执行的同步函数（不能是协程）
-        # *args：传递给同步函数的参数
-        # 执行流程：
-        # 把 func(*args) 这个同步任务提交到指定的线程池
-        # 立即返回一个 Future 对象（可等待对象），代表这个任务的结果
-        # 同步函数在线程池的某个线程中异步执行（不阻塞事件循环）
-        # 当同步函数执行完成后，Future 对象会被标记为完成，并携带返回结果
-        summary_task = loop.run_in_executor(
-            executor, invoke_with_cleaning, llm_adapter, prompt_summary, f"第{novel_number}章章节概要生成"
-        )
-        # 根据新生成的章节内容，更新角色状态
-        prompt_char_state = update_character_state_prompt.format(
-            chapter_text=chapter_text,
-            old_state=old_character_state
-        )
-        char_state_task = loop.run_in_executor(
-            executor, invoke_with_cleaning, llm_adapter, prompt_char_state, f"第{novel_number}章角色状态更新"
-        )
+    # 两个LLM调用在共享线程池中并发执行（run_blocking 会复制当前上下文，含 novel_id/run_id）
+    # 对新生成的章节内容，进行总结
+    prompt_summary = summary_prompt.format(
+        chapter_text=chapter_text
+    )
+    summary_task = run_blocking(
+        _invoke_in_stage, STAGE_FINALIZE_SUMMARY, novel_number, llm_adapter, prompt_summary, "章节概要生成"
+    )
+    # 根据新生成的章节内容，更新角色状态
+    char_state_task = run_blocking(
+        _update_character_state, novel_number, llm_adapter, chapter_text, old_character_state, state_update_mode
+    )
 
-        # 使用asyncio.gather()同时运行两个任务，await会等待两个任务都完成后才继续执行
-        # 执行完成后，分别得到章节概括和新的角色状态
-        new_summary, new_char_state = await asyncio.gather(
-            summary_task, char_state_task
-        )
-        logging.info(f"第 {novel_number} 章章节概括和角色状态更新成功")
+    # 使用asyncio.gather()同时运行两个任务，await会等待两个任务都完成后才继续执行
+    # 执行完成后，分别得到章节概括和新的角色状态
+    new_summary, new_char_state = await asyncio.gather(
+        summary_task, char_state_task
+    )
+    logging.info(f"第 {novel_number} 章章节概括和角色状态更新成功")
 
     # 等待两个任务（summary_task 和 char_state_task）全部执行完成后，继续执行后续代码
     if not new_char_state.strip():
@@ -100,12 +127,33 @@ async def finalize_chapter(
         print("章节概括生成失败,即将退出终端")
         sys.exit(1)
 
-    # 将章节摘要保存到summary_result文件夹中
-    summary_file = os.path.join(summary_result_dir, f"chapter_{novel_number}_summary.txt")
-    save_string_to_txt(new_summary, summary_file)
-    logging.info(f"第 {novel_number} 章概括已保存到: {summary_file}")
-    
-    clear_file_content(character_state_file)
-    # 将更新后的角色状态内容写入到 character_state.txt 文件中
-    save_string_to_txt(new_char_state, character_state_file)
-    logging.info(f"第 {novel_number} 章生成结束")
+    # 章节摘要和角色状态各原子写入一次（rename前各自fsync），目录只fsync一次
+    with deferred_fsync():
+        # 将章节摘要保存到summary_result文件夹中
+        summary_file = os.path.join(summary_result_dir, f"chapter_{novel_number}_summary.txt")
+        workspace.write(summary_file, new_summary)
+        logging.info(f"第 {novel_number} 章概括已保存到: {summary_file}")
+
+        # 将更新后的角色状态内容写入到 character_state.txt 文件中
+        workspace.write(character_state_file, new_char_state)
+
+    # 角色状态按章节追加版本，可回滚或查看任意一章时的状态
+    history = get_state_history(filepath)
+    if history.latest_version() is None and old_character_state:
+        history.append(novel_number - 1, old_character_state)
+    history.append(novel_number, new_char_state)
+
+    # 启用SQLite存储时同时写入章节概括
+    store = get_novel_store(filepath)
+    if store is not None:
+        store.save_summary(novel_number, new_summary)
+
+    # 正文分块后加入向量知识库，供后续章节检索
+    vector_store = get_vector_store(filepath)
+    if vector_store is not None:
+        try:
+            chunk_count = vector_store.add_chapter(novel_number, chapter_text)
+            logging.info(f"第 {novel_number} 章已加入知识库（{chunk_count} 个分块）")
+        except Exception as e:
+            logging.warning(f"第 {novel_number} 章加入知识库失败: {e}")
+    logging.info(f"第 {novel_number} 章生成结束")
\ No newline at end of file
@@ -0,0 +1,300 @@
+#novel_generator/novel_store.py
+# -*- coding: utf-8 -*-
+"""
+可选的 SQLite 存储后端（Novel_Output/novel_store.db）
+把章节正文、章节概括、章节目录条目、角色状态版本（见 state_history）和其它文本产物存为一个SQLite文件中的行，
+按章节号建立索引，"第10到19章的摘要" 之类的范围读取只需一次查询。
+支持从现有txt目录结构导入、导出回txt目录结构。
+"""
+import os
+import re
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from chapter_directory_parser import tokenize_blueprint
+from utils import read_file, save_string_to_txt, deferred_fsync
+from novel_generator.state_history import CharacterStateHistory, STATE_FILENAME
+
+
+STORE_FILENAME = "novel_store.db"
+
+# 以整份文本保存的产物：名称 -> Novel_Output中的文件名
+ARTIFACT_FILES = {
+    "architecture": "Novel_architecture.txt",
+    "directory": "Novel_directory.txt",
+    "character_information": "character_information.txt",
+    "character_state": "character_state.txt",
+    "world_building": "world_building.txt",
+    "plot": "plot.txt",
+}
+
+_CHAPTER_FILE_PATTERN = re.compile(r'^chapter_(\d+)\.txt$')
+_SUMMARY_FILE_PATTERN = re.compile(r'^chapter_(\d+)_summary\.txt$')
+_PLOT_FILE_PATTERN = re.compile(r'^plot_(.+)\.txt$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chapters (
+    chapter_number INTEGER PRIMARY KEY,
+    content TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    chapter_number INTEGER PRIMARY KEY,
+    content TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blueprint_entries (
+    chapter_number INTEGER PRIMARY KEY,
+    chapter_title TEXT,
+    chapter_role TEXT,
+    chapter_purpose TEXT,
+    suspense_level TEXT,
+    connection_elements TEXT,
+    chapter_summary TEXT,
+    raw_text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    name TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class NovelStore:
+    """单部小说的SQLite存储，一个连接 + 锁，可在线程池中共享"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        # 角色状态版本（关键帧 + 压缩差异）
+        self.character_states = CharacterStateHistory(
+            conn=self._conn, lock=self._lock,
+            state_file=os.path.join(os.path.dirname(os.path.abspath(db_path)), STATE_FILENAME)
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql: str, params: tuple = ()) -> None:
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def _fetchall(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ---------------- 章节正文 ----------------
+    def save_chapter(self, chapter_number: int, content: str) -> None:
+        self._execute(
+            "REPLACE INTO chapters (chapter_number, content, updated_at) VALUES (?, ?, ?)",
+            (chapter_number, content, _now())
+        )
+
+    def get_chapter(self, chapter_number: int) -> str:
+        rows = self._fetchall("SELECT content FROM chapters WHERE chapter_number = ?", (chapter_number,))
+        return rows[0][0] if rows else ""
+
+    def get_chapters(self, start_chapter: int, end_chapter: int) -> Dict[int, str]:
+        """获取[start_chapter, end_chapter]范围内已有的章节正文"""
+        rows = self._fetchall(
+            "SELECT chapter_number, content FROM chapters WHERE chapter_number BETWEEN ? AND ? "
+            "ORDER BY chapter_number",
+            (start_chapter, end_chapter)
+        )
+        return dict(rows)
+
+    def list_chapter_numbers(self) -> List[int]:
+        return [row[0] for row in self._fetchall("SELECT chapter_number FROM chapters ORDER BY chapter_number")]
+
+    # ---------------- 章节概括 ----------------
+    def save_summary(self, chapter_number: int, content: str) -> None:
+        self._execute(
+            "REPLACE INTO summaries (chapter_number, content, updated_at) VALUES (?, ?, ?)",
+            (chapter_number, content, _now())
+        )
+
+    def get_summaries(self, start_chapter: int, end_chapter: int) -> Dict[int, str]:
+        """获取[start_chapter, end_chapter]范围内已有的章节概括"""
+        rows = self._fetchall(
+            "SELECT chapter_number, content FROM summaries WHERE chapter_number BETWEEN ? AND ? "
+            "ORDER BY chapter_number",
+            (start_chapter, end_chapter)
+        )
+        return dict(rows)
+
+    # ---------------- 章节目录 ----------------
+    def save_blueprint(self, blueprint_text: str) -> None:
+        """用整份章节目录文本替换所有目录条目"""
+        # 一次扫描同时得到原文和解析后的字段，同一章节出现多次时以最后一次为准
+        rows = {}
+        for number, raw, fields in tokenize_blueprint(blueprint_text):
+            rows[number] = (
+                number, fields["chapter_title"], fields["chapter_role"], fields["chapter_purpose"],
+                fields["suspense_level"], fields["connection_elements"], fields["chapter_summary"], raw
+            )
+        rows = list(rows.values())
+        with self._lock:
+            self._conn.execute("DELETE FROM blueprint_entries")
+            self._conn.executemany(
+                "INSERT INTO blueprint_entries (chapter_number, chapter_title, chapter_role, chapter_purpose, "
+                "suspense_level, connection_elements, chapter_summary, raw_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def get_blueprint_entries(self, start_chapter: int, end_chapter: int) -> List[Dict[str, object]]:
+        """获取[start_chapter, end_chapter]范围内的结构化目录条目"""
+        rows = self._fetchall(
+            "SELECT chapter_number, chapter_title, chapter_role, chapter_purpose, suspense_level, "
+            "connection_elements, chapter_summary FROM blueprint_entries "
+            "WHERE chapter_number BETWEEN ? AND ? ORDER BY chapter_number",
+            (start_chapter, end_chapter)
+        )
+        keys = ("chapter_number", "chapter_title", "chapter_role", "chapter_purpose",
+                "suspense_level", "connection_elements", "chapter_summary")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def get_blueprint_text(self) -> str:
+        rows = self._fetchall("SELECT raw_text FROM blueprint_entries ORDER BY chapter_number")
+        return "\n\n".join(row[0] for row in rows)
+
+    # ---------------- 角色状态 ----------------
+    def save_character_state(self, chapter_number: int, content: str) -> None:
+        """追加一个角色状态版本（chapter_number为产生该版本的章节，0表示初始状态）"""
+        self.character_states.append(chapter_number, content)
+
+    def get_latest_character_state(self) -> str:
+        return self.character_states.latest()
+
+    def get_character_state_at(self, chapter_number: int) -> str:
+        """获取第chapter_number章完成时的角色状态"""
+        return self.character_states.at_chapter(chapter_number)
+
+    # ---------------- 其它文本产物 ----------------
+    def save_artifact(self, name: str, content: str) -> None:
+        self._execute(
+            "REPLACE INTO artifacts (name, content, updated_at) VALUES (?, ?, ?)",
+            (name, content, _now())
+        )
+
+    def get_artifact(self, name: str) -> str:
+        rows = self._fetchall("SELECT content FROM artifacts WHERE name = ?", (name,))
+        return rows[0][0] if rows else ""
+
+    def list_artifacts(self) -> List[str]:
+        return [row[0] for row in self._fetchall("SELECT name FROM artifacts ORDER BY name")]
+
+    # ---------------- txt 导入导出 ----------------
+    def import_from_txt(self, filepath: str) -> Tuple[int, int]:
+        """从Novel_Output的txt目录结构导入，返回 (导入的章节数, 导入的概括数)"""
+        chapter_rows, summary_rows = [], []
+        chapters_dir = os.path.join(filepath, "chapters")
+        if os.path.isdir(chapters_dir):
+            for name in os.listdir(chapters_dir):
+                match = _CHAPTER_FILE_PATTERN.match(name)
+                if match:
+                    content = read_file(os.path.join(chapters_dir, name))
+                    chapter_rows.append((int(match.group(1)), content, _now()))
+        summary_dir = os.path.join(filepath, "summary_result")
+        if os.path.isdir(summary_dir):
+            for name in os.listdir(summary_dir):
+                match = _SUMMARY_FILE_PATTERN.match(name)
+                if match:
+                    content = read_file(os.path.join(summary_dir, name))
+                    summary_rows.append((int(match.group(1)), content, _now()))
+
+        with self._lock:
+            self._conn.executemany("REPLACE INTO chapters (chapter_number, content, updated_at) VALUES (?, ?, ?)",
+                                   chapter_rows)
+            self._conn.executemany("REPLACE INTO summaries (chapter_number, content, updated_at) VALUES (?, ?, ?)",
+                                   summary_rows)
+            self._conn.commit()
+
+        latest_chapter = max((row[0] for row in chapter_rows), default=0)
+        self.sync_artifacts_from_txt(filepath, latest_chapter)
+        logging.info(f"已从 {filepath} 导入 {len(chapter_rows)} 章正文、{len(summary_rows)} 章概括")
+        return len(chapter_rows), len(summary_rows)
+
+    def sync_artifacts_from_txt(self, filepath: str, chapter_number: int = 0) -> None:
+        """
+        导入架构、章节目录、角色状态、剧情等整份文本产物（架构/目录生成后调用）。
+        角色状态与最新版本不同时记为第chapter_number章的新版本。
+        """
+        for name, filename in ARTIFACT_FILES.items():
+            content = read_file(os.path.join(filepath, filename))
+            if content:
+                self.save_artifact(name, content)
+        if os.path.isdir(filepath):
+            for filename in os.listdir(filepath):
+                match = _PLOT_FILE_PATTERN.match(filename)
+                if match:
+                    self.save_artifact(f"plot_{match.group(1)}", read_file(os.path.join(filepath, filename)))
+
+        directory_text = self.get_artifact("directory")
+        if directory_text:
+            self.save_blueprint(directory_text)
+        character_state = self.get_artifact("character_state")
+        if character_state and character_state != self.get_latest_character_state():
+            self.save_character_state(chapter_number, character_state)
+
+    def export_to_txt(self, filepath: str) -> None:
+        """导出为Novel_Output的txt目录结构"""
+        chapters_dir = os.path.join(filepath, "chapters")
+        summary_dir = os.path.join(filepath, "summary_result")
+        os.makedirs(chapters_dir, exist_ok=True)
+        os.makedirs(summary_dir, exist_ok=True)
+        with deferred_fsync():
+            for number, content in self._fetchall("SELECT chapter_number, content FROM chapters"):
+                save_string_to_txt(content, os.path.join(chapters_dir, f"chapter_{number}.txt"))
+            for number, content in self._fetchall("SELECT chapter_number, content FROM summaries"):
+                save_string_to_txt(content, os.path.join(summary_dir, f"chapter_{number}_summary.txt"))
+            for name in self.list_artifacts():
+                filename = ARTIFACT_FILES.get(name, f"{name}.txt")
+                content = self.get_artifact(name)
+                if name == "character_state":
+                    content = self.get_latest_character_state() or content
+                save_string_to_txt(content, os.path.join(filepath, filename))
+        logging.info(f"已导出到 {filepath}")
+
+
+_stores: Dict[str, NovelStore] = {}
+_stores_lock = threading.Lock()
+
+
+def open_novel_store(filepath: str, import_existing: bool = True) -> NovelStore:
+    """
+    为小说输出目录启用SQLite存储（Novel_Output/novel_store.db）。
+    新建数据库时若 import_existing 为True，会先导入已有的txt文件。
+    """
+    key = os.path.abspath(filepath)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is not None:
+            return store
+        os.makedirs(filepath, exist_ok=True)
+        db_path = os.path.join(filepath, STORE_FILENAME)
+        is_new = not os.path.exists(db_path)
+        store = NovelStore(db_path)
+        _stores[key] = store
+    if is_new and import_existing:
+        store.import_from_txt(filepath)
+    return store
+
+
+def get_novel_store(filepath: str) -> Optional[NovelStore]:
+    """返回已启用的SQLite存储，未调用 open_novel_store 时返回None（即使用txt存储）"""
+    return _stores.get(os.path.abspath(filepath))
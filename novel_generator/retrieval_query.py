@@ -0,0 +1,108 @@
+#novel_generator/retrieval_query.py
+# -*- coding: utf-8 -*-
+"""
+知识库检索查询的构造
+默认直接由章节目录解析出的字段（本章简述、衔接要素）和角色状态中的角色名拼出查询，不调用大模型；
+只有检索结果过少或相似度过低（召回差）时，才让大模型把本章信息改写为检索关键词再检索一次。
+"""
+import logging
+from typing import Callable, Dict, List, Optional
+from prompt_definitions import retrieval_query_rewrite_prompt
+from novel_generator.common import invoke_with_cleaning
+from database.call_context import llm_call_context, STAGE_RETRIEVAL_QUERY
+from character_state_model import CharacterState
+
+# 召回判定：有效结果数少于 top_k 的一半，或最高相似度低于该值时视为召回差
+MIN_TOP_SCORE = 0.2
+# 改写查询只输出几行关键词，用较小的输出上限，预算按它预留
+QUERY_REWRITE_MAX_TOKENS = 1024
+
+
+def query_text(chapter_info: dict) -> str:
+    """本章简述 + 衔接要素，用于查找本章涉及的角色"""
+    return "\n".join(filter(None, [
+        chapter_info.get("chapter_summary", ""),
+        chapter_info.get("connection_elements", ""),
+    ]))
+
+
+def characters_in(state: Optional[CharacterState], text: str) -> List[str]:
+    """角色状态中出现在 text 里的角色名，按首次出现的位置排序"""
+    if state is None or not text:
+        return []
+    names = [c.name for c in state.characters if c.name and c.name in text]
+    return sorted(names, key=text.index)
+
+
+def build_retrieval_query(chapter_info: dict, state: Optional[CharacterState] = None) -> str:
+    """由章节目录字段确定性地构造检索查询：标题、简述、衔接要素，以及涉及的角色名"""
+    text = query_text(chapter_info)
+    names = characters_in(state, text)
+    parts = [
+        chapter_info.get("chapter_title", ""),
+        text,
+        # 角色名单独成行，提高含有这些角色的片段的权重
+        " ".join(names),
+    ]
+    return "\n".join(part for part in parts if part)
+
+
+def min_results(top_k: int) -> int:
+    """有效结果数少于该值时视为召回差"""
+    return max(1, top_k // 2)
+
+
+def is_poor_recall(results: List[Dict], top_k: int, min_score: float = MIN_TOP_SCORE) -> bool:
+    """检索结果过少或最高相似度过低"""
+    if len(results) < min_results(top_k):
+        return True
+    return max(result["score"] for result in results) < min_score
+
+
+def rewrite_query(llm_adapter, chapter_info: dict, novel_number: int) -> str:
+    """让大模型把本章信息改写为检索关键词（仅在召回差时调用），失败时返回空字符串"""
+    prompt = retrieval_query_rewrite_prompt.format(
+        novel_number=novel_number,
+        chapter_title=chapter_info.get("chapter_title", ""),
+        chapter_purpose=chapter_info.get("chapter_purpose", ""),
+        connection_elements=chapter_info.get("connection_elements", ""),
+        chapter_summary=chapter_info.get("chapter_summary", ""),
+    )
+    with llm_call_context(stage=STAGE_RETRIEVAL_QUERY, chapter_number=novel_number):
+        return invoke_with_cleaning(llm_adapter, prompt, purpose="改写知识库检索查询").strip()
+
+
+def search_with_fallback(search: Callable[[str], List[Dict]], chapter_info: dict, novel_number: int,
+                         state: Optional[CharacterState] = None, top_k: int = 5,
+                         make_llm_adapter: Optional[Callable[[], object]] = None,
+                         available: Optional[int] = None) -> List[Dict]:
+    """
+    先用确定性查询检索；召回差且提供了 make_llm_adapter 时，用大模型改写的查询再检索一次，合并两次结果。
+    search(query) 返回 [{"chapter", "text", "score"}]。
+    make_llm_adapter 只在需要改写时才调用，召回正常的章节不会创建适配器。
+    available 为可供检索的分块数：少于召回判定所需的结果数时（如开头几章），
+    改写查询也不会得到更多结果，不再调用大模型。
+    """
+    query = build_retrieval_query(chapter_info, state)
+    results = search(query) if query else []
+    if make_llm_adapter is None or not is_poor_recall(results, top_k):
+        return results
+    if available is not None and available < min_results(top_k):
+        logging.info(f"第{novel_number}章可检索的分块只有 {available} 个，不改写检索查询")
+        return results
+
+    logging.info(f"第{novel_number}章知识库召回不足（{len(results)} 个结果），改写检索查询后重试")
+    try:
+        rewritten = rewrite_query(make_llm_adapter(), chapter_info, novel_number)
+    except Exception as e:
+        logging.warning(f"改写检索查询失败: {e}")
+        return results
+    if not rewritten:
+        return results
+
+    merged = {(r["chapter"], r["text"]): r for r in results}
+    for result in search(rewritten):
+        key = (result["chapter"], result["text"])
+        if key not in merged or merged[key]["score"] < result["score"]:
+            merged[key] = result
+    return sorted(merged.values(), key=lambda r: -r["score"])[:top_k]
@@ -0,0 +1,208 @@
+#novel_generator/state_history.py
+# -*- coding: utf-8 -*-
+"""
+角色状态版本历史（只追加）
+每章定稿后追加一个版本，默认存放在 Novel_Output/character_state_history.db。
+每隔 keyframe_interval 个版本保存一个完整的关键帧，其余版本只保存与上一版本的按行差异，均经zlib压缩；
+最新版本常驻内存，读取为O(1)；任意历史版本从最近的关键帧开始最多应用 keyframe_interval-1 个差异即可还原。
+"""
+import os
+import json
+import zlib
+import difflib
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Any
+from novel_generator.workspace import get_workspace
+
+
+HISTORY_FILENAME = "character_state_history.db"
+STATE_FILENAME = "character_state.txt"
+KEYFRAME_INTERVAL = 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS character_state_versions (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    chapter_number INTEGER NOT NULL,
+    is_keyframe INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    raw_size INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_character_state_versions_chapter ON character_state_versions (chapter_number);
+"""
+
+
+def encode_delta(old_text: str, new_text: str) -> bytes:
+    """计算 old_text -> new_text 的按行差异，返回压缩后的字节串"""
+    old_lines = old_text.splitlines(keepends=True)
+    new_lines = new_text.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    # 只记录非equal的片段：[旧文本起始行, 旧文本结束行, 替换后的行]
+    ops = [[i1, i2, new_lines[j1:j2]]
+           for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+    return zlib.compress(json.dumps(ops, ensure_ascii=False).encode('utf-8'))
+
+
+def apply_delta(old_text: str, delta: bytes) -> str:
+    """把 encode_delta 生成的差异应用到 old_text 上"""
+    old_lines = old_text.splitlines(keepends=True)
+    ops = json.loads(zlib.decompress(delta).decode('utf-8'))
+    result, position = [], 0
+    for i1, i2, lines in ops:
+        result.extend(old_lines[position:i1])
+        result.extend(lines)
+        position = i2
+    result.extend(old_lines[position:])
+    return ''.join(result)
+
+
+class CharacterStateHistory:
+    """
+    角色状态版本历史，可使用独立的数据库文件，也可共用 NovelStore 的连接；
+    state_file 为对应的 character_state.txt，回滚时把恢复的内容写回该文件
+    """
+
+    def __init__(self, db_path: Optional[str] = None,
+                 conn: Optional[sqlite3.Connection] = None,
+                 lock: Optional[threading.RLock] = None,
+                 keyframe_interval: int = KEYFRAME_INTERVAL,
+                 state_file: Optional[str] = None):
+        self.state_file = state_file
+        if conn is None:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+        self._conn = conn
+        self._lock = lock or threading.RLock()
+        self.keyframe_interval = max(1, keyframe_interval)
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+        # 最新版本：(版本号, 章节号, 内容, 距上一个关键帧的差异数)
+        self._latest: Optional[Tuple[int, int, str, int]] = None
+        self._load_latest()
+
+    def _load_latest(self) -> None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, chapter_number FROM character_state_versions ORDER BY version DESC LIMIT 1"
+            ).fetchone()
+        if row is None:
+            self._latest = None
+            return
+        content, deltas_since_keyframe = self._reconstruct(row[0])
+        self._latest = (row[0], row[1], content, deltas_since_keyframe)
+
+    def _reconstruct(self, version: int) -> Tuple[str, int]:
+        """从最近的关键帧开始还原指定版本，返回 (内容, 应用的差异数)"""
+        with self._lock:
+            keyframe = self._conn.execute(
+                "SELECT MAX(version) FROM character_state_versions WHERE is_keyframe = 1 AND version <= ?",
+                (version,)
+            ).fetchone()[0]
+            if keyframe is None:
+                raise KeyError(f"角色状态版本 {version} 不存在")
+            rows = self._conn.execute(
+                "SELECT is_keyframe, payload FROM character_state_versions "
+                "WHERE version BETWEEN ? AND ? ORDER BY version",
+                (keyframe, version)
+            ).fetchall()
+        content = zlib.decompress(rows[0][1]).decode('utf-8')
+        for _, payload in rows[1:]:
+            content = apply_delta(content, payload)
+        return content, len(rows) - 1
+
+    def append(self, chapter_number: int, content: str) -> int:
+        """追加一个版本（内容与最新版本相同时不追加），返回版本号"""
+        # 读取最新版本、计算差异和写入在同一把锁内，并发追加时差异不会基于错误的上一版本
+        with self._lock:
+            latest = self._latest
+            if latest is not None and latest[2] == content:
+                return latest[0]
+            if latest is None or latest[3] + 1 >= self.keyframe_interval:
+                is_keyframe, payload, deltas = 1, zlib.compress(content.encode('utf-8')), 0
+            else:
+                is_keyframe, payload, deltas = 0, encode_delta(latest[2], content), latest[3] + 1
+            cursor = self._conn.execute(
+                "INSERT INTO character_state_versions "
+                "(chapter_number, is_keyframe, payload, raw_size, created_at) VALUES (?, ?, ?, ?, ?)",
+                (chapter_number, is_keyframe, payload, len(content.encode('utf-8')),
+                 datetime.now().isoformat(timespec="seconds"))
+            )
+            self._conn.commit()
+            version = cursor.lastrowid
+            self._latest = (version, chapter_number, content, deltas)
+            return version
+
+    def latest(self) -> str:
+        """最新版本的内容，没有任何版本时返回空字符串"""
+        return self._latest[2] if self._latest else ""
+
+    def latest_version(self) -> Optional[int]:
+        return self._latest[0] if self._latest else None
+
+    def get_version(self, version: int) -> str:
+        """还原指定版本的内容"""
+        if self._latest is not None and version == self._latest[0]:
+            return self._latest[2]
+        return self._reconstruct(version)[0]
+
+    def at_chapter(self, chapter_number: int) -> str:
+        """第chapter_number章完成时的角色状态，不存在时返回空字符串"""
+        with self._lock:
+            version = self._conn.execute(
+                "SELECT MAX(version) FROM character_state_versions WHERE chapter_number <= ?",
+                (chapter_number,)
+            ).fetchone()[0]
+        return self.get_version(version) if version is not None else ""
+
+    def versions(self) -> List[Dict[str, Any]]:
+        """列出所有版本的元信息（不还原内容）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT version, chapter_number, is_keyframe, raw_size, LENGTH(payload), created_at "
+                "FROM character_state_versions ORDER BY version"
+            ).fetchall()
+        keys = ("version", "chapter_number", "is_keyframe", "raw_size", "stored_size", "created_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def rollback(self, version: int) -> str:
+        """
+        回滚到指定版本：以该版本内容追加一个新版本（历史保持只追加），
+        并通过工作区写回 character_state.txt（同时更新缓存），返回内容
+        """
+        with self._lock:
+            content = self.get_version(version)
+            chapter_number = self._latest[1] if self._latest else 0
+            # 先写回文件：写入失败时抛出异常，不记录这次回滚
+            if self.state_file:
+                get_workspace(os.path.dirname(os.path.abspath(self.state_file))).write(self.state_file, content)
+            self.append(chapter_number, content)
+        logging.info(f"角色状态已回滚到版本 {version}")
+        return content
+
+
+_histories: Dict[str, CharacterStateHistory] = {}
+_histories_lock = threading.Lock()
+
+
+def get_state_history(filepath: str) -> CharacterStateHistory:
+    """
+    获取小说输出目录的角色状态历史：
+    启用了SQLite存储时使用 novel_store.db，否则使用独立的 character_state_history.db
+    """
+    from novel_generator.novel_store import get_novel_store
+    store = get_novel_store(filepath)
+    if store is not None:
+        return store.character_states
+    key = os.path.abspath(filepath)
+    with _histories_lock:
+        history = _histories.get(key)
+        if history is None:
+            os.makedirs(filepath, exist_ok=True)
+            history = CharacterStateHistory(os.path.join(filepath, HISTORY_FILENAME),
+                                            state_file=os.path.join(filepath, STATE_FILENAME))
+            _histories[key] = history
+        return history
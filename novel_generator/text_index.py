@@ -0,0 +1,238 @@
+#novel_generator/text_index.py
+# -*- coding: utf-8 -*-
+"""
+章节正文和章节概括的倒排索引（BM25）
+中文按连续汉字切分为一元组（单字）和二元组（bigram），英文/数字按单词切分，
+人名等词语检索时同样切分，要求全部命中；单字的名字（如"强"）通过一元组命中。
+索引按文件 (mtime_ns, size) 增量维护，保存在 Novel_Output/text_index.json.gz，
+用于在不调用大模型的情况下，毫秒级找回"角色X和Y上一次同时出现"的前文原文。
+"""
+import os
+import re
+import gzip
+import json
+import math
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+INDEX_FILENAME = "text_index.json.gz"
+# 版本变化时（如切分方式改变）已有索引作废，下次同步时重建
+INDEX_VERSION = 2
+
+_CJK_RUN = re.compile(r'[一-鿿]+')
+_WORD = re.compile(r'[A-Za-z0-9]+')
+_CHAPTER_FILE = re.compile(r'^chapter_(\d+)\.txt$')
+_SUMMARY_FILE = re.compile(r'^chapter_(\d+)_summary\.txt$')
+
+# 文档类型 -> (子目录, 文件名匹配)
+SOURCES = {
+    "chapter": ("chapters", _CHAPTER_FILE),
+    "summary": ("summary_result", _SUMMARY_FILE),
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """汉字连续片段切为一元组和二元组，英文/数字按单词小写"""
+    tokens = []
+    for run in _CJK_RUN.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(word.lower() for word in _WORD.findall(text))
+    return tokens
+
+
+class TextIndex:
+    """BM25倒排索引，文档ID为 "chapter:12" / "summary:12" """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.index_file = os.path.join(filepath, INDEX_FILENAME)
+        self._lock = threading.RLock()
+        # 词 -> {文档ID: 词频}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        # 文档ID -> {"kind", "chapter", "length", "key": [mtime_ns, size], "path"}
+        self.docs: Dict[str, Dict] = {}
+        self._load()
+
+    # ---------------- 持久化 ----------------
+    def _load(self) -> None:
+        try:
+            with gzip.open(self.index_file, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != INDEX_VERSION:
+            return
+        self.postings = data.get("postings", {})
+        self.docs = data.get("docs", {})
+
+    def save(self) -> None:
+        with self._lock:
+            data = {"version": INDEX_VERSION, "postings": self.postings, "docs": self.docs}
+            tmp_file = self.index_file + ".tmp"
+            payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            with gzip.open(tmp_file, 'wb', compresslevel=1) as f:
+                f.write(payload)
+            os.replace(tmp_file, self.index_file)
+
+    # ---------------- 增量维护 ----------------
+    def _remove_doc(self, doc_id: str) -> None:
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        # 只在章节被改写或删除时发生，直接扫描词表
+        for term in [t for t, postings in self.postings.items() if doc_id in postings]:
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+
+    def add_document(self, kind: str, chapter_number: int, text: str,
+                     path: Optional[str] = None, key: Optional[List[int]] = None) -> None:
+        """添加或替换一个文档"""
+        doc_id = f"{kind}:{chapter_number}"
+        counts = Counter(tokenize(text))
+        with self._lock:
+            self._remove_doc(doc_id)
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            self.docs[doc_id] = {
+                "kind": kind, "chapter": chapter_number, "length": sum(counts.values()),
+                "key": key, "path": path,
+            }
+
+    def sync(self) -> int:
+        """扫描 chapters/ 和 summary_result/，只重新索引新增或变化的文件，返回更新的文档数"""
+        updated, seen = 0, set()
+        for kind, (subdir, pattern) in SOURCES.items():
+            directory = os.path.join(self.filepath, subdir)
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    match = pattern.match(entry.name)
+                    if not match:
+                        continue
+                    chapter_number = int(match.group(1))
+                    doc_id = f"{kind}:{chapter_number}"
+                    seen.add(doc_id)
+                    st = entry.stat()
+                    key = [st.st_mtime_ns, st.st_size]
+                    doc = self.docs.get(doc_id)
+                    if doc is not None and doc.get("key") == key:
+                        continue
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        self.add_document(kind, chapter_number, f.read(), path=entry.path, key=key)
+                    updated += 1
+        with self._lock:
+            for doc_id in [d for d in self.docs if d not in seen and self.docs[d].get("path")]:
+                self._remove_doc(doc_id)
+                updated += 1
+        if updated:
+            self.save()
+            logging.info(f"倒排索引已更新 {updated} 个文档")
+        return updated
+
+    # ---------------- 检索 ----------------
+    def _candidate_docs(self, kind: Optional[str], before_chapter: Optional[int]) -> Dict[str, Dict]:
+        return {
+            doc_id: doc for doc_id, doc in self.docs.items()
+            if (kind is None or doc["kind"] == kind)
+            and (before_chapter is None or doc["chapter"] < before_chapter)
+        }
+
+    def search(self, query: str, top_k: int = 5, kind: Optional[str] = None,
+               before_chapter: Optional[int] = None) -> List[Tuple[str, float]]:
+        """BM25检索，返回 [(文档ID, 分数)]，按分数降序"""
+        with self._lock:
+            docs = self._candidate_docs(kind, before_chapter)
+            if not docs:
+                return []
+            avg_length = sum(doc["length"] for doc in docs.values()) / len(docs) or 1.0
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                df = sum(1 for doc_id in postings if doc_id in docs)
+                if not df:
+                    continue
+                idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+                for doc_id, tf in postings.items():
+                    doc = docs.get(doc_id)
+                    if doc is None:
+                        continue
+                    norm = tf + self.K1 * (1 - self.B + self.B * doc["length"] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.K1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+
+    def docs_containing_all(self, terms: List[str], kind: Optional[str] = None,
+                            before_chapter: Optional[int] = None) -> List[str]:
+        """包含所有词语（如多个角色名）的文档ID，按章节号从新到旧排列"""
+        with self._lock:
+            candidates = set(self._candidate_docs(kind, before_chapter))
+            for term in terms:
+                for token in set(tokenize(term)):
+                    candidates &= set(self.postings.get(token, {}))
+                    if not candidates:
+                        return []
+            return sorted(candidates, key=lambda doc_id: -self.docs[doc_id]["chapter"])
+
+    def find_scenes(self, names: List[str], before_chapter: Optional[int] = None,
+                    limit: int = 2, window: int = 150) -> List[Dict]:
+        """
+        查找多个角色最近一次同时出现的章节正文片段，
+        返回 [{"chapter": 章节号, "text": 片段}]（片段取两个名字距离最近处前后 window 字）
+        """
+        scenes = []
+        for doc_id in self.docs_containing_all(names, kind="chapter", before_chapter=before_chapter):
+            path = self.docs[doc_id].get("path")
+            if not path or not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            snippet = _cooccurrence_snippet(text, names, window)
+            if snippet:
+                scenes.append({"chapter": self.docs[doc_id]["chapter"], "text": snippet})
+                if len(scenes) >= limit:
+                    break
+        return scenes
+
+
+def _cooccurrence_snippet(text: str, names: List[str], window: int) -> str:
+    """所有名字都出现时，返回它们最靠近的位置附近的片段"""
+    positions = {name: [m.start() for m in re.finditer(re.escape(name), text)] for name in names}
+    if not all(positions.values()):
+        return ""
+    anchor_name = names[0]
+    best, best_span = None, None
+    for anchor in positions[anchor_name]:
+        nearest = [min(positions[name], key=lambda p: abs(p - anchor)) for name in names[1:]]
+        start, end = min([anchor] + nearest), max([anchor] + nearest)
+        if best_span is None or end - start < best_span:
+            best, best_span = (start, end), end - start
+    start = max(0, best[0] - window)
+    end = min(len(text), best[1] + window)
+    return text[start:end].strip()
+
+
+_indexes: Dict[str, TextIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_text_index(filepath: str, sync: bool = True) -> TextIndex:
+    """获取小说输出目录的倒排索引，sync为True时先增量同步文件变化"""
+    key = os.path.abspath(filepath)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = TextIndex(filepath)
+            _indexes[key] = index
+    if sync:
+        index.sync()
+    return index
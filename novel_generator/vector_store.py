@@ -0,0 +1,332 @@
+#novel_generator/vector_store.py
+# -*- coding: utf-8 -*-
+"""
+本地向量知识库（Novel_Output/vectorstore/）
+每章定稿后把正文分块、向量化并追加到知识库；写下一章前按章节目录检索最相关的前文片段注入提示词。
+    - vectors.f32：float32 矩阵（每行一个分块），以 numpy.memmap 只读映射，检索时按需分页读入
+    - chunks.jsonl：每行一个分块的元信息（章节号、批次、文本），与矩阵行一一对应
+同一章重新写入时只追加新的一批分块并更新有效行掩码，失效的分块过多时压缩两个文件。
+向量默认使用字符 unigram/bigram 的特征哈希（不依赖模型与网络，可离线使用），相似度为余弦相似度。
+依赖 numpy，未安装时知识库不生效（检索返回空列表）。
+"""
+import os
+import json
+import zlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STORE_DIRNAME = "vectorstore"
+DEFAULT_DIM = 512
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_CHUNK_OVERLAP = 100
+
+
+def chunk_text(text: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+               overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[str]:
+    """按段落把文本拼成不超过 chunk_size 字的分块，相邻分块重叠 overlap 字"""
+    paragraphs = [p.strip() for p in text.splitlines() if p.strip()]
+    chunks, current = [], ""
+    for paragraph in paragraphs:
+        while len(paragraph) > chunk_size:
+            # 超长段落直接切开
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:chunk_size])
+            paragraph = paragraph[chunk_size - overlap:]
+        if current and len(current) + len(paragraph) + 1 > chunk_size:
+            chunks.append(current)
+            current = current[-overlap:] if overlap else ""
+        current = f"{current}\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def hash_embed(texts: List[str], dim: int = DEFAULT_DIM) -> "np.ndarray":
+    """
+    特征哈希向量：字符unigram和bigram经crc32映射到 dim 维（带符号），L2归一化。
+    返回 (len(texts), dim) 的float32矩阵。
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    rows, cols, signs = [], [], []
+    for row, text in enumerate(texts):
+        text = "".join(text.split())
+        grams = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+        for gram in grams:
+            h = zlib.crc32(gram.encode('utf-8'))
+            rows.append(row)
+            cols.append(h % dim)
+            signs.append(1.0 if (h >> 31) & 1 else -1.0)
+    if rows:
+        np.add.at(matrix, (np.asarray(rows), np.asarray(cols)), np.asarray(signs, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _reserve(array: "np.ndarray", size: int) -> "np.ndarray":
+    """容量不足 size 行时按倍数扩容（复制已有内容），追加一行的均摊开销为O(1)"""
+    if len(array) >= size:
+        return array
+    grown = np.zeros((max(size, 2 * len(array), 64),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _fsync_write(path: str, data: bytes) -> None:
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class VectorStore:
+    """追加写入的向量知识库，同一章节重新写入时旧分块失效，失效的分块过多时压缩文件"""
+
+    # 失效分块超过总行数的该比例（且不少于 COMPACT_MIN_ROWS 行）时压缩
+    COMPACT_RATIO = 0.5
+    COMPACT_MIN_ROWS = 256
+    # 映射之后追加的向量先保存在内存中，超过已映射行数的 1/REMAP_FRACTION（且不少于 REMAP_MIN_ROWS 行）时重新映射
+    REMAP_FRACTION = 4
+    REMAP_MIN_ROWS = 256
+
+    def __init__(self, directory: str, dim: int = DEFAULT_DIM,
+                 embed: Optional[Callable[[List[str], int], "np.ndarray"]] = None):
+        if np is None:
+            raise ImportError("向量知识库需要 numpy")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self.embed = embed or hash_embed
+        self.vectors_file = os.path.join(directory, "vectors.f32")
+        self.chunks_file = os.path.join(directory, "chunks.jsonl")
+        self._lock = threading.Lock()
+        self._chunks: List[Dict] = []
+        # 章节号 -> 最新一批分块的行范围 (start, stop)，批次号即该批第一行的行号
+        self._spans: Dict[int, Tuple[int, int]] = {}
+        self._rows = 0
+        self._active_rows = 0
+        # 按容量扩容的缓冲区，前 _rows 行有效
+        self._active = np.zeros(0, dtype=bool)
+        self._chapters = np.zeros(0, dtype=np.int32)
+        # 已映射的前 _mapped 行，以及之后追加、尚未映射的向量
+        self._matrix = None
+        self._mapped = 0
+        self._tail = np.zeros((0, dim), dtype=np.float32)
+        self._load()
+
+    def _load(self) -> None:
+        self._recover_compaction()
+        if os.path.exists(self.chunks_file):
+            with open(self.chunks_file, 'r', encoding='utf-8') as f:
+                self._chunks = [json.loads(line) for line in f if line.strip()]
+        # 写入向量后、写入元信息前中断时，截掉多出的向量行，保持与元信息一一对应
+        expected_size = len(self._chunks) * self.dim * 4
+        vectors_size = os.path.getsize(self.vectors_file) if os.path.exists(self.vectors_file) else 0
+        if vectors_size > expected_size:
+            with open(self.vectors_file, 'r+b') as f:
+                f.truncate(expected_size)
+        elif vectors_size < expected_size:
+            # 向量文件缺失或不完整：丢弃没有向量的分块，之后追加的行才能与元信息对齐
+            available = vectors_size // (self.dim * 4)
+            logging.warning(f"向量文件只有 {available} 行，丢弃之后的 {len(self._chunks) - available} 个分块")
+            self._chunks = self._chunks[:available]
+            with open(self.vectors_file, 'ab') as f:
+                f.truncate(available * self.dim * 4)
+            lines = "".join(json.dumps(chunk, ensure_ascii=False) + "\n" for chunk in self._chunks)
+            _fsync_write(self.chunks_file + ".tmp", lines.encode('utf-8'))
+            os.replace(self.chunks_file + ".tmp", self.chunks_file)
+        self._rebuild()
+
+    def _recover_compaction(self) -> None:
+        """
+        压缩先写好两个临时文件，以替换 chunks.jsonl 为提交点：
+        两个临时文件都在时压缩未提交，丢弃；只剩向量临时文件时元信息已替换，补完向量文件的替换
+        """
+        vectors_tmp, chunks_tmp = self.vectors_file + ".tmp", self.chunks_file + ".tmp"
+        if os.path.exists(vectors_tmp):
+            if os.path.exists(chunks_tmp):
+                os.remove(chunks_tmp)
+                os.remove(vectors_tmp)
+            else:
+                os.replace(vectors_tmp, self.vectors_file)
+        elif os.path.exists(chunks_tmp):
+            os.remove(chunks_tmp)
+
+    def _rebuild(self) -> None:
+        """根据全部分块元信息重建有效行掩码并映射向量矩阵，只在加载和压缩后执行"""
+        # 以最后一次写入为准：每章只保留最新一批分块
+        self._spans = {}
+        for row, chunk in enumerate(self._chunks):
+            span = self._spans.get(chunk["chapter"])
+            start = span[0] if span is not None and span[0] == chunk["batch"] else row
+            self._spans[chunk["chapter"]] = (start, row + 1)
+        self._rows = len(self._chunks)
+        self._active = np.zeros(self._rows, dtype=bool)
+        for start, stop in self._spans.values():
+            self._active[start:stop] = True
+        self._active_rows = int(self._active.sum())
+        self._chapters = np.array([c["chapter"] for c in self._chunks], dtype=np.int32)
+        self._matrix, self._mapped = None, 0
+        self._tail = np.zeros((0, self.dim), dtype=np.float32)
+        self._remap()
+
+    def _remap(self) -> None:
+        """重新映射向量文件的全部行，清空内存中的追加部分"""
+        rows = self._rows
+        if rows:
+            self._matrix = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(rows, self.dim))
+            self._mapped = rows
+            self._tail = np.zeros((0, self.dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return self._active_rows
+
+    def count(self, before_chapter: Optional[int] = None) -> int:
+        """有效分块数，before_chapter 指定时只统计该章之前的章节"""
+        with self._lock:
+            if before_chapter is None:
+                return self._active_rows
+            rows = self._rows
+            return int((self._active[:rows] & (self._chapters[:rows] < before_chapter)).sum())
+
+    def add_chapter(self, chapter_number: int, text: str) -> int:
+        """把一章正文分块后追加到知识库，返回分块数"""
+        chunks = chunk_text(text)
+        if not chunks:
+            return 0
+        vectors = self.embed(chunks, self.dim).astype(np.float32)
+        with self._lock:
+            batch = start = self._rows
+            stop = start + len(chunks)
+            with open(self.vectors_file, 'ab') as f:
+                f.write(vectors.tobytes())
+            with open(self.chunks_file, 'a', encoding='utf-8') as f:
+                for chunk in chunks:
+                    f.write(json.dumps({"chapter": chapter_number, "batch": batch, "text": chunk},
+                                       ensure_ascii=False) + "\n")
+            self._chunks.extend({"chapter": chapter_number, "batch": batch, "text": c} for c in chunks)
+
+            # 只更新新增的行和该章上一批分块的掩码，不重建
+            self._active = _reserve(self._active, stop)
+            self._chapters = _reserve(self._chapters, stop)
+            self._tail = _reserve(self._tail, stop - self._mapped)
+            previous = self._spans.get(chapter_number)
+            if previous is not None:
+                self._active[previous[0]:previous[1]] = False
+                self._active_rows -= previous[1] - previous[0]
+            self._active[start:stop] = True
+            self._chapters[start:stop] = chapter_number
+            self._tail[start - self._mapped:stop - self._mapped] = vectors
+            self._spans[chapter_number] = (start, stop)
+            self._rows = stop
+            self._active_rows += len(chunks)
+
+            superseded = self._rows - self._active_rows
+            if superseded >= self.COMPACT_MIN_ROWS and superseded > self._rows * self.COMPACT_RATIO:
+                self._compact()
+            elif self._rows - self._mapped >= max(self.REMAP_MIN_ROWS, self._mapped // self.REMAP_FRACTION):
+                self._remap()
+        return len(chunks)
+
+    def _compact(self) -> None:
+        """去掉失效的分块，重写向量文件和元信息（批次号改为新的行号），调用方持有锁"""
+        keep = np.flatnonzero(self._active[:self._rows])
+        mapped = keep[keep < self._mapped]
+        vectors = np.concatenate([
+            np.asarray(self._matrix[mapped]) if len(mapped) else np.zeros((0, self.dim), dtype=np.float32),
+            self._tail[keep[keep >= self._mapped] - self._mapped],
+        ])
+        chunks, batches = [], {}
+        for row in keep:
+            chunk = self._chunks[row]
+            batch = batches.setdefault((chunk["chapter"], chunk["batch"]), len(chunks))
+            chunks.append({"chapter": chunk["chapter"], "batch": batch, "text": chunk["text"]})
+        lines = "".join(json.dumps(chunk, ensure_ascii=False) + "\n" for chunk in chunks)
+        _fsync_write(self.vectors_file + ".tmp", vectors.astype(np.float32).tobytes())
+        _fsync_write(self.chunks_file + ".tmp", lines.encode('utf-8'))
+        self._matrix = None
+        os.replace(self.chunks_file + ".tmp", self.chunks_file)
+        os.replace(self.vectors_file + ".tmp", self.vectors_file)
+        logging.info(f"向量知识库已压缩：{self._rows} -> {len(chunks)} 个分块")
+        self._chunks = chunks
+        self._rebuild()
+
+    def search(self, query: str, top_k: int = 5, before_chapter: Optional[int] = None,
+               min_score: float = 0.0) -> List[Dict]:
+        """
+        余弦相似度检索，返回 [{"chapter": 章节号, "text": 片段, "score": 相似度}]，按相似度降序。
+        before_chapter 指定时只检索该章之前的章节。
+        """
+        with self._lock:
+            rows, mapped = self._rows, self._mapped
+            # 掩码会被原地更新，在锁内复制；其余数组的前 rows 行不再变化
+            mask = self._active[:rows].copy()
+            chapters, matrix, tail, chunks = self._chapters[:rows], self._matrix, self._tail[:rows - mapped], self._chunks
+        if not rows or not query.strip():
+            return []
+        if before_chapter is not None:
+            mask &= chapters < before_chapter
+        if not mask.any():
+            return []
+        query_vector = self.embed([query], self.dim)[0]
+        scores = np.empty(rows, dtype=np.float32)
+        if mapped:
+            scores[:mapped] = matrix @ query_vector
+        if rows > mapped:
+            scores[mapped:] = tail @ query_vector
+        scores[~mask] = -np.inf
+        k = min(top_k, int(mask.sum()))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"chapter": chunks[i]["chapter"], "text": chunks[i]["text"], "score": float(scores[i])}
+            for i in top if scores[i] > min_score
+        ]
+
+
+_stores: Dict[str, VectorStore] = {}
+_stores_lock = threading.Lock()
+_warned = False
+
+
+def get_vector_store(filepath: str) -> Optional[VectorStore]:
+    """获取小说输出目录的向量知识库，未安装numpy时返回None"""
+    global _warned
+    if np is None:
+        if not _warned:
+            logging.warning("未安装numpy，向量知识库不生效")
+            _warned = True
+        return None
+    key = os.path.abspath(filepath)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = VectorStore(os.path.join(filepath, STORE_DIRNAME))
+            _stores[key] = store
+        return store
+
+
+def format_snippets(results: List[Dict], max_chars: int = 1500,
+                    priority: Optional[Callable[[Dict], float]] = None) -> str:
+    """
+    把检索结果格式化为提示词中的前文片段，总长度不超过 max_chars。
+    按 priority 从高到低依次选取（默认按相似度 score），选中的片段再按章节顺序排列。
+    """
+    if priority is None:
+        priority = lambda r: r["score"]
+    selected, total = [], 0
+    for result in sorted(results, key=priority, reverse=True):
+        snippet = f"（第{result['chapter']}章）{result['text']}"
+        if total + len(snippet) > max_chars and selected:
+            break
+        selected.append((result["chapter"], snippet))
+        total += len(snippet)
+    return "\n\n".join(snippet for _, snippet in sorted(selected, key=lambda item: item[0]))
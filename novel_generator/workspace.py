@@ -0,0 +1,129 @@
+#novel_generator/workspace.py
+# -*- coding: utf-8 -*-
+"""
+Novel_Output 目录的读写缓存
+文件内容按 (路径, mtime_ns, size) 缓存，文件未变化时直接返回内存中的内容；
+通过 write() 写入的文件会同步更新缓存，下次读取不再访问磁盘。
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional, Tuple
+from utils import read_file, atomic_write
+from tracing import span
+
+
+class NovelWorkspace:
+    """单个小说输出目录的文件缓存"""
+
+    def __init__(self, filepath: str, max_entries: int = 256):
+        self.filepath = filepath
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        # 绝对路径 -> ((mtime_ns, size), 内容)，按最近使用排序
+        self._cache: "OrderedDict[str, Tuple[Tuple[int, int], str]]" = OrderedDict()
+        # (绝对路径, 名称) -> ((mtime_ns, size), 派生结果)，如解析后的章节目录
+        self._derived: Dict[Tuple[str, str], Tuple[Tuple[int, int], Any]] = {}
+
+    def path(self, *parts: str) -> str:
+        """拼接出目录内的文件路径"""
+        return os.path.join(self.filepath, *parts)
+
+    @staticmethod
+    def _stat_key(abs_path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _resolve(path: str) -> str:
+        return os.path.abspath(path)
+
+    def read(self, path: str) -> str:
+        """读取文件内容，文件不存在时返回空字符串"""
+        return self._read(self._resolve(path))[1]
+
+    def _read(self, abs_path: str) -> Tuple[Optional[Tuple[int, int]], str]:
+        """返回 ((mtime_ns, size), 内容)，只stat一次；文件不存在时为 (None, "")"""
+        key = self._stat_key(abs_path)
+        if key is None:
+            with self._lock:
+                self._cache.pop(abs_path, None)
+            return None, ""
+        with self._lock:
+            cached = self._cache.get(abs_path)
+            if cached is not None and cached[0] == key:
+                self._cache.move_to_end(abs_path)
+                return key, cached[1]
+        content = read_file(abs_path)
+        self._store(abs_path, key, content)
+        return key, content
+
+    def read_derived(self, path: str, name: str, func: Callable[[str], Any]) -> Any:
+        """
+        返回 func(文件内容) 的结果，文件未变化时复用上次的结果。
+        例如：workspace.read_derived(workspace.path("Novel_directory.txt"), "blueprint", parse_chapter_blueprint)
+        """
+        abs_path = self._resolve(path)
+        key, content = self._read(abs_path)
+        with self._lock:
+            cached = self._derived.get((abs_path, name))
+            if cached is not None and key is not None and cached[0] == key:
+                return cached[1]
+        result = func(content)
+        if key is not None:
+            with self._lock:
+                self._derived[(abs_path, name)] = (key, result)
+        return result
+
+    def write(self, path: str, content: str, fsync: bool = True) -> None:
+        """原子写入文件并更新缓存；写入失败时抛出异常，并清除该文件的缓存"""
+        abs_path = self._resolve(path)
+        try:
+            with span("file.write", path=abs_path, chars=len(content)):
+                atomic_write(abs_path, content, fsync=fsync)
+        except OSError:
+            self.invalidate(abs_path)
+            raise
+        key = self._stat_key(abs_path)
+        if key is not None:
+            self._store(abs_path, key, content)
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(self._resolve(path))
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """清除某个文件或全部文件的缓存"""
+        with self._lock:
+            if path is None:
+                self._cache.clear()
+                self._derived.clear()
+                return
+            abs_path = self._resolve(path)
+            self._cache.pop(abs_path, None)
+            for derived_key in [k for k in self._derived if k[0] == abs_path]:
+                del self._derived[derived_key]
+
+    def _store(self, abs_path: str, key: Tuple[int, int], content: str) -> None:
+        with self._lock:
+            self._cache[abs_path] = (key, content)
+            self._cache.move_to_end(abs_path)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+
+_workspaces: Dict[str, NovelWorkspace] = {}
+_workspaces_lock = threading.Lock()
+
+
+def get_workspace(filepath: str) -> NovelWorkspace:
+    """获取某个小说输出目录对应的（进程内共享的）工作区"""
+    key = os.path.abspath(filepath)
+    with _workspaces_lock:
+        workspace = _workspaces.get(key)
+        if workspace is None:
+            workspace = NovelWorkspace(filepath)
+            _workspaces[key] = workspace
+        return workspace
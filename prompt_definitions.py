@@ -10,6 +10,9 @@ summarize_recent_chapters_prompt = """\
 最近章节概要：
 {recent_summaries}
 
+本章涉及角色的前文原场景：
+{earlier_scenes}
+
 第{last_chapter_number}章完整内容：
 {combined_text}
 
@@ -273,6 +276,88 @@ chunked_chapter_blueprint_prompt = """\
 仅给出最终文本，不要解释任何内容。
 """
 
+# =============== 并行章节目录生成：章节骨架 ===================
+chapter_skeleton_prompt = """\
+你是一名专业的小说家，请你基于以下元素，为总共{number_of_chapters}章的小说先列出章节骨架：
+
+- 小说架构：{novel_architecture}
+
+各剧情部分对应的章节范围（骨架需遵守这些分界）：
+{part_ranges}
+
+当前已有章节信息（若为空则说明是初始生成）：
+{chapter_list}
+
+现在请列出第{n}章到第{m}章的骨架，每章只占一行：
+第n章 - [标题]：一句话概括本章发生的核心事件
+
+要求：
+- 严格一章一行，不要空行，不要输出其他字段。
+- 每行的概括控制在40字以内，写清楚本章推动了什么。
+- 相邻章节之间要有因果衔接，每3-5章构成一个悬念单元。
+- 重要事件必须在之前章节中有所铺垫。
+- 在第{number_of_chapters}章前不要出现结局章节。
+
+仅给出最终文本，不要解释任何内容。
+"""
+
+# =============== 并行章节目录生成：按骨架展开分块 ===================
+skeleton_chunk_blueprint_prompt = """\
+你是一名专业的小说家，正在为总共{number_of_chapters}章的小说编写章节目录。全书的章节骨架已经确定，
+其他章节由别人同时编写，你只负责第{n}章到第{m}章。
+
+- 小说架构：{novel_architecture}
+
+全书章节骨架（一章一行）：
+{skeleton}
+
+第{n}章之前的章节信息（若为空则以骨架为准）：
+{chapter_list}
+
+现在请把骨架中第{n}章到第{m}章展开为完整的章节信息：
+- 每章的标题和核心事件以骨架为准，不要改变章节顺序，也不要提前写出骨架中后续章节的事件
+- 衔接要素需与骨架中的前一章和后一章对应
+- 重要事件必须在之前章节中有所铺垫或提及
+
+输出格式示例：
+第n章 - [标题]
+本章定位：[角色/事件/主题/...]
+核心作用：[推进/转折/揭示/...]
+语言风格：[根据章节具体情况选择合适的语言风格]
+衔接要素：[承接前章的XXX/为下章XXX做铺垫]
+本章简述：[精确地概括]
+
+要求：
+- 使用精炼语言描述，每章字数控制在200字以内。
+- 只输出第{n}章到第{m}章，章节编号与骨架一致。
+- 章节之间连贯过渡，避免突兀，不要与骨架中其他章节的内容重复。
+- 每章小说的正文内容在2000字左右，请合理安排每章剧情容量。
+
+仅给出最终文本，不要解释任何内容。
+"""
+
+# =============== 并行章节目录生成：分块交界处的衔接修订 ===================
+blueprint_boundary_reconcile_prompt = """\
+以下章节目录由两位作者分别编写，交界处可能存在衔接不上、事件重复或前后矛盾的问题。
+
+交界附近的参考内容（章节骨架或剧情部分）：
+{reference}
+
+前一块的最后几章：
+{before}
+
+后一块的开头几章：
+{after}
+
+请修订以上章节，使其自然衔接：
+- 只做必要的修改，保持章节编号不变，标题和核心事件与参考内容一致
+- 修正衔接要素，使前一章的铺垫与后一章的承接相互对应
+- 删除两块之间重复的情节，补足缺失的过渡
+
+按原格式输出修订后的全部章节（前一块的最后几章和后一块的开头几章），每章之间空一行。
+仅给出最终文本，不要解释任何内容。
+"""
+
 # =============== 基于剧情部分的章节目录生成 ===================
 part_based_chapter_blueprint_prompt = """\
 你正在根据一部言情小说的第{current_part_number}部分的剧情内容生成小说章节目录。
@@ -329,6 +414,53 @@ part_based_chapter_blueprint_prompt = """\
 仅给出最终文本，不要解释任何内容。
 """
 
+# =============== 基于剧情部分的章节目录并行生成 ===================
+parallel_part_chapter_blueprint_prompt = """\
+你正在根据一部言情小说的第{current_part_number}部分的剧情内容生成小说章节目录。
+各部分的章节目录由不同作者同时编写，你只负责当前部分。
+
+相关剧情部分（包含前后相邻部分，用于把握衔接）：
+{plot_context}
+
+当前部分标题：{current_part_title}
+
+生成要求：
+1. 根据上述剧情部分内容，为当前部分生成至少{min_chapters}个章节的目录
+
+2. 章节设计原则：
+- 紧密贴合当前部分的剧情发展，不要写出相邻部分的剧情
+- 合理利用相关剧情部分的内容作为上下文参考
+- 开头几章承接前一部分的结尾，最后几章为后一部分做铺垫
+
+3. 章节分布策略：
+- 根据剧情密度合理分配章节内容
+- 重要情节转折点需要单独成章
+- 适当安排情感发展和角色互动章节
+- 保持整体节奏的起伏变化
+
+4. 章节编号：从第1章开始连续编号，合并时会统一调整为全书编号
+
+输出格式示例：
+第n章 - [标题]
+本章定位：[角色/事件/主题/...]
+核心作用：[铺垫/推进/转折/揭示/...]
+语言风格：[根据章节具体情况选择合适的语言风格]
+衔接要素：[承接前章的XXX/为后续章节XXX做铺垫]
+本章简述：[精准概括]
+
+要求：
+- 使用精炼语言描述，每章字数控制在200字以内
+- 合理安排剧情发展节奏，剧情可以包括主线、支线、日常等
+- 你可以发挥想象力，加入更多合理的剧情内容
+- 章节之间连贯过渡，避免突兀
+- 确保章节内容不重复，各有特色
+- 重点体现当前部分的核心剧情和情感发展
+- 每章小说的正文内容在2000-2300字左右，请合理安排每章剧情容量
+- 生成至少{min_chapters}个章节，可以根据剧情需要适当增加
+
+仅给出最终文本，不要解释任何内容。
+"""
+
 # =============== 获取正文摘要 ===================
 summary_prompt = """你是一位专业的叙事概括专家，请对以下故事内容进行精确总结。
 
@@ -401,6 +533,48 @@ update_character_state_prompt = """\
 仅返回更新后的角色状态文档和新出场角色，不要做任何解释。
 """
 
+# =============== 增量更新角色状态 ===================
+# 只让模型输出本章新增的事件和新出场角色，由程序合并进角色状态文档，输出长度与角色数量无关
+update_character_state_delta_prompt = """\
+请根据新完成的章节文本，找出角色状态文档需要增加的内容：
+
+以下是新完成的章节文本：
+{chapter_text}
+
+当前的角色状态文档：
+{old_state}
+
+要求：
+- 只输出本章新增的关键事件，不要重复文档中已有的事件
+- "add_events"的键必须是文档中已有角色的名称（"角色X："后面的名称），值为该角色本章新增的事件列表
+- "new_characters"为本章新出场、文档中还没有的角色或临时人物，格式为"名称：简要描述"
+- "remove_new_characters"为"新出场角色"中已淡出视线、可以删除的角色名称
+- 没有需要增加的内容时对应字段返回空列表或空对象
+
+仅返回如下格式的JSON，不要做任何解释，不要使用markdown格式：
+{{
+  "add_events": {{"角色名称": ["事件描述"]}},
+  "new_characters": ["名称：简要描述"],
+  "remove_new_characters": ["名称"]
+}}
+"""
+
+# =============== 知识库检索查询改写 ===================
+# 仅在按章节目录直接构造的查询召回不足时使用
+retrieval_query_rewrite_prompt = """\
+请为第{novel_number}章《{chapter_title}》生成用于在前文中检索相关情节的关键词。
+
+本章信息：
+- 核心作用：{chapter_purpose}
+- 衔接要素：{connection_elements}
+- 本章简述：{chapter_summary}
+
+要求：
+- 列出本章可能需要回顾的前文人物、地点、物品、事件和伏笔
+- 使用小说正文中可能出现的具体词语，不要使用概括性的描述
+- 只输出一行关键词，用空格分隔，不要做任何解释
+"""
+
 # =============== 章节正文写作 ===================
 
 # 创作第一章正文
@@ -449,6 +623,9 @@ next_chapter_draft_prompt = """\
 - 当前章节摘要：
 {short_summary}
 
+- 相关前文片段（从知识库中检索的更早章节原文，供保持前后一致）：
+{knowledge_context}
+
 当前章节信息：
 第{novel_number}章《{chapter_title}》：
 - 章节定位：{chapter_role}
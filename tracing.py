@@ -0,0 +1,207 @@
+# tracing.py
+# -*- coding: utf-8 -*-
+"""
+轻量级链路追踪（参考 OpenTelemetry 的 span 模型）
+用嵌套的 span 记录 章节 -> 阶段 -> LLM调用 / 文件读写 的耗时，
+导出为 JSON Lines 文件，每行一个 Chrome Trace Event（ph="X"），
+用 export_chrome_trace() 转换后可在 chrome://tracing 或 https://ui.perfetto.dev 中查看火焰图/时间线。
+
+开启方式：
+    - 设置环境变量 NOVEL_TRACE_FILE=./Novel_Output/trace.jsonl
+    - 或在代码中调用 enable_tracing("./Novel_Output/trace.jsonl")
+未开启时 span() 直接返回共享的空对象，开销只有一次函数调用。
+"""
+import os
+import json
+import time
+import uuid
+import atexit
+import asyncio
+import functools
+import threading
+import contextvars
+from typing import Optional, Dict, Any
+
+
+class _NoopSpan:
+    """未开启追踪时使用的空span"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+# 当前所在的span，用于确定父子关系（线程池中执行时需复制上下文才能继承）
+_current_span: contextvars.ContextVar = contextvars.ContextVar("trace_current_span", default=None)
+
+
+class _JsonlExporter:
+    """把结束的span追加写入JSON Lines文件，按条数批量刷新"""
+
+    def __init__(self, path: str, flush_every: int = 64):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def export(self, event: Dict[str, Any]) -> None:
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.flush_every:
+                self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if self._buffer and not self._file.closed:
+            self._file.write('\n'.join(self._buffer) + '\n')
+            self._file.flush()
+        self._buffer.clear()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_locked()
+            self._file.close()
+
+
+_exporter: Optional[_JsonlExporter] = None
+
+
+class Span:
+    """一个计时区间，退出with块时导出"""
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_id",
+                 "_start_ns", "_start_perf", "_token")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        parent = _current_span.get()
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._start_ns = time.time_ns()
+        self._start_perf = time.perf_counter_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ns = time.perf_counter_ns() - self._start_perf
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export({
+                "name": self.name,
+                "ph": "X",
+                "ts": self._start_ns // 1000,      # 微秒
+                "dur": duration_ns // 1000,        # 微秒
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": dict(self.attributes, trace_id=self.trace_id,
+                             span_id=self.span_id, parent_id=self.parent_id),
+            })
+        return False
+
+
+def span(name: str, **attributes):
+    """
+    创建一个span，用法：
+        with span("chapter", chapter_number=3):
+            ...
+    """
+    if _exporter is None:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def traced(name: Optional[str] = None):
+    """函数装饰器，把整个函数调用记录为一个span，支持协程函数"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def tracing_enabled() -> bool:
+    return _exporter is not None
+
+
+def enable_tracing(path: str, flush_every: int = 64) -> None:
+    """开启追踪，span导出到path（JSON Lines，追加写）"""
+    global _exporter
+    disable_tracing()
+    _exporter = _JsonlExporter(path, flush_every)
+
+
+def disable_tracing() -> None:
+    """关闭追踪并把缓冲区写入文件"""
+    global _exporter
+    exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.close()
+
+
+def flush_tracing() -> None:
+    if _exporter is not None:
+        _exporter.flush()
+
+
+def export_chrome_trace(jsonl_path: str, output_path: str) -> int:
+    """把JSON Lines格式的span文件转换为Chrome Trace JSON，返回事件数"""
+    events = []
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                events.append(json.loads(line))
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    return len(events)
+
+
+atexit.register(disable_tracing)
+
+if os.environ.get("NOVEL_TRACE_FILE"):
+    enable_tracing(os.environ["NOVEL_TRACE_FILE"])
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        print("用法: python tracing.py trace.jsonl trace.json")
+        sys.exit(1)
+    count = export_chrome_trace(sys.argv[1], sys.argv[2])
+    print(f"已导出 {count} 个span到 {sys.argv[2]}，可在 chrome://tracing 或 ui.perfetto.dev 中打开")
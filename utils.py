@@ -1,12 +1,26 @@
 # utils.py
 # -*- coding: utf-8 -*-
 import os
+import tempfile
+import contextvars
+from contextlib import contextmanager
+from tracing import span
+
+# deferred_fsync() 块内延迟fsync的目录列表，None表示每次写入后立即fsync目录
+_deferred_fsync_paths: contextvars.ContextVar = contextvars.ContextVar("deferred_fsync_paths", default=None)
+
+# 新建文件的默认权限；os.umask只能"设置并返回旧值"，会短暂修改全进程的umask，
+# 因此只在导入时读取一次，不在线程池任务中调用
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 def read_file(filename: str) -> str:
     """读取文件的全部内容，若文件不存在或异常则返回空字符串。"""
     try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            content = file.read()
+        with span("file.read", path=filename) as sp:
+            with open(filename, 'r', encoding='utf-8') as file:
+                content = file.read()
+            sp.set_attribute("chars", len(content))
         return content
     except FileNotFoundError:
         return ""
@@ -22,12 +36,73 @@ def clear_file_content(filename: str):
     except IOError as e:
         print(f"[clear_file_content] 无法清空文件 '{filename}' 的内容：{e}")
 
-def save_string_to_txt(content: str, filename: str):
-    """将字符串保存为 txt 文件（覆盖写）。"""
+def _fsync_path(path: str):
+    """对文件或目录执行fsync（目录fsync用于持久化rename，Windows上不支持时忽略）"""
     try:
-        with open(filename, 'w', encoding='utf-8') as file:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def atomic_write(filename: str, content: str, fsync: bool = True):
+    """
+    原子写入：先写入同目录下的临时文件并fsync，再用os.replace替换目标文件。
+    任何时刻目标文件要么是旧内容要么是新内容，进程崩溃不会留下空文件或半截文件。
+    临时文件总是在rename之前fsync；在 deferred_fsync() 块内时只把持久化rename所需的目录fsync推迟到块结束统一执行。
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(filename)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
             file.write(content)
-    except Exception as e:
-        print(f"[save_string_to_txt] 保存文件时发生错误: {e}")
+            file.flush()
+            if fsync:
+                os.fsync(file.fileno())
+        # 保留原文件的权限（mkstemp创建的临时文件权限为0600）
+        try:
+            os.chmod(tmp_path, os.stat(filename).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if fsync:
+        deferred = _deferred_fsync_paths.get()
+        if deferred is None:
+            _fsync_path(directory)
+        else:
+            deferred.append(directory)
 
+@contextmanager
+def deferred_fsync():
+    """
+    批量写入：块内的 atomic_write/save_string_to_txt 照常在rename前fsync各自的临时文件，
+    只把目录的fsync推迟到退出时，每个涉及的目录只fsync一次。
+    """
+    if _deferred_fsync_paths.get() is not None:
+        # 已在外层批量块中，由外层统一fsync
+        yield
+        return
+    directories = []
+    token = _deferred_fsync_paths.set(directories)
+    try:
+        yield
+    finally:
+        _deferred_fsync_paths.reset(token)
+        for directory in dict.fromkeys(directories):
+            _fsync_path(directory)
 
+def save_string_to_txt(content: str, filename: str, fsync: bool = True):
+    """将字符串保存为 txt 文件（原子覆盖写，无需先调用 clear_file_content）。"""
+    try:
+        with span("file.write", path=filename, chars=len(content)):
+            atomic_write(filename, content, fsync=fsync)
+    except Exception as e:
+        print(f"[save_string_to_txt] 保存文件时发生错误: {e}")